@@ -0,0 +1,385 @@
+"""
+Generic array placement: a pattern generator lays out the cells, and a routing
+template describes the copper for one cell relative to its centre. The template
+is stamped onto every cell at once with NumPy and the result is a BowtieLayout,
+ready for M0WUTPcbHandler.apply_layout or the headless writer.
+"""
+
+from dataclasses import dataclass, fields
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from bowtie_layout import (
+    BowtieIndex,
+    BowtieLayout,
+    BowtieSpec,
+    Placements,
+    Segments,
+    Vias,
+    halve_nm,
+    mm_to_nm,
+    rotate_nm,
+    round_nm,
+)
+from kicad_layer import KicadLayer
+
+
+@dataclass
+class Cells:
+    x: np.ndarray  # nm
+    y: np.ndarray  # nm
+    rotation: np.ndarray  # Degrees, anticlockwise as shown in Kicad
+    col: np.ndarray  # Column, or ring for polar patterns
+    row: np.ndarray  # Position within the column or ring
+
+    def __len__(self):
+        return len(self.x)
+
+
+def _cells(x_nm, y_nm, rotation, col, row) -> Cells:
+    count = len(x_nm)
+    return Cells(
+        x=np.asarray(x_nm, dtype=np.int64),
+        y=np.asarray(y_nm, dtype=np.int64),
+        rotation=np.broadcast_to(np.asarray(rotation, dtype=np.float64), count).copy(),
+        col=np.asarray(col, dtype=np.int64),
+        row=np.asarray(row, dtype=np.int64),
+    )
+
+
+def grid_pattern(
+    cols: int,
+    rows: int,
+    pitch_x_mm: float,
+    pitch_y_mm: float,
+    origin_x_mm: float = 0.0,
+    origin_y_mm: float = 0.0,
+) -> Cells:
+    # Column by column, starting at the origin
+    col, row = np.divmod(np.arange(cols * rows), rows)
+    return _cells(
+        mm_to_nm(origin_x_mm) + col * mm_to_nm(pitch_x_mm),
+        mm_to_nm(origin_y_mm) + row * mm_to_nm(pitch_y_mm),
+        0.0,
+        col,
+        row,
+    )
+
+
+def hex_pattern(
+    cols: int,
+    rows: int,
+    pitch_mm: float,
+    origin_x_mm: float = 0.0,
+    origin_y_mm: float = 0.0,
+) -> Cells:
+    # Every other column is shifted down by half a pitch, with the columns
+    # closer together so all neighbours are pitch_mm apart
+    col, row = np.divmod(np.arange(cols * rows), rows)
+    pitch_nm = int(mm_to_nm(pitch_mm))
+    col_pitch_nm = pitch_nm * np.sqrt(3) / 2
+    return _cells(
+        mm_to_nm(origin_x_mm) + round_nm(col * col_pitch_nm),
+        mm_to_nm(origin_y_mm) + row * pitch_nm + (col % 2) * halve_nm(pitch_nm),
+        0.0,
+        col,
+        row,
+    )
+
+
+def polar_pattern(
+    ring_counts: Sequence[int],
+    ring_pitch_mm: float,
+    centre_x_mm: float = 0.0,
+    centre_y_mm: float = 0.0,
+    inner_radius_mm: Optional[float] = None,
+    start_angle_deg: float = 0.0,
+    rotate_cells: bool = True,
+) -> Cells:
+    """
+    Concentric rings of evenly spaced cells, ring_counts[n] on ring n. Rings
+    start at inner_radius_mm (default: one ring pitch) and are ring_pitch_mm
+    apart. With rotate_cells, every cell is turned to face outwards.
+    """
+    ring_counts = np.asarray(ring_counts, dtype=np.int64)
+    if inner_radius_mm is None:
+        inner_radius_mm = ring_pitch_mm
+
+    ring = np.repeat(np.arange(len(ring_counts)), ring_counts)
+    position = np.arange(len(ring)) - np.repeat(
+        np.cumsum(ring_counts) - ring_counts, ring_counts
+    )
+    angle_deg = start_angle_deg + 360 * position / ring_counts[ring]
+    radius_nm = mm_to_nm(inner_radius_mm) + ring * mm_to_nm(ring_pitch_mm)
+
+    # Kicad's Y axis points down, so anticlockwise is negative Y
+    angle = np.radians(angle_deg)
+    return _cells(
+        mm_to_nm(centre_x_mm) + round_nm(radius_nm * np.cos(angle)),
+        mm_to_nm(centre_y_mm) - round_nm(radius_nm * np.sin(angle)),
+        angle_deg % 360 if rotate_cells else 0.0,
+        ring,
+        position,
+    )
+
+
+def circle_pattern(
+    count: int,
+    radius_mm: float,
+    centre_x_mm: float = 0.0,
+    centre_y_mm: float = 0.0,
+    start_angle_deg: float = 0.0,
+    rotate_cells: bool = True,
+) -> Cells:
+    return polar_pattern(
+        [count],
+        radius_mm,
+        centre_x_mm,
+        centre_y_mm,
+        inner_radius_mm=radius_mm,
+        start_angle_deg=start_angle_deg,
+        rotate_cells=rotate_cells,
+    )
+
+
+def bowtie_pattern(spec: BowtieSpec = BowtieSpec()) -> Cells:
+    index = BowtieIndex.from_spec(spec)
+    col, row = index.get_column_row(np.arange(len(index)))
+    x_nm, y_nm = index.get_position_nm(col, row)
+    return _cells(x_nm, y_nm, 0.0, col, row)
+
+
+@dataclass(frozen=True)
+class TemplateSegment:
+    # Relative to the cell centre, in mm, before the cell is rotated
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    width: float
+    layer: KicadLayer
+    net_name: str
+
+
+@dataclass(frozen=True)
+class TemplateVia:
+    x: float
+    y: float
+    drill: float
+    pad: float
+    net_name: str
+
+
+@dataclass(frozen=True)
+class RoutingTemplate:
+    segments: tuple[TemplateSegment, ...] = ()
+    vias: tuple[TemplateVia, ...] = ()
+
+
+@dataclass(frozen=True)
+class RowVariants:
+    # Different routing for the first and last cell in each column (or ring),
+    # e.g. as there is nothing below the first cell to link to. Both default to
+    # the middle template and a cell on its own counts as the first
+    middle: RoutingTemplate
+    first: Optional[RoutingTemplate] = None
+    last: Optional[RoutingTemplate] = None
+
+    def get_cell_templates(
+        self, cells: Cells
+    ) -> list[tuple[RoutingTemplate, np.ndarray]]:
+        last_rows = np.zeros(int(cells.col.max(initial=-1)) + 1, dtype=np.int64)
+        np.maximum.at(last_rows, cells.col, cells.row)
+
+        is_first = cells.row == 0
+        is_last = ~is_first & (cells.row == last_rows[cells.col])
+        is_middle = ~is_first & ~is_last
+        return [
+            (self.first or self.middle, is_first),
+            (self.middle, is_middle),
+            (self.last or self.middle, is_last),
+        ]
+
+
+Routing = Union[RoutingTemplate, RowVariants]
+
+
+def bowtie_template(spec: BowtieSpec = BowtieSpec()) -> RowVariants:
+    track_width = spec.track_width
+    net_name = spec.power_net_name
+
+    # Bottom left pad i.e. negative X, positive Y
+    # This goes down to a via which connects to the power plane track on L3
+    via_x = -spec.led_pad_offset_x
+    via_y = spec.row_spacing / 2
+    power = RoutingTemplate(
+        segments=(
+            TemplateSegment(
+                via_x,
+                spec.led_pad_offset_y,
+                via_x,
+                via_y,
+                track_width,
+                KicadLayer.TOP,
+                net_name,
+            ),
+            TemplateSegment(
+                via_x,
+                via_y,
+                via_x + spec.column_spacing,
+                via_y,
+                spec.power_track_width,
+                KicadLayer.L3,
+                net_name,
+            ),
+        ),
+        vias=(TemplateVia(via_x, via_y, spec.via_hole, spec.via_diameter, net_name),),
+    )
+
+    # Every LED apart from the bottom one in each column links to the one below
+    # with a three leg dog-leg from each of these pads
+    links = []
+    pad_offset_x = spec.led_pad_offset_x
+    pad_offset_y = spec.led_pad_offset_y
+    for pad_x, pad_y, direction in [
+        # Top right pad, goes up and to the left
+        (pad_offset_x, -pad_offset_y, -1),
+        # Top left pad, goes up and to the right
+        (-pad_offset_x, -pad_offset_y, 1),
+        # Bottom right pad, goes up and to the right
+        (pad_offset_x, pad_offset_y, 1),
+    ]:
+        vertex_x = pad_x + direction * spec.led_pad_track_vertex_offset_x
+        vertex_offset_y = spec.led_pad_track_vertex_offset_y
+        points = [
+            (pad_x, pad_y),
+            (vertex_x, pad_y + vertex_offset_y),
+            (vertex_x, pad_y + spec.row_spacing - vertex_offset_y),
+            (pad_x, pad_y + spec.row_spacing),
+        ]
+        for start, end in zip(points, points[1:]):
+            links.append(
+                TemplateSegment(*start, *end, track_width, KicadLayer.TOP, net_name)
+            )
+
+    linked = RoutingTemplate(segments=power.segments + tuple(links), vias=power.vias)
+    return RowVariants(middle=linked, first=power)
+
+
+def _transform(
+    cells: Cells, x_nm: np.ndarray, y_nm: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    # (template items, cells) arrays of every template point on every cell
+    x_nm, y_nm = rotate_nm(x_nm[:, None], y_nm[:, None], cells.rotation)
+    return cells.x + x_nm, cells.y + y_nm
+
+
+def _concatenate(parts: list, cls):
+    return cls(
+        **{
+            x.name: np.concatenate([getattr(part, x.name) for part in parts])
+            for x in fields(cls)
+        }
+    )
+
+
+def stamp_template(
+    cells: Cells, template: Routing, nets: list[str]
+) -> tuple[Segments, Vias]:
+    """
+    Copy the template onto every cell. Net names not already in nets are
+    appended to it. Items are ordered template item first, then cell, and are
+    owned by the cell they were stamped on. Row variants are stamped one after
+    another, first row cells first.
+    """
+    if isinstance(template, RoutingTemplate):
+        return _stamp_cells(cells, np.arange(len(cells)), template, nets)
+
+    # Each variant is stamped onto its own cells
+    stamped = []
+    for variant, mask in template.get_cell_templates(cells):
+        subset = Cells(**{x.name: getattr(cells, x.name)[mask] for x in fields(Cells)})
+        stamped.append(_stamp_cells(subset, np.flatnonzero(mask), variant, nets))
+    return (
+        _concatenate([x[0] for x in stamped], Segments),
+        _concatenate([x[1] for x in stamped], Vias),
+    )
+
+
+def _stamp_cells(
+    cells: Cells, led: np.ndarray, template: RoutingTemplate, nets: list[str]
+) -> tuple[Segments, Vias]:
+    for item in template.segments + template.vias:
+        if item.net_name not in nets:
+            nets.append(item.net_name)
+
+    def template_nm(items, name: str) -> np.ndarray:
+        return mm_to_nm(np.array([getattr(x, name) for x in items], dtype=float))
+
+    def template_nets(items) -> np.ndarray:
+        return np.array([nets.index(x.net_name) for x in items], dtype=np.int64)
+
+    def repeat(values: np.ndarray) -> np.ndarray:
+        return np.repeat(values, len(cells))
+
+    segments = template.segments
+    x0, y0 = _transform(
+        cells, template_nm(segments, "x0"), template_nm(segments, "y0")
+    )
+    x1, y1 = _transform(
+        cells, template_nm(segments, "x1"), template_nm(segments, "y1")
+    )
+    stamped_segments = Segments(
+        x0=x0.reshape(-1),
+        y0=y0.reshape(-1),
+        x1=x1.reshape(-1),
+        y1=y1.reshape(-1),
+        width=repeat(template_nm(segments, "width")),
+        layer=repeat(np.array([x.layer.value for x in segments], dtype=np.int64)),
+        net=repeat(template_nets(segments)),
+        led=np.tile(led, len(segments)),
+    )
+
+    vias = template.vias
+    x, y = _transform(cells, template_nm(vias, "x"), template_nm(vias, "y"))
+    stamped_vias = Vias(
+        x=x.reshape(-1),
+        y=y.reshape(-1),
+        drill=repeat(template_nm(vias, "drill")),
+        pad=repeat(template_nm(vias, "pad")),
+        net=repeat(template_nets(vias)),
+        led=np.tile(led, len(vias)),
+    )
+    return stamped_segments, stamped_vias
+
+
+def get_default_refs(count: int, prefix: str = "LD", first: int = 1) -> np.ndarray:
+    return np.char.add(prefix, np.arange(first, first + count).astype(str))
+
+
+def plan_array(
+    cells: Cells,
+    template: Routing,
+    refs: Optional[Sequence[str]] = None,
+    layer: KicadLayer = KicadLayer.TOP,
+    nets: Sequence[str] = (),
+) -> BowtieLayout:
+    # refs[n] is placed on cells[n], LD1, LD2... if not given
+    refs = get_default_refs(len(cells)) if refs is None else np.asarray(refs)
+    assert len(refs) == len(cells), f"{len(refs)} references for {len(cells)} cells"
+
+    net_names = list(nets)
+    segments, vias = stamp_template(cells, template, net_names)
+    return BowtieLayout(
+        nets=tuple(net_names),
+        placements=Placements(
+            refs=refs,
+            x=cells.x,
+            y=cells.y,
+            rotation=cells.rotation,
+            layer=np.full(len(cells), layer.value),
+        ),
+        segments=segments,
+        vias=vias,
+    )
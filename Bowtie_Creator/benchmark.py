@@ -0,0 +1,285 @@
+"""
+Scaling benchmarks for the bowtie generator.
+
+By default this runs against fake_pcbnew so it works headless, e.g. on Linux CI,
+with a per-call latency to mimic SWIG. Run with --real from Kicad's
+Python to time the same operations against pcbnew and compare.
+
+    python benchmark.py --sizes 1000 10000 100000 --json out.json
+"""
+
+import argparse
+import json
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Optional
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Without latency a fake call costs next to nothing, so anything that saves
+# pcbnew calls, like building tracks by duplicating, doesn't show up in the times
+DEFAULT_LATENCY_US = 1.0
+
+
+@dataclass
+class BenchmarkResult:
+    backend: str
+    num_leds: int
+    operation: str
+    elapsed_s: float
+    pcbnew_calls: Optional[int]
+    # Set for operations where the cost per item is what matters
+    num_items: Optional[int] = None
+
+    @property
+    def per_item_us(self) -> Optional[float]:
+        if not self.num_items:
+            return None
+        return 1e6 * self.elapsed_s / self.num_items
+
+    def __repr__(self):
+        calls = "" if self.pcbnew_calls is None else f"{self.pcbnew_calls:>10}"
+        per_item = (
+            "" if self.per_item_us is None else f" {self.per_item_us:>8.3f}us/item"
+        )
+        return (
+            f"{self.backend:<5} {self.num_leds:>8} {self.operation:<28} "
+            f"{self.elapsed_s:>10.4f}s {calls}{per_item}"
+        )
+
+
+def spec_for_led_count(num_leds: int):
+    from bowtie_layout import BowtieSpec, get_column_sizes
+
+    # Scale the default bowtie in both directions, keeping its shape, until it
+    # holds at least the requested number of LEDs
+    default_spec = BowtieSpec()
+
+    def scaled(scale: float) -> BowtieSpec:
+        # Columns hold an even number of LEDs so the taper stays symmetrical
+        start_column_size = 2 * round(default_spec.start_column_size * scale / 2)
+        return replace(
+            default_spec,
+            num_cols=max(1, round(default_spec.num_cols * scale)),
+            start_column_size=max(2, start_column_size),
+            num_centre_cols=max(1, round(default_spec.num_centre_cols * scale)),
+        )
+
+    low, high = 0.01, 1.0
+    while int(get_column_sizes(scaled(high)).sum()) < num_leds:
+        high *= 2
+    for _ in range(40):
+        middle = (low + high) / 2
+        if int(get_column_sizes(scaled(middle)).sum()) < num_leds:
+            low = middle
+        else:
+            high = middle
+    return scaled(high)
+
+
+def build_board(num_leds: int, net_names: tuple[str, ...]):
+    import pcbnew
+
+    from bowtie_layout import LED_PAD_OFFSET_X, LED_PAD_OFFSET_Y
+
+    # Four corner pads, like the LEDs the bowtie was drawn for. The pads the
+    # routing links up the columns are on nets of their own, the bottom left
+    # pad is the one wired to power
+    power_net_name, ground_net_name = net_names[:2]
+    pads = [
+        (-LED_PAD_OFFSET_X, -LED_PAD_OFFSET_Y, "LED_DIN"),
+        (LED_PAD_OFFSET_X, -LED_PAD_OFFSET_Y, ground_net_name),
+        (LED_PAD_OFFSET_X, LED_PAD_OFFSET_Y, "LED_DOUT"),
+        (-LED_PAD_OFFSET_X, LED_PAD_OFFSET_Y, power_net_name),
+    ]
+    pad_size = pcbnew.VECTOR2I(pcbnew.FromMM(0.6), pcbnew.FromMM(0.5))
+
+    board = pcbnew.BOARD()
+    for net_name in dict.fromkeys((*net_names, "LED_DIN", "LED_DOUT")):
+        board.Add(pcbnew.NETINFO_ITEM(board, net_name))
+    for index in range(1, num_leds + 1):
+        footprint = pcbnew.FOOTPRINT(board)
+        footprint.SetReference(f"LD{index}")
+        footprint.SetFPIDAsString("LED_SMD:LED_WS2812B-2020_PLCC4_2.0x2.0mm")
+        for number, (x_mm, y_mm, net_name) in enumerate(pads, 1):
+            pad = pcbnew.PAD(footprint)
+            pad.SetNumber(str(number))
+            pad.SetFPRelativePosition(
+                pcbnew.VECTOR2I(pcbnew.FromMM(x_mm), pcbnew.FromMM(y_mm))
+            )
+            pad.SetSize(pad_size)
+            pad.SetNet(board.FindNet(net_name))
+            footprint.Add(pad)
+        board.Add(footprint)
+    return board
+
+
+def _get_segment_rows(layout) -> list[tuple]:
+    segments = layout.segments
+    return list(
+        zip(
+            segments.x0.tolist(),
+            segments.y0.tolist(),
+            segments.x1.tolist(),
+            segments.y1.tolist(),
+            segments.width.tolist(),
+            segments.layer.tolist(),
+            segments.net.tolist(),
+        )
+    )
+
+
+def construct_tracks(board, layout, nets) -> list:
+    import pcbnew
+
+    from kicad_layer import KicadLayer
+
+    # How tracks were built before ItemFactory, kept as the baseline
+    tracks = []
+    for x0, y0, x1, y1, width, layer, net in _get_segment_rows(layout):
+        track = pcbnew.PCB_TRACK(board)
+        track.SetStartEnd(pcbnew.VECTOR2I(x0, y0), pcbnew.VECTOR2I(x1, y1))
+        track.SetWidth(width)
+        track.SetLayer(KicadLayer(layer).get_layer_code())
+        track.SetNetCode(nets[net].get_net_code())
+        tracks.append(track)
+    return tracks
+
+
+def duplicate_tracks(board, layout, nets) -> list:
+    from bowtie_creator import ItemFactory
+    from kicad_layer import KicadLayer
+
+    factory = ItemFactory(board)
+    return [
+        factory.make_track(x0, y0, x1, y1, width, KicadLayer(layer), nets[net])
+        for x0, y0, x1, y1, width, layer, net in _get_segment_rows(layout)
+    ]
+
+
+def run_benchmarks(sizes: list[int], backend: str) -> list[BenchmarkResult]:
+    import pcbnew
+
+    from bowtie_creator import M0WUTPcbHandler, create_bowtie
+    from bowtie_layout import get_column_sizes, plan_bowtie
+    from layout_optimiser import optimise_layout
+
+    results = []
+
+    def timed(
+        num_leds: int,
+        operation: str,
+        function: Callable,
+        num_items: Optional[int] = None,
+    ):
+        call_counts = getattr(pcbnew, "call_counts", None)
+        if call_counts is not None:
+            call_counts.clear()
+        start_time = perf_counter()
+        ret = function()
+        elapsed_s = perf_counter() - start_time
+        result = BenchmarkResult(
+            backend,
+            num_leds,
+            operation,
+            elapsed_s,
+            None if call_counts is None else sum(call_counts.values()),
+            num_items,
+        )
+        print(result, flush=True)
+        results.append(result)
+        return ret
+
+    for requested_leds in sizes:
+        spec = spec_for_led_count(requested_leds)
+        num_leds = int(get_column_sizes(spec).sum())
+        nets = (spec.power_net_name, spec.ground_net_name)
+
+        layout = timed(num_leds, "plan", lambda: plan_bowtie(spec))
+        layout = timed(num_leds, "optimise", lambda: optimise_layout(layout))
+
+        board = build_board(num_leds, nets)
+        handler = M0WUTPcbHandler(board)
+        refs = layout.placements.refs.tolist()
+        timed(
+            num_leds,
+            "get_component (all LEDs)",
+            lambda: [handler.get_component(x) for x in refs],
+        )
+
+        # Building the items is separate from adding them to the board, so time
+        # just that, the old way and from prototypes
+        layout_nets = [handler.get_net(x) for x in layout.nets]
+        num_segments = len(layout.segments)
+        timed(
+            num_leds,
+            "build tracks (constructed)",
+            lambda: construct_tracks(board, layout, layout_nets),
+            num_segments,
+        )
+        timed(
+            num_leds,
+            "build tracks (duplicated)",
+            lambda: duplicate_tracks(board, layout, layout_nets),
+            num_segments,
+        )
+
+        timed(num_leds, "apply_layout", lambda: handler.apply_layout(layout))
+        timed(num_leds, "remove_items (all)", handler.delete_all_tracks_and_vias)
+
+        timed(
+            num_leds,
+            "differential (empty board)",
+            lambda: handler.apply_layout_differential(layout),
+        )
+        timed(
+            num_leds,
+            "differential (unchanged)",
+            lambda: handler.apply_layout_differential(layout),
+        )
+
+        board = build_board(num_leds, nets)
+        # Kept out of the plan cache, which would otherwise fill up with
+        # benchmark sizes and evict the user's own plans
+        timed(
+            num_leds,
+            "create_bowtie",
+            lambda: create_bowtie(board, spec, plan_cache_dir=None),
+        )
+
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--latency-us",
+        type=float,
+        default=DEFAULT_LATENCY_US,
+        help="Latency added to every fake pcbnew call, to mimic SWIG",
+    )
+    parser.add_argument(
+        "--real", action="store_true", help="Use Kicad's pcbnew instead of the fake"
+    )
+    parser.add_argument("--json", type=Path, help="Also write results to this file")
+    args = parser.parse_args(argv)
+
+    if args.real:
+        backend = "real"
+    else:
+        import fake_pcbnew
+
+        fake_pcbnew.install()
+        fake_pcbnew.set_latency(args.latency_us * 1e-6)
+        backend = "fake"
+
+    results = run_benchmarks(args.sizes, backend)
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump([asdict(x) for x in results], file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,58 @@
-from dataclasses import dataclass
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from enum import Enum, auto
-from time import sleep
-from typing import Optional
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
 
 import pcbnew
 
+from array_placement import Cells, RoutingTemplate, get_default_refs, plan_array
+from bowtie_layout import BowtieIndex, BowtieLayout, BowtieSpec
+from clearance import DEFAULT_CLEARANCE_MM, check_clearance, get_violating_refs
+from kicad_layer import KicadLayer
+from layout_optimiser import get_merged_leds, optimise_layout
+from layout_manifest import (
+    ItemKey,
+    ManifestEntry,
+    get_owner_group_name,
+    get_owner_ref,
+    get_planned_keys,
+    make_track_key,
+    make_via_key,
+)
+from pad_geometry import get_led_pad_spec, get_led_pads, get_pad_geometry
+from panelise import PanelCopy, panelise_layout
+from plan_cache import PLAN_CACHE_DIR, get_layout
+from stitching import Keepout, add_stitching
 
-class KicadLayer(Enum):
-    TOP = auto()
-    L2 = auto()
-    L3 = auto()
-    L4 = auto()
-    L5 = auto()
-    L6 = auto()
-    L7 = auto()
-    L8 = auto()
-    L9 = auto()
-    BOTTOM = auto()
-
-    def get_layer_code(self) -> int:
-        layer_codes = {
-            KicadLayer.TOP: pcbnew.F_Cu,
-            KicadLayer.L2: pcbnew.In1_Cu,
-            KicadLayer.L3: pcbnew.In2_Cu,
-            KicadLayer.L4: pcbnew.In3_Cu,
-            KicadLayer.L5: pcbnew.In4_Cu,
-            KicadLayer.L6: pcbnew.In5_Cu,
-            KicadLayer.L7: pcbnew.In6_Cu,
-            KicadLayer.L8: pcbnew.In7_Cu,
-            KicadLayer.L9: pcbnew.In8_Cu,
-            KicadLayer.BOTTOM: pcbnew.B_Cu,
+
+class TrackItemType(Enum):
+    TRACK = auto()
+    ARC = auto()
+    VIA = auto()
+
+    def get_type_code(self) -> int:
+        type_codes = {
+            TrackItemType.TRACK: pcbnew.PCB_TRACE_T,
+            TrackItemType.ARC: pcbnew.PCB_ARC_T,
+            TrackItemType.VIA: pcbnew.PCB_VIA_T,
         }
-        return layer_codes[self]
+        return type_codes[self]
 
 
 class Net:
-    def __init__(self, net_name: str, net_code: int):
+    def __init__(
+        self,
+        net_name: str,
+        net_code: int,
+        netinfo: Optional[pcbnew.NETINFO_ITEM] = None,
+    ):
         self._net_name = net_name
         self._net_code = net_code
+        self._netinfo = netinfo
 
     def __repr__(self):
         return f"{self._net_name} (Code: {self._net_code})"
@@ -45,6 +60,13 @@ class Net:
     def get_net_code(self) -> int:
         return self._net_code
 
+    def assign_to(self, item: pcbnew.BOARD_ITEM) -> None:
+        # Handing over the NETINFO_ITEM saves Kicad looking the code up each time
+        if self._netinfo is not None:
+            item.SetNet(self._netinfo)
+        else:
+            item.SetNetCode(self._net_code)
+
 
 class Component:
     def __init__(self, footprint: pcbnew.FOOTPRINT):
@@ -57,6 +79,17 @@ class Component:
         layer: KicadLayer,
         rotation_deg: Optional[float] = None,
     ):
+        self.set_position_nm(
+            pcbnew.FromMM(x_pos_mm), pcbnew.FromMM(y_pos_mm), layer, rotation_deg
+        )
+
+    def set_position_nm(
+        self,
+        x_pos_nm: int,
+        y_pos_nm: int,
+        layer: KicadLayer,
+        rotation_deg: Optional[float] = None,
+    ):
 
         assert layer in [
             KicadLayer.TOP,
@@ -65,12 +98,28 @@ class Component:
 
         self.footprint.SetLayerAndFlip(layer.get_layer_code())
 
-        self.footprint.SetX(pcbnew.FromMM(x_pos_mm))
-        self.footprint.SetY(pcbnew.FromMM(y_pos_mm))
+        self.footprint.SetPosition(pcbnew.VECTOR2I(x_pos_nm, y_pos_nm))
         if rotation_deg is not None:
             # Function requires angle to be 0 <= angle < 360
             self.footprint.SetOrientationDegrees((rotation_deg + 360) % 360)
 
+    def get_placement(self) -> tuple[pcbnew.VECTOR2I, int, float]:
+        return (
+            self.footprint.GetPosition(),
+            self.footprint.GetLayer(),
+            self.footprint.GetOrientationDegrees(),
+        )
+
+    def restore_placement(self, placement: tuple[pcbnew.VECTOR2I, int, float]):
+        position, layer_code, orientation_deg = placement
+        if self.footprint.GetLayer() != layer_code:
+            self.footprint.SetLayerAndFlip(layer_code)
+        self.footprint.SetPosition(position)
+        self.footprint.SetOrientationDegrees(orientation_deg)
+
+    def is_reference_visible(self) -> bool:
+        return self.footprint.Reference().IsVisible()
+
     def _set_reference_visible_state(self, visible: bool):
         self.footprint.Reference().SetVisible(visible)
 
@@ -81,28 +130,193 @@ class Component:
         self._set_reference_visible_state(False)
 
 
-NUM_COLS = 19
-START_COLUMN_SIZE = 26
+class ItemFactory:
+    """
+    Makes tracks and vias by duplicating a fully configured prototype.
+
+    There is one prototype per (type, width, layer, net), so every new item
+    only needs its position setting rather than a constructor call and a
+    setter for each property.
+    """
+
+    def __init__(self, pcb: pcbnew.BOARD):
+        self.pcb = pcb
+        self._prototypes: dict[tuple, pcbnew.BOARD_ITEM] = {}
+
+    def clear(self) -> None:
+        self._prototypes.clear()
+
+    def make_track(
+        self,
+        start_x_nm: int,
+        start_y_nm: int,
+        end_x_nm: int,
+        end_y_nm: int,
+        width_nm: int,
+        layer: KicadLayer,
+        net: Net,
+    ) -> pcbnew.PCB_TRACK:
+        key = ("track", width_nm, layer, net.get_net_code())
+        prototype = self._prototypes.get(key)
+        if prototype is None:
+            prototype = pcbnew.PCB_TRACK(self.pcb)
+            prototype.SetWidth(width_nm)
+            prototype.SetLayer(layer.get_layer_code())
+            net.assign_to(prototype)
+            self._prototypes[key] = prototype
+
+        # Duplicate gives the copy a fresh UUID
+        track = prototype.Duplicate().Cast()
+        track.SetStartEnd(
+            pcbnew.VECTOR2I(start_x_nm, start_y_nm),
+            pcbnew.VECTOR2I(end_x_nm, end_y_nm),
+        )
+        return track
+
+    def make_via(
+        self,
+        x_pos_nm: int,
+        y_pos_nm: int,
+        hole_diameter_nm: int,
+        pad_diameter_nm: int,
+        net: Net,
+    ) -> pcbnew.PCB_VIA:
+        key = ("via", hole_diameter_nm, pad_diameter_nm, net.get_net_code())
+        prototype = self._prototypes.get(key)
+        if prototype is None:
+            prototype = pcbnew.PCB_VIA(self.pcb)
+            prototype.SetDrill(hole_diameter_nm)
+            prototype.SetWidth(pad_diameter_nm)
+            net.assign_to(prototype)
+            self._prototypes[key] = prototype
+
+        via = prototype.Duplicate().Cast()
+        via.SetPosition(pcbnew.VECTOR2I(x_pos_nm, y_pos_nm))
+        return via
+
+
+logger = logging.getLogger(__name__)
+
+# Every phase of create_bowtie in the order they run
+PHASES = ("plan", "wipe", "place footprints", "add tracks", "add vias", "refresh")
+
+# Called with the current phase and how far through it the run is, from 0 to 1.
+# Returning False cancels the run
+ProgressCallback = Callable[[str, float], bool]
+
+
+class BowtieCancelled(Exception):
+    pass
+
+
+class _PhaseTracker:
+    def __init__(self, callback: Optional[ProgressCallback] = None):
+        self.callback = callback
+        self.phase_times: dict[str, float] = {}
+
+    @contextmanager
+    def phase(
+        self, name: str, start: float = 0.0, end: float = 1.0
+    ) -> Iterator[Callable[[int, int], None]]:
+        # start and end allow a phase to be split over more than one step, e.g.
+        # building items and then adding them to the board. Time spent in each
+        # step is added together
+        start_time = perf_counter()
+
+        def report(done: int, total: int) -> None:
+            # Only every 1% so the callback doesn't slow the loop down
+            if self.callback is None or (done % max(1, total // 100) and done != total):
+                return
+            fraction = start + (end - start) * done / max(1, total)
+            if not self.callback(name, fraction):
+                raise BowtieCancelled(f"Cancelled during {name}")
+
+        try:
+            report(0, 1)
+            yield report
+        finally:
+            self.phase_times[name] = (
+                self.phase_times.get(name, 0.0) + perf_counter() - start_time
+            )
+
+
+def format_phase_times(phase_times: dict[str, float]) -> str:
+    return ", ".join(
+        f"{x} {phase_times[x]:.3f}s" for x in PHASES if x in phase_times
+    )
+
+
+@dataclass
+class BatchStats:
+    tracks_added: int = 0
+    vias_added: int = 0
+    items_removed: int = 0
+    footprints_moved: int = 0
+    elapsed_s: float = 0.0
+    phase_times: dict[str, float] = field(default_factory=dict)
+
+    def __repr__(self):
+        return (
+            f"{self.tracks_added} tracks, {self.vias_added} vias, "
+            f"{self.items_removed} removals, "
+            f"{self.footprints_moved} footprints in {self.elapsed_s:.3f}s"
+        )
+
+
+@dataclass
+class DiffStats:
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    footprints_moved: int = 0
+    elapsed_s: float = 0.0
+    phase_times: dict[str, float] = field(default_factory=dict)
 
-NUM_CENTRE_COLS = 10
+    def __repr__(self):
+        return (
+            f"{self.added} added, {self.updated} updated, {self.removed} removed, "
+            f"{self.unchanged} unchanged, {self.footprints_moved} footprints moved "
+            f"in {self.elapsed_s:.3f}s"
+        )
 
-# Coordinates of Start LED (first one on bottom left on left side of bowtie)
-START_X = 97.75
-CENTRE_LINE_Y = 100
 
-COLUMN_SPACING = 2.3  # mm
-ROW_SPACING = 2.3  # mm
+@dataclass
+class RemovalStats:
+    removed: int = 0
+    elapsed_s: float = 0.0
 
-DEFAULT_TRACK_WIDTH_MM = 0.127
-DEFAULT_POWER_TRACK_WIDTH_MM = 0.5
+    def __repr__(self):
+        return f"{self.removed} items in {self.elapsed_s:.3f}s"
 
-VIA_DIAMETER = 0.45
-VIA_HOLE = 0.2
 
-LED_PAD_OFFSET_X = 0.65
-LED_PAD_OFFSET_Y = 0.4
-LED_PAD_TRACK_VERTEX_OFFSET_X = 0.5
-LED_PAD_TRACK_VERTEX_OFFSET_Y = 0.417
+@dataclass
+class _PendingBatch:
+    progress: _PhaseTracker
+    # Items are fully configured, including their net, but not yet attached to
+    # the board
+    tracks: list[pcbnew.BOARD_ITEM] = field(default_factory=list)
+    vias: list[pcbnew.BOARD_ITEM] = field(default_factory=list)
+    removals: list[pcbnew.BOARD_ITEM] = field(default_factory=list)
+    moves: list[tuple[Component, int, int, KicadLayer, Optional[float]]] = field(
+        default_factory=list
+    )
+    hidden_references: list[Component] = field(default_factory=list)
+    # (item, owner group name) for every item whose owner is being set
+    owners: list[tuple[pcbnew.BOARD_ITEM, str]] = field(default_factory=list)
+    # What has actually been done to the board so far, for rolling back
+    detached: list[pcbnew.BOARD_ITEM] = field(default_factory=list)
+    previous_placements: list[tuple[Component, tuple]] = field(default_factory=list)
+    previous_visibility: list[tuple[Component, bool]] = field(default_factory=list)
+    attached: list[pcbnew.BOARD_ITEM] = field(default_factory=list)
+    # (item, group it was in before)
+    regrouped: list[tuple[pcbnew.BOARD_ITEM, Optional[pcbnew.PCB_GROUP]]] = field(
+        default_factory=list
+    )
+    created_groups: list[pcbnew.PCB_GROUP] = field(default_factory=list)
+    removed_groups: list[pcbnew.PCB_GROUP] = field(default_factory=list)
+    # Reverses edits made to items already on the board while building the batch
+    undo: list[Callable[[], None]] = field(default_factory=list)
 
 
 @dataclass
@@ -113,6 +327,201 @@ class M0WUTPcbHandler:
     default_via_pad_mm: float = 0.45
     default_track_width_mm: float = 0.2
 
+    _batch: Optional[_PendingBatch] = field(default=None, init=False, repr=False)
+    _footprint_index: Optional[dict[str, pcbnew.FOOTPRINT]] = field(
+        default=None, init=False, repr=False
+    )
+    _nets: dict[str, Net] = field(default_factory=dict, init=False, repr=False)
+    _items: ItemFactory = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._items = ItemFactory(self.pcb)
+
+    @contextmanager
+    def batch(
+        self, progress: Optional[ProgressCallback] = None
+    ) -> Iterator[BatchStats]:
+        """
+        Collect every track, via, removal and footprint move made inside the block
+        and apply them to the board in one go when the block exits.
+
+        Connectivity is rebuilt and the view refreshed once for the whole batch.
+        If the block raises, or progress returns False, everything already done
+        to the board is undone. When run from an ActionPlugin, Kicad records the
+        whole batch as a single undo step.
+        """
+        assert self._batch is None, "Batches cannot be nested"
+        stats = BatchStats()
+        batch = _PendingBatch(_PhaseTracker(progress))
+        self._batch = batch
+        try:
+            yield stats
+            self._commit_batch(batch, stats)
+        except BaseException:
+            self._rollback_batch(batch)
+            raise
+        finally:
+            stats.phase_times = batch.progress.phase_times
+            self._batch = None
+
+    def _commit_batch(self, batch: _PendingBatch, stats: BatchStats) -> None:
+        start_time = perf_counter()
+        progress = batch.progress
+
+        # Bulk modes skip the per-item connectivity update, which is rebuilt
+        # once at the end instead. Older Kicad versions don't expose them.
+        add_mode = getattr(pcbnew, "ADD_MODE_BULK_APPEND", None)
+        remove_mode = getattr(pcbnew, "REMOVE_MODE_BULK", None)
+
+        with progress.phase("wipe", 0.5) as report:
+            for index, item in enumerate(batch.removals):
+                report(index, len(batch.removals))
+                group = item.GetParentGroup()
+                if group is not None:
+                    group.RemoveItem(item)
+                    batch.regrouped.append((item, group))
+                if remove_mode is None:
+                    self.pcb.Remove(item)
+                else:
+                    self.pcb.Remove(item, remove_mode)
+                batch.detached.append(item)
+
+        with progress.phase("place footprints", 0.5) as report:
+            for index, move in enumerate(batch.moves):
+                report(index, len(batch.moves))
+                component, x_pos_nm, y_pos_nm, layer, rotation_deg = move
+                batch.previous_placements.append(
+                    (component, component.get_placement())
+                )
+                component.set_position_nm(x_pos_nm, y_pos_nm, layer, rotation_deg)
+
+            for component in batch.hidden_references:
+                batch.previous_visibility.append(
+                    (component, component.is_reference_visible())
+                )
+                component.hide_reference()
+
+        for phase, items in (("add tracks", batch.tracks), ("add vias", batch.vias)):
+            with progress.phase(phase, 0.5) as report:
+                for index, item in enumerate(items):
+                    report(index, len(items))
+                    if add_mode is None:
+                        self.pcb.Add(item)
+                    else:
+                        self.pcb.Add(item, add_mode, True)
+                    batch.attached.append(item)
+
+        with progress.phase("refresh"):
+            self._commit_owners(batch)
+            self.pcb.BuildConnectivity()
+            pcbnew.Refresh()
+
+        stats.tracks_added = len(batch.tracks)
+        stats.vias_added = len(batch.vias)
+        stats.items_removed = len(batch.removals)
+        stats.footprints_moved = len(batch.moves)
+        stats.elapsed_s = perf_counter() - start_time
+        logger.info(f"Committed batch: {stats}")
+
+    def get_owner_groups(self) -> dict[str, pcbnew.PCB_GROUP]:
+        # Group name -> group, for every group made by the bowtie creator
+        return {
+            x.GetName(): x
+            for x in self.pcb.Groups()
+            if get_owner_ref(x.GetName()) is not None
+        }
+
+    def _commit_owners(self, batch: _PendingBatch) -> None:
+        groups = self.get_owner_groups()
+        for item, group_name in batch.owners:
+            group = groups.get(group_name)
+            if group is None:
+                group = pcbnew.PCB_GROUP(self.pcb)
+                group.SetName(group_name)
+                self.pcb.Add(group)
+                groups[group_name] = group
+                batch.created_groups.append(group)
+            previous = item.GetParentGroup()
+            if previous is not None and previous.GetName() == group_name:
+                continue
+            # Moves the item out of any group it was in
+            group.AddItem(item)
+            batch.regrouped.append((item, previous))
+
+        # Owners whose items have all gone
+        for group in groups.values():
+            if not group.GetItems():
+                self.pcb.Remove(group)
+                batch.removed_groups.append(group)
+
+    def _set_owner(self, item: pcbnew.BOARD_ITEM, ref: Optional[str]) -> None:
+        owner = (item, get_owner_group_name(ref))
+        if self._batch is not None:
+            self._batch.owners.append(owner)
+        else:
+            self._commit_owners(_PendingBatch(_PhaseTracker(None), owners=[owner]))
+
+    def _rollback_batch(self, batch: _PendingBatch) -> None:
+        # Undo in the opposite order to the commit
+        start_time = perf_counter()
+        add_mode = getattr(pcbnew, "ADD_MODE_BULK_APPEND", None)
+        remove_mode = getattr(pcbnew, "REMOVE_MODE_BULK", None)
+
+        for group in reversed(batch.removed_groups):
+            self.pcb.Add(group)
+        for item, previous in reversed(batch.regrouped):
+            group = item.GetParentGroup()
+            if group is not None:
+                group.RemoveItem(item)
+            if previous is not None:
+                previous.AddItem(item)
+        for group in reversed(batch.created_groups):
+            self.pcb.Remove(group)
+        for item in reversed(batch.attached):
+            if remove_mode is None:
+                self.pcb.Remove(item)
+            else:
+                self.pcb.Remove(item, remove_mode)
+        for component, visible in reversed(batch.previous_visibility):
+            component._set_reference_visible_state(visible)
+        for component, placement in reversed(batch.previous_placements):
+            component.restore_placement(placement)
+        for item in reversed(batch.detached):
+            if add_mode is None:
+                self.pcb.Add(item)
+            else:
+                self.pcb.Add(item, add_mode, True)
+        for undo in reversed(batch.undo):
+            undo()
+
+        changes = (
+            len(batch.regrouped)
+            + len(batch.attached)
+            + len(batch.previous_visibility)
+            + len(batch.previous_placements)
+            + len(batch.detached)
+            + len(batch.undo)
+        )
+        if changes:
+            self.pcb.BuildConnectivity()
+            pcbnew.Refresh()
+        logger.info(
+            f"Rolled back {changes} changes in {perf_counter() - start_time:.3f}s"
+        )
+
+    def _add_item(self, item: pcbnew.BOARD_ITEM, is_via: bool) -> None:
+        if self._batch is not None:
+            pending = self._batch.vias if is_via else self._batch.tracks
+            pending.append(item)
+        else:
+            self.pcb.Add(item)
+
+    def _remove_item(self, item: pcbnew.BOARD_ITEM) -> None:
+        if self._batch is not None:
+            self._batch.removals.append(item)
+        else:
+            self.pcb.Remove(item)
+
     # Function used from https://jeffmcbride.net/kicad-track-layout/
     @classmethod
     def _pcbpoint(cls, x: float, y: float) -> pcbnew.VECTOR2I:
@@ -125,27 +534,36 @@ class M0WUTPcbHandler:
         net: Net,
         hole_diameter_mm: Optional[float] = None,
         pad_diameter_mm: Optional[float] = None,
-    ):
-        new_via = pcbnew.PCB_VIA(self.pcb)
-
-        new_via.SetX(pcbnew.FromMM(x_pos_mm))
-        new_via.SetY(pcbnew.FromMM(y_pos_mm))
-        new_via.SetDrill(
-            pcbnew.FromMM(
-                hole_diameter_mm
-                if hole_diameter_mm is not None
-                else self.default_via_hole_mm
-            )
+    ) -> pcbnew.PCB_VIA:
+        return self.add_via_nm(
+            pcbnew.FromMM(x_pos_mm),
+            pcbnew.FromMM(y_pos_mm),
+            net,
+            pcbnew.FromMM(hole_diameter_mm) if hole_diameter_mm is not None else None,
+            pcbnew.FromMM(pad_diameter_mm) if pad_diameter_mm is not None else None,
         )
-        new_via.SetWidth(
-            pcbnew.FromMM(
-                pad_diameter_mm
-                if pad_diameter_mm is not None
-                else self.default_via_pad_mm
-            )
+
+    def add_via_nm(
+        self,
+        x_pos_nm: int,
+        y_pos_nm: int,
+        net: Net,
+        hole_diameter_nm: Optional[int] = None,
+        pad_diameter_nm: Optional[int] = None,
+    ) -> pcbnew.PCB_VIA:
+        new_via = self._items.make_via(
+            x_pos_nm,
+            y_pos_nm,
+            hole_diameter_nm
+            if hole_diameter_nm is not None
+            else pcbnew.FromMM(self.default_via_hole_mm),
+            pad_diameter_nm
+            if pad_diameter_nm is not None
+            else pcbnew.FromMM(self.default_via_pad_mm),
+            net,
         )
-        self.pcb.Add(new_via)
-        new_via.SetNetCode(net.get_net_code())
+        self._add_item(new_via, is_via=True)
+        return new_via
 
     def add_track(
         self,
@@ -156,22 +574,42 @@ class M0WUTPcbHandler:
         net: Net,
         layer: KicadLayer,
         width_mm: Optional[float] = None,
-    ):
-
-        new_track = pcbnew.PCB_TRACK(self.pcb)
-
-        new_track.SetStartEnd(
-            M0WUTPcbHandler._pcbpoint(start_x_mm, start_y_mm),
-            M0WUTPcbHandler._pcbpoint(end_x_mm, end_y_mm),
+    ) -> pcbnew.PCB_TRACK:
+        start = M0WUTPcbHandler._pcbpoint(start_x_mm, start_y_mm)
+        end = M0WUTPcbHandler._pcbpoint(end_x_mm, end_y_mm)
+        return self.add_track_nm(
+            start.x,
+            start.y,
+            end.x,
+            end.y,
+            net,
+            layer,
+            pcbnew.FromMM(width_mm) if width_mm is not None else None,
         )
-        new_track.SetWidth(
-            pcbnew.FromMM(width_mm)
-            if width_mm is not None
-            else pcbnew.FromMM(self.default_track_width_mm)
+
+    def add_track_nm(
+        self,
+        start_x_nm: int,
+        start_y_nm: int,
+        end_x_nm: int,
+        end_y_nm: int,
+        net: Net,
+        layer: KicadLayer,
+        width_nm: Optional[int] = None,
+    ) -> pcbnew.PCB_TRACK:
+        new_track = self._items.make_track(
+            start_x_nm,
+            start_y_nm,
+            end_x_nm,
+            end_y_nm,
+            width_nm
+            if width_nm is not None
+            else pcbnew.FromMM(self.default_track_width_mm),
+            layer,
+            net,
         )
-        new_track.SetLayer(layer.get_layer_code())
-        self.pcb.Add(new_track)
-        new_track.SetNetCode(net.get_net_code())
+        self._add_item(new_track, is_via=False)
+        return new_track
 
     def add_multipoint_track(
         self,
@@ -187,208 +625,632 @@ class M0WUTPcbHandler:
             end_y = points[index + 1][1]
             self.add_track(start_x, start_y, end_x, end_y, net, layer, width)
 
+    def move_component(
+        self,
+        component: Component,
+        x_pos_mm: float,
+        y_pos_mm: float,
+        layer: KicadLayer,
+        rotation_deg: Optional[float] = None,
+    ):
+        self.move_component_nm(
+            component,
+            pcbnew.FromMM(x_pos_mm),
+            pcbnew.FromMM(y_pos_mm),
+            layer,
+            rotation_deg,
+        )
+
+    def move_component_nm(
+        self,
+        component: Component,
+        x_pos_nm: int,
+        y_pos_nm: int,
+        layer: KicadLayer,
+        rotation_deg: Optional[float] = None,
+    ):
+        if self._batch is not None:
+            self._batch.moves.append(
+                (component, x_pos_nm, y_pos_nm, layer, rotation_deg)
+            )
+        else:
+            component.set_position_nm(x_pos_nm, y_pos_nm, layer, rotation_deg)
+
+    def hide_reference(self, component: Component) -> None:
+        if self._batch is not None:
+            self._batch.hidden_references.append(component)
+        else:
+            component.hide_reference()
+
+    def _build_footprint_index(self) -> dict[str, pcbnew.FOOTPRINT]:
+        # FindFootprintByReference is a linear scan over every footprint so
+        # build a lookup table in a single pass instead
+        self._footprint_index = {
+            footprint.GetReference(): footprint
+            for footprint in self.pcb.GetFootprints()
+        }
+        return self._footprint_index
+
+    def invalidate_footprint_index(self) -> None:
+        # Must be called if footprints are added, removed or re-annotated
+        # outside of this handler
+        self._footprint_index = None
+
     def get_component(self, component_reference: str) -> Optional[Component]:
-        x = self.pcb.FindFootprintByReference(component_reference)
+        index = self._footprint_index
+        if index is None:
+            index = self._build_footprint_index()
+
+        x = index.get(component_reference)
+        if x is None or x.GetReference() != component_reference:
+            # Index may be stale so rebuild once before giving up
+            x = self._build_footprint_index().get(component_reference)
+
         if x:
             return Component(x)
         else:
             return None
 
-    def delete_all_tracks(self) -> None:
-        tracks = self.pcb.GetTracks()
-        for t in tracks:
-            # This "helpfully returns all Tracks and Vias"
-            if t.GetClass() == "PCB_TRACK":
-                self.pcb.Delete(t)
-        sleep(1)
-        pcbnew.Refresh()
-        sleep(1)
+    def get_missing_references(self, references: Iterable[str]) -> list[str]:
+        index = self._build_footprint_index()
+        return [x for x in references if x not in index]
 
-    def delete_all_vias(self) -> None:
-        tracks = self.pcb.GetTracks()
-        for t in tracks:
-            if t.GetClass() == "PCB_VIA":
-                self.pcb.Remove(t)
-        pcbnew.Refresh()
+    def remove_items(
+        self,
+        nets: Optional[Iterable[Net]] = None,
+        layers: Optional[Iterable[KicadLayer]] = None,
+        item_types: Optional[Iterable[TrackItemType]] = None,
+        bounding_box_mm: Optional[tuple[float, float, float, float]] = None,
+    ) -> RemovalStats:
+        """
+        Remove every track, arc and via matching all of the supplied filters.
+
+        Filters left as None match everything. Layers match if the item is on
+        any of them, so a through via matches every copper layer. The bounding
+        box is (min_x, min_y, max_x, max_y) and items must lie entirely inside it.
+        """
+        start_time = perf_counter()
+
+        net_codes = None if nets is None else {x.get_net_code() for x in nets}
+        layer_codes = (
+            None if layers is None else [x.get_layer_code() for x in layers]
+        )
+        type_codes = (
+            None if item_types is None else {x.get_type_code() for x in item_types}
+        )
+        if bounding_box_mm is not None:
+            min_x, min_y, max_x, max_y = (pcbnew.FromMM(x) for x in bounding_box_mm)
+
+        # Pick everything out first, removing while iterating GetTracks() skips
+        # items
+        to_remove = []
+        for item in self.pcb.GetTracks():
+            if type_codes is not None and item.Type() not in type_codes:
+                continue
+            if net_codes is not None and item.GetNetCode() not in net_codes:
+                continue
+            if layer_codes is not None and not any(
+                item.IsOnLayer(x) for x in layer_codes
+            ):
+                continue
+            if bounding_box_mm is not None:
+                start = item.GetStart()
+                end = item.GetEnd()
+                if not (
+                    min_x <= min(start.x, end.x)
+                    and max(start.x, end.x) <= max_x
+                    and min_y <= min(start.y, end.y)
+                    and max(start.y, end.y) <= max_y
+                ):
+                    continue
+            to_remove.append(item)
 
-    def delete_all_tracks_and_vias(self) -> None:
-        tracks = self.pcb.GetTracks()
-        for t in tracks:
-            self.pcb.Remove(t)
+        if self._batch is not None:
+            # Removed along with everything else when the batch is committed
+            self._batch.removals += to_remove
+            stats = RemovalStats(len(to_remove), perf_counter() - start_time)
+            logger.info(f"Queued removal of {stats}")
+            return stats
+
+        # As with adding, bulk mode defers the connectivity update to one
+        # rebuild at the end
+        bulk_mode = getattr(pcbnew, "REMOVE_MODE_BULK", None)
+        for item in to_remove:
+            group = item.GetParentGroup()
+            if group is not None:
+                group.RemoveItem(item)
+            if bulk_mode is None:
+                self.pcb.Remove(item)
+            else:
+                self.pcb.Remove(item, bulk_mode)
+
+        if bulk_mode is not None and to_remove:
+            self.pcb.BuildConnectivity()
         pcbnew.Refresh()
 
+        stats = RemovalStats(len(to_remove), perf_counter() - start_time)
+        logger.info(f"Removed {stats}")
+        return stats
+
+    def delete_all_tracks(self) -> RemovalStats:
+        return self.remove_items(item_types=[TrackItemType.TRACK])
+
+    def delete_all_vias(self) -> RemovalStats:
+        return self.remove_items(item_types=[TrackItemType.VIA])
+
+    def delete_all_tracks_and_vias(self) -> RemovalStats:
+        return self.remove_items()
+
     def get_net(self, net_name: str) -> Optional[Net]:
+        # Nets are looked up once and the NETINFO_ITEM kept for assigning to items
+        net = self._nets.get(net_name)
+        if net is not None:
+            return net
+
         x = self.pcb.FindNet(net_name)
         if x:
-            return Net(net_name, x.GetNetCode())
+            net = Net(net_name, x.GetNetCode(), x)
+            self._nets[net_name] = net
+            return net
         else:
             return None
 
+    def invalidate_nets(self) -> None:
+        # Must be called if nets are added, removed or renumbered outside of
+        # this handler, e.g. by updating the PCB from the schematic
+        self._nets.clear()
+        self._items.clear()
 
-def create_bowtie(kicad_pcb: pcbnew.BOARD):
+    def apply_layout(
+        self,
+        layout: BowtieLayout,
+        progress: Optional[ProgressCallback] = None,
+        replace_existing: bool = False,
+    ) -> BatchStats:
+        """
+        Place the LEDs and add every track and via in the layout in one batch.
+        Each item goes in the owner group of its LED, see layout_manifest.
 
-    pcb = M0WUTPcbHandler(
-        pcb=kicad_pcb,
-        default_via_hole_mm=0.2,
-        default_via_pad_mm=VIA_DIAMETER,
-        default_track_width_mm=VIA_HOLE,
-    )
+        With replace_existing, every track and via already on the board is
+        removed in the same batch, so cancelling puts them back.
+        """
+        nets = [self.get_net(net_name) for net_name in layout.nets]
+        for net_name, net in zip(layout.nets, nets):
+            assert net is not None, f"Couldn't find net {net_name}"
 
-    net_5v = pcb.get_net("5V0")
-    assert net_5v is not None
-    net_0v = pcb.get_net("0V")
-    assert net_0v is not None
-
-    # Wipe board from previous attempts
-    pcb.delete_all_tracks_and_vias()
-
-    # Setup orientation conditions
-    current_led_reference = 1
-    leds_per_column = START_COLUMN_SIZE
-    add_led_next_column = False
-
-    flip = True
-    for col in range(2 * NUM_COLS + NUM_CENTRE_COLS):
-        led_centre_x = START_X + COLUMN_SPACING * col
-        for row in range(leds_per_column):
-            led = pcb.get_component(f"LD{current_led_reference}")
-            # cap = pcb.get_component(f"C{current_led_reference}")
-            assert led is not None, f"Couldn't find LD{current_led_reference}"
-            # assert cap is not None, f"Couldn't find C{current_led_reference}"
-
-            led_centre_y = (
-                CENTRE_LINE_Y
-                - row * ROW_SPACING
-                + 0.5 * (leds_per_column - 1) * ROW_SPACING
-            )
+        layers = {x.value: x for x in KicadLayer}
+        with self.batch(progress) as stats:
+            # Building the batch is the first half of each phase, committing it
+            # to the board is the second
+            phases = self._batch.progress
+            if replace_existing:
+                with phases.phase("wipe", 0.0, 0.5):
+                    self.delete_all_tracks_and_vias()
+
+            placements = layout.placements
+            refs = [None] + placements.refs.tolist()
+            with phases.phase("place footprints", 0.0, 0.5) as report:
+                for index, (ref, x, y, rotation, layer) in enumerate(
+                    zip(
+                        placements.refs.tolist(),
+                        placements.x.tolist(),
+                        placements.y.tolist(),
+                        placements.rotation.tolist(),
+                        placements.layer.tolist(),
+                    )
+                ):
+                    report(index, len(placements))
+                    component = self.get_component(ref)
+                    assert component is not None, f"Couldn't find {ref}"
+                    self.move_component_nm(component, x, y, layers[layer], rotation)
+                    self.hide_reference(component)
+
+            segments = layout.segments
+            with phases.phase("add tracks", 0.0, 0.5) as report:
+                for index, (x0, y0, x1, y1, width, layer, net, led) in enumerate(
+                    zip(
+                        segments.x0.tolist(),
+                        segments.y0.tolist(),
+                        segments.x1.tolist(),
+                        segments.y1.tolist(),
+                        segments.width.tolist(),
+                        segments.layer.tolist(),
+                        segments.net.tolist(),
+                        segments.led.tolist(),
+                    )
+                ):
+                    report(index, len(segments))
+                    track = self.add_track_nm(
+                        x0, y0, x1, y1, nets[net], layers[layer], width
+                    )
+                    # Unowned items have led -1, which is None in refs
+                    self._set_owner(track, refs[led + 1])
+
+            vias = layout.vias
+            with phases.phase("add vias", 0.0, 0.5) as report:
+                for index, (x, y, drill, pad, net, led) in enumerate(
+                    zip(
+                        vias.x.tolist(),
+                        vias.y.tolist(),
+                        vias.drill.tolist(),
+                        vias.pad.tolist(),
+                        vias.net.tolist(),
+                        vias.led.tolist(),
+                    )
+                ):
+                    report(index, len(vias))
+                    via = self.add_via_nm(x, y, nets[net], drill, pad)
+                    self._set_owner(via, refs[led + 1])
+
+        return stats
+
+    def place_array(
+        self,
+        cells: Cells,
+        template: RoutingTemplate,
+        refs: Optional[Sequence[str]] = None,
+        layer: KicadLayer = KicadLayer.TOP,
+        progress: Optional[ProgressCallback] = None,
+        replace_existing: bool = False,
+    ) -> BatchStats:
+        # Puts refs[n] (default LD1, LD2...) on cells[n] and stamps the routing
+        # template onto every cell
+        layout = plan_array(cells, template, refs, layer)
+        return self.apply_layout(layout, progress, replace_existing)
 
-            led.set_position(
-                led_centre_x,
-                led_centre_y,
-                KicadLayer.TOP,
-                rotation_deg=0,
+    def _get_item_key(
+        self, item: pcbnew.BOARD_ITEM, layers: dict[int, KicadLayer]
+    ) -> Optional[ItemKey]:
+        if item.Type() == pcbnew.PCB_VIA_T:
+            position = item.GetPosition()
+            return make_via_key(
+                position.x,
+                position.y,
+                item.GetDrill(),
+                item.GetWidth(),
+                item.GetNetname(),
             )
-            led.hide_reference()
-
-            # Bottom left pad i.e. negative X, positive Y
-            # This goes to a via
-            x_pos = led_centre_x - LED_PAD_OFFSET_X
-            y_pos = led_centre_y + LED_PAD_OFFSET_Y
-            pcb.add_track(
-                x_pos,
-                y_pos,
-                x_pos,
-                led_centre_y + 0.5 * ROW_SPACING,
-                net_5v,
-                KicadLayer.TOP,
-                DEFAULT_TRACK_WIDTH_MM,
+        if item.Type() == pcbnew.PCB_TRACE_T and item.GetLayer() in layers:
+            start = item.GetStart()
+            end = item.GetEnd()
+            return make_track_key(
+                start.x,
+                start.y,
+                end.x,
+                end.y,
+                item.GetWidth(),
+                layers[item.GetLayer()].value,
+                item.GetNetname(),
             )
-            pcb.add_via(
-                x_pos,
-                led_centre_y + 0.5 * ROW_SPACING,
-                net_5v,
-                VIA_HOLE,
-                VIA_DIAMETER,
+        # Arcs and tracks on non-copper layers are never generated
+        return None
+
+    @staticmethod
+    def _set_item_from_key(item: pcbnew.BOARD_ITEM, key: ItemKey, net_code: int):
+        if key[0] == "via":
+            _, x, y, drill, pad, _ = key
+            item.SetPosition(pcbnew.VECTOR2I(x, y))
+            item.SetDrill(drill)
+            item.SetWidth(pad)
+        else:
+            _, x0, y0, x1, y1, width, layer, _ = key
+            item.SetStart(pcbnew.VECTOR2I(x0, y0))
+            item.SetEnd(pcbnew.VECTOR2I(x1, y1))
+            item.SetWidth(width)
+            item.SetLayer(KicadLayer(layer).get_layer_code())
+        item.SetNetCode(net_code)
+
+    def _update_item(
+        self,
+        item: pcbnew.BOARD_ITEM,
+        key: ItemKey,
+        nets: dict[str, Net],
+        previous_key: ItemKey,
+    ) -> None:
+        # Items already on the board are edited straight away, so remember how
+        # to put them back if the batch is rolled back
+        if self._batch is not None:
+            self._batch.undo.append(
+                partial(self._set_item_from_key, item, previous_key, item.GetNetCode())
             )
-            pcb.add_track(
-                x_pos,
-                led_centre_y + 0.5 * ROW_SPACING,
-                x_pos + COLUMN_SPACING,
-                led_centre_y + 0.5 * ROW_SPACING,
-                net_5v,
-                KicadLayer.L3,
-                DEFAULT_POWER_TRACK_WIDTH_MM,
+        self._set_item_from_key(item, key, nets[key[-1]].get_net_code())
+
+    def _add_item_from_key(self, key: ItemKey, nets: dict[str, Net]):
+        if key[0] == "via":
+            _, x, y, drill, pad, net_name = key
+            return self.add_via_nm(x, y, nets[net_name], drill, pad)
+        _, x0, y0, x1, y1, width, layer, net_name = key
+        return self.add_track_nm(
+            x0, y0, x1, y1, nets[net_name], KicadLayer(layer), width
+        )
+
+    def _component_needs_move(
+        self, component: Component, x: int, y: int, rotation: float, layer: int
+    ) -> bool:
+        position = component.footprint.GetPosition()
+        orientation_delta = (
+            component.footprint.GetOrientationDegrees() - rotation
+        ) % 360
+        return (
+            (position.x, position.y) != (x, y)
+            or min(orientation_delta, 360 - orientation_delta) > 1e-6
+            or component.footprint.GetLayer() != KicadLayer(layer).get_layer_code()
+        )
+
+    def apply_layout_differential(
+        self,
+        layout: BowtieLayout,
+        progress: Optional[ProgressCallback] = None,
+        leds: Optional[Iterable[int]] = None,
+    ) -> DiffStats:
+        """
+        Bring the board in line with the layout, touching only what has changed.
+
+        Items created by previous runs are in owner groups on the board, see
+        layout_manifest, so ownership is saved and undone with the board. Owned
+        items which already match the plan are left alone, mismatched ones are
+        edited in place where possible and everything else is added or removed.
+        Items in no owner group (e.g. hand-routed tracks) are never modified,
+        although an unowned item which exactly matches a planned one is adopted
+        rather than duplicated.
+
+        If leds is given, only those LEDs (indices into the plan) and the items
+        their owner groups hold are regenerated.
+        """
+        start_time = perf_counter()
+        stats = DiffStats()
+
+        nets = {net_name: self.get_net(net_name) for net_name in layout.nets}
+        for net_name, net in nets.items():
+            assert net is not None, f"Couldn't find net {net_name}"
+
+        planned = get_planned_keys(layout)
+        selected = None if leds is None else set(leds)
+        if selected is not None:
+            planned = [x for x in planned if x.led in selected]
+        planned_keys = {x.key for x in planned}
+        layers = {x.get_layer_code(): x for x in KicadLayer}
+
+        # UUID -> index of the owning LED, -1 for items owned by no LED or by
+        # one that is no longer in the plan
+        refs = layout.placements.refs.tolist()
+        led_indices = {ref: index for index, ref in enumerate(refs)}
+        owners: dict[str, int] = {}
+        for group_name, group in self.get_owner_groups().items():
+            led = led_indices.get(get_owner_ref(group_name), -1)
+            for item in group.GetItems():
+                owners[item.m_Uuid.AsString()] = led
+
+        # Owned items on the board bucketed by their current geometry, plus any
+        # unowned items that happen to be exactly what is planned
+        owned: dict[ItemKey, list[pcbnew.BOARD_ITEM]] = {}
+        adoptable: dict[ItemKey, list[pcbnew.BOARD_ITEM]] = {}
+        for item in self.pcb.GetTracks():
+            led = owners.get(item.m_Uuid.AsString())
+            is_owned = led is not None
+            if is_owned and selected is not None and led not in selected:
+                # Belongs to an LED that isn't being regenerated
+                continue
+            if not is_owned and item.Type() == pcbnew.PCB_ARC_T:
+                continue
+            key = self._get_item_key(item, layers)
+            if key is None:
+                continue
+            if is_owned:
+                owned.setdefault(key, []).append(item)
+            elif key in planned_keys:
+                adoptable.setdefault(key, []).append(item)
+
+        def get_ref(entry: ManifestEntry) -> Optional[str]:
+            return refs[entry.led] if entry.led >= 0 else None
+
+        with self.batch(progress) as batch_stats:
+            unmatched: list[ManifestEntry] = []
+            for entry in planned:
+                for candidates in (owned, adoptable):
+                    if candidates.get(entry.key):
+                        item = candidates[entry.key].pop()
+                        self._set_owner(item, get_ref(entry))
+                        stats.unchanged += 1
+                        break
+                else:
+                    unmatched.append(entry)
+
+            # Whatever owned items are left no longer match the plan so reuse
+            # them for unmatched items of the same kind before adding or
+            # removing
+            leftovers: dict[str, list[tuple[ItemKey, pcbnew.BOARD_ITEM]]] = {
+                "track": [],
+                "via": [],
+            }
+            for key, items in owned.items():
+                leftovers[key[0]] += [(key, x) for x in items]
+
+            phases = self._batch.progress
+            for phase, kind in (("add tracks", "track"), ("add vias", "via")):
+                entries = [x for x in unmatched if x.key[0] == kind]
+                with phases.phase(phase, 0.0, 0.5) as report:
+                    for index, entry in enumerate(entries):
+                        report(index, len(entries))
+                        if leftovers[kind]:
+                            previous_key, item = leftovers[kind].pop()
+                            self._update_item(item, entry.key, nets, previous_key)
+                            stats.updated += 1
+                        else:
+                            item = self._add_item_from_key(entry.key, nets)
+                            stats.added += 1
+                        self._set_owner(item, get_ref(entry))
+
+            with phases.phase("wipe", 0.0, 0.5):
+                for items in leftovers.values():
+                    for _, item in items:
+                        self._remove_item(item)
+                        stats.removed += 1
+
+            placements = layout.placements
+            led_indices = (
+                range(len(placements)) if selected is None else sorted(selected)
             )
+            with phases.phase("place footprints", 0.0, 0.5) as report:
+                for index, led in enumerate(led_indices):
+                    report(index, len(led_indices))
+                    ref = str(placements.refs[led])
+                    x = int(placements.x[led])
+                    y = int(placements.y[led])
+                    rotation = float(placements.rotation[led])
+                    layer = int(placements.layer[led])
+                    component = self.get_component(ref)
+                    assert component is not None, f"Couldn't find {ref}"
+                    if self._component_needs_move(component, x, y, rotation, layer):
+                        self.move_component_nm(
+                            component, x, y, KicadLayer(layer), rotation
+                        )
+                        self.hide_reference(component)
+                        stats.footprints_moved += 1
 
-            if row > 0:
-
-                # Top right pad i.e. positive X, negative Y (becauese Kicad)
-                # This goes up and to the left
-                x_pos = led_centre_x + LED_PAD_OFFSET_X
-                y_pos = led_centre_y - LED_PAD_OFFSET_Y
-                pcb.add_multipoint_track(
-                    [
-                        (x_pos, y_pos),
-                        (
-                            x_pos - LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (
-                            x_pos - LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + ROW_SPACING - LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (x_pos, y_pos + ROW_SPACING),
-                    ],
-                    net_5v,
-                    KicadLayer.TOP,
-                    DEFAULT_TRACK_WIDTH_MM,
-                )
-                # Top left via i.e. negative X, negative Y
-                # This goes up and to the right
-                x_pos = led_centre_x - LED_PAD_OFFSET_X
-                y_pos = led_centre_y - LED_PAD_OFFSET_Y
-                pcb.add_multipoint_track(
-                    [
-                        (x_pos, y_pos),
-                        (
-                            x_pos + LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (
-                            x_pos + LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + ROW_SPACING - LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (x_pos, y_pos + ROW_SPACING),
-                    ],
-                    net_5v,
-                    KicadLayer.TOP,
-                    DEFAULT_TRACK_WIDTH_MM,
-                )
+        stats.phase_times = batch_stats.phase_times
+        stats.elapsed_s = perf_counter() - start_time
+        logger.info(f"Differential update: {stats}")
+        return stats
 
-                # # Bottom right via i.e. positive X, positive Y
-                # # This goes up and right
-                x_pos = led_centre_x + LED_PAD_OFFSET_X
-                y_pos = led_centre_y + LED_PAD_OFFSET_Y
-                pcb.add_multipoint_track(
-                    [
-                        (x_pos, y_pos),
-                        (
-                            x_pos + LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (
-                            x_pos + LED_PAD_TRACK_VERTEX_OFFSET_X,
-                            y_pos + ROW_SPACING - LED_PAD_TRACK_VERTEX_OFFSET_Y,
-                        ),
-                        (x_pos, y_pos + ROW_SPACING),
-                    ],
-                    net_5v,
-                    KicadLayer.TOP,
-                    DEFAULT_TRACK_WIDTH_MM,
-                )
 
-            current_led_reference += 1
+def create_bowtie(
+    kicad_pcb: pcbnew.BOARD,
+    spec: BowtieSpec = BowtieSpec(),
+    differential: bool = False,
+    optimise: bool = True,
+    clearance_mm: Optional[float] = DEFAULT_CLEARANCE_MM,
+    progress: Optional[ProgressCallback] = None,
+    columns: Optional[range] = None,
+    refs: Optional[Iterable[str]] = None,
+    panel: Optional[Sequence[PanelCopy]] = None,
+    footprint_pads: bool = True,
+    stitch_pitch_mm: Optional[float] = None,
+    keepouts: Sequence[Keepout] = (),
+    plan_cache_dir: Optional[Path] = PLAN_CACHE_DIR,
+) -> Union[BatchStats, DiffStats]:
+    """
+    Place and route the bowtie described by spec on kicad_pcb.
 
-        if col < NUM_COLS:
-            # Taper down
-            if add_led_next_column == (2 if flip else 1):
-                leds_per_column -= 2
-                add_led_next_column = 0
-                flip = not flip
-            else:
-                add_led_next_column = add_led_next_column + 1
+    Returns what was changed on the board, with the time taken by each phase.
 
-        elif col >= NUM_COLS + NUM_CENTRE_COLS:
-            if add_led_next_column == (2 if flip else 1):
-                leds_per_column += 2
-                add_led_next_column = 0
-                flip = not flip
-            else:
-                add_led_next_column = add_led_next_column + 1
+    Passing columns and/or refs regenerates only those LEDs and their tracks,
+    e.g. columns=range(4, 6) or refs=["LD537"] after swapping a footprint.
+    This needs differential mode and a board where the whole bowtie has been
+    generated before, as the owner groups are what say which items belong to
+    which LED.
 
-            pass
-        else:
-            # Centre section
-            pass
+    Differential mode on a board with no owner groups regenerates everything,
+    as nothing generated can be told apart from hand routing.
+
+    With panel, the plan is replicated onto every copy, see panelise_layout.
+
+    With footprint_pads, the LED pad offsets in spec are replaced by those read
+    from the first LED's footprint.
+
+    With stitch_pitch_mm, ground stitching vias are added on that pitch
+    wherever they clear the bowtie and keepouts, see add_stitching.
+
+    Plans are cached in plan_cache_dir, or only in memory if it is None.
+    """
+
+    pcb = M0WUTPcbHandler(
+        pcb=kicad_pcb,
+        default_via_hole_mm=spec.via_hole,
+        default_via_pad_mm=spec.via_diameter,
+        default_track_width_mm=spec.track_width,
+    )
+
+    assert pcb.get_net(spec.power_net_name) is not None
+    assert pcb.get_net(spec.ground_net_name) is not None
+
+    phases = _PhaseTracker(progress)
+    with phases.phase("plan") as report:
+        if footprint_pads:
+            first_ref = str(get_default_refs(1)[0])
+            first_led = pcb.get_component(first_ref)
+            assert first_led is not None, f"Couldn't find {first_ref}"
+            spec = get_led_pad_spec(spec, get_pad_geometry(first_led.footprint))
+
+        layout = get_layout(spec, plan_cache_dir)
+        segments = layout.segments
+        if optimise:
+            # Fewer, longer tracks make for a smaller board file and faster DRC
+            layout = optimise_layout(layout)
+        if panel is not None:
+            layout = panelise_layout(layout, panel)
+        if stitch_pitch_mm is not None:
+            layout = add_stitching(
+                layout,
+                spec,
+                stitch_pitch_mm,
+                DEFAULT_CLEARANCE_MM if clearance_mm is None else clearance_mm,
+                keepouts,
+            )
+
+        # Check before anything on the board is changed
+        missing_references = pcb.get_missing_references(
+            layout.placements.refs.tolist()
+        )
+        assert not missing_references, f"Couldn't find {', '.join(missing_references)}"
+
+        if footprint_pads:
+            # Every LED is routed for the pads read from the first one
+            fpid = first_led.footprint.GetFPIDAsString()
+            other_leds = [
+                x
+                for x in layout.placements.refs.tolist()
+                if pcb.get_component(x).footprint.GetFPIDAsString() != fpid
+            ]
+            assert not other_leds, (
+                f"Not every LED is {fpid} like {first_ref}: {', '.join(other_leds)}"
+            )
+
+        if clearance_mm is not None:
+            # The LED pads are what the routing is most likely to clip
+            pads = get_led_pads(
+                layout.placements,
+                [
+                    pcb.get_component(x).footprint
+                    for x in layout.placements.refs.tolist()
+                ],
+            )
+            violations = check_clearance(layout, clearance_mm, pads)
+            for violation in violations:
+                logger.error(violation)
+            assert not violations, (
+                "Clearance violations around "
+                f"{', '.join(get_violating_refs(violations))}"
+            )
+        report(1, 1)
+
+    leds = None
+    if columns is not None or refs is not None:
+        assert panel is None, "Panels can only be regenerated as a whole"
+        index = BowtieIndex.from_spec(spec)
+        leds = set()
+        if columns is not None:
+            leds.update(index.get_column_leds(columns).tolist())
+        if refs is not None:
+            leds.update(index.get_led_from_ref(x) for x in refs)
+        if optimise:
+            # Merged tracks are owned by one of the LEDs they run past
+            leds = get_merged_leds(segments, leds)
+        assert differential, "Regenerating part of the bowtie needs differential mode"
+
+    if differential:
+        if pcb.get_owner_groups():
+            stats = pcb.apply_layout_differential(layout, progress, leds)
+            stats.phase_times = {**phases.phase_times, **stats.phase_times}
+            logger.info(f"Phase timings: {format_phase_times(stats.phase_times)}")
+            return stats
+        assert leds is None, (
+            "Regenerate the whole bowtie once before regenerating part of it"
+        )
+        logger.warning("No bowtie owner groups on the board, regenerating from scratch")
 
-    pcbnew.Refresh()
+    # Wipe board from previous attempts in the same batch, so it can be undone
+    stats = pcb.apply_layout(layout, progress, replace_existing=True)
+    stats.phase_times = {**phases.phase_times, **stats.phase_times}
+    logger.info(f"Phase timings: {format_phase_times(stats.phase_times)}")
+    return stats
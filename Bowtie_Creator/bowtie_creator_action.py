@@ -1,6 +1,19 @@
+import logging
+
 import pcbnew
+import wx
+
+from bowtie_creator import (
+    PHASES,
+    BowtieCancelled,
+    create_bowtie,
+    format_phase_times,
+)
+
+logger = logging.getLogger(__name__)
 
-from bowtie_creator import create_bowtie
+# Resolution of the progress bar
+PROGRESS_STEPS = 1000
 
 
 class BowtiePluginAction(pcbnew.ActionPlugin):
@@ -11,4 +24,41 @@ class BowtiePluginAction(pcbnew.ActionPlugin):
 
     def Run(self):
         # This must be called Run with a capital R to appease Kicad
-        create_bowtie(pcbnew.GetBoard())
+        dialog = wx.ProgressDialog(
+            self.name,
+            "Starting...",
+            maximum=PROGRESS_STEPS,
+            style=wx.PD_APP_MODAL
+            | wx.PD_CAN_ABORT
+            | wx.PD_AUTO_HIDE
+            | wx.PD_ELAPSED_TIME,
+        )
+        # Phases don't always run in order, so never let the bar go backwards
+        last_value = 0
+
+        def progress(phase: str, fraction: float) -> bool:
+            nonlocal last_value
+            value = int(
+                PROGRESS_STEPS * (PHASES.index(phase) + fraction) / len(PHASES)
+            )
+            last_value = min(max(last_value, value), PROGRESS_STEPS - 1)
+            keep_going, _ = dialog.Update(last_value, f"{phase.capitalize()}...")
+            return keep_going
+
+        try:
+            # Always a full regeneration, differential runs are opt in from the
+            # scripting console
+            stats = create_bowtie(pcbnew.GetBoard(), progress=progress)
+        except BowtieCancelled:
+            logger.info("Bowtie creation cancelled, board left as it was")
+            wx.MessageBox("Cancelled, board left as it was", self.name)
+            return
+        finally:
+            dialog.Destroy()
+
+        # Kicad doesn't show the log, so report the timings here
+        wx.MessageBox(
+            f"Bowtie created: {stats}\n\n"
+            f"Phase timings: {format_phase_times(stats.phase_times)}",
+            self.name,
+        )
@@ -0,0 +1,281 @@
+from dataclasses import dataclass, replace
+from typing import Sequence, Union
+
+import numpy as np
+
+NUM_COLS = 19
+START_COLUMN_SIZE = 26
+
+NUM_CENTRE_COLS = 10
+
+# Columns between each change of two LEDs in the taper, repeating
+TAPER_STEPS = (3, 2)
+
+# Coordinates of Start LED (first one on bottom left on left side of bowtie)
+START_X = 97.75
+CENTRE_LINE_Y = 100
+
+COLUMN_SPACING = 2.3  # mm
+ROW_SPACING = 2.3  # mm
+
+DEFAULT_TRACK_WIDTH_MM = 0.127
+DEFAULT_POWER_TRACK_WIDTH_MM = 0.5
+
+VIA_DIAMETER = 0.45
+VIA_HOLE = 0.2
+
+LED_PAD_OFFSET_X = 0.65
+LED_PAD_OFFSET_Y = 0.4
+LED_PAD_TRACK_VERTEX_OFFSET_X = 0.5
+LED_PAD_TRACK_VERTEX_OFFSET_Y = 0.417
+
+POWER_NET_NAME = "5V0"
+GROUND_NET_NAME = "0V"
+
+
+@dataclass(frozen=True)
+class BowtieSpec:
+    num_cols: int = NUM_COLS
+    start_column_size: int = START_COLUMN_SIZE
+    num_centre_cols: int = NUM_CENTRE_COLS
+    taper_steps: tuple[int, ...] = TAPER_STEPS
+    start_x: float = START_X
+    centre_line_y: float = CENTRE_LINE_Y
+    column_spacing: float = COLUMN_SPACING
+    row_spacing: float = ROW_SPACING
+    track_width: float = DEFAULT_TRACK_WIDTH_MM
+    power_track_width: float = DEFAULT_POWER_TRACK_WIDTH_MM
+    via_diameter: float = VIA_DIAMETER
+    via_hole: float = VIA_HOLE
+    led_pad_offset_x: float = LED_PAD_OFFSET_X
+    led_pad_offset_y: float = LED_PAD_OFFSET_Y
+    led_pad_track_vertex_offset_x: float = LED_PAD_TRACK_VERTEX_OFFSET_X
+    led_pad_track_vertex_offset_y: float = LED_PAD_TRACK_VERTEX_OFFSET_Y
+    power_net_name: str = POWER_NET_NAME
+    ground_net_name: str = GROUND_NET_NAME
+
+
+# Layout arrays hold integer nanometres, the same units pcbnew uses internally,
+# so the board is built without any rounding or FromMM calls per item
+
+
+@dataclass
+class Placements:
+    refs: np.ndarray
+    x: np.ndarray  # nm
+    y: np.ndarray  # nm
+    rotation: np.ndarray
+    layer: np.ndarray  # KicadLayer values
+
+    def __len__(self):
+        return len(self.refs)
+
+
+@dataclass
+class Segments:
+    x0: np.ndarray  # nm
+    y0: np.ndarray  # nm
+    x1: np.ndarray  # nm
+    y1: np.ndarray  # nm
+    width: np.ndarray  # nm
+    layer: np.ndarray  # KicadLayer values
+    net: np.ndarray  # Index into BowtieLayout.nets
+    led: np.ndarray  # Index into BowtieLayout.placements of the owning LED
+
+    def __len__(self):
+        return len(self.x0)
+
+
+@dataclass
+class Vias:
+    x: np.ndarray  # nm
+    y: np.ndarray  # nm
+    drill: np.ndarray  # nm
+    pad: np.ndarray  # nm
+    net: np.ndarray  # Index into BowtieLayout.nets
+    led: np.ndarray  # Index into BowtieLayout.placements of the owning LED
+
+    def __len__(self):
+        return len(self.x)
+
+
+@dataclass
+class BowtieLayout:
+    """
+    Complete bowtie geometry in integer nm, with no dependency on pcbnew.
+
+    Each field is a set of equal-length NumPy arrays so the whole layout can be
+    inspected, tested or transformed without touching a board.
+    """
+
+    nets: tuple[str, ...]
+    placements: Placements
+    segments: Segments
+    vias: Vias
+
+
+def round_nm(x_nm: np.ndarray) -> np.ndarray:
+    # Matches the rounding used by pcbnew.FromMM (half away from zero)
+    return (np.sign(x_nm) * np.floor(np.abs(x_nm) + 0.5)).astype(np.int64)
+
+
+def rotate_nm(
+    x_nm: np.ndarray, y_nm: np.ndarray, rotation_deg: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rotate offsets from a centre anticlockwise on screen, with Y pointing down
+    as in Kicad, rounded to the nm. The arguments broadcast against each other.
+    """
+    if not np.any(rotation_deg):
+        # Pure translation stays in exact integer arithmetic
+        return x_nm, y_nm
+
+    angle = np.radians(rotation_deg)
+    cos = np.cos(angle)
+    sin = np.sin(angle)
+    return round_nm(x_nm * cos + y_nm * sin), round_nm(y_nm * cos - x_nm * sin)
+
+
+def mm_to_nm(x_mm: np.ndarray) -> np.ndarray:
+    return round_nm(np.asarray(x_mm, dtype=np.float64) * 1e6)
+
+
+def halve_nm(x_nm: np.ndarray) -> np.ndarray:
+    # Integer halving that rounds half away from zero like mm_to_nm
+    return np.sign(x_nm) * ((np.abs(x_nm) + 1) // 2)
+
+
+def get_spec_with_pad_offsets(
+    spec: BowtieSpec, numbers: Sequence[str], x_nm: np.ndarray, y_nm: np.ndarray
+) -> BowtieSpec:
+    """
+    Return spec with the LED pad offsets taken from pad centres relative to an
+    unrotated LED footprint.
+
+    The bowtie routing expects four pads, one on each corner of a rectangle
+    centred on the footprint. The track vertex offsets are left as they are.
+    """
+    offset_x = np.abs(x_nm)
+    offset_y = np.abs(y_nm)
+    quadrants = set(zip(np.sign(x_nm).tolist(), np.sign(y_nm).tolist()))
+    assert (
+        len(x_nm) == 4
+        and np.ptp(offset_x) <= 1
+        and np.ptp(offset_y) <= 1
+        and quadrants == {(-1, -1), (-1, 1), (1, -1), (1, 1)}
+    ), (
+        f"LED pads {tuple(numbers)} aren't on the corners of a rectangle, turn "
+        "off footprint_pads to route to the pad offsets in the spec"
+    )
+
+    # Rounded to the nm so the same footprint always gives the same plan
+    return replace(
+        spec,
+        led_pad_offset_x=round(float(offset_x.mean()) / 1e6, 6),
+        led_pad_offset_y=round(float(offset_y.mean()) / 1e6, 6),
+    )
+
+
+def get_column_sizes(spec: BowtieSpec) -> np.ndarray:
+    # The taper loses two LEDs every time it has run for the current number of
+    # taper steps, holds its size across the centre and then grows back
+    column_sizes = []
+    leds_per_column = spec.start_column_size
+    columns_since_change = 0
+    step_index = 0
+    for col in range(2 * spec.num_cols + spec.num_centre_cols):
+        column_sizes.append(leds_per_column)
+
+        if spec.num_cols <= col < spec.num_cols + spec.num_centre_cols:
+            # Centre section
+            continue
+
+        columns_since_change += 1
+        if columns_since_change == spec.taper_steps[step_index]:
+            leds_per_column += -2 if col < spec.num_cols else 2
+            columns_since_change = 0
+            step_index = (step_index + 1) % len(spec.taper_steps)
+
+    return np.array(column_sizes, dtype=np.int64)
+
+
+@dataclass(frozen=True)
+class BowtieIndex:
+    """
+    Closed-form lookup between an LED's index in the plan (LD1 is 0) and its
+    column, row and position, without replaying the taper.
+
+    Works on single indices or arrays of them.
+    """
+
+    spec: BowtieSpec
+    column_sizes: np.ndarray
+    column_starts: np.ndarray  # Index of the first LED in each column
+    led_columns: np.ndarray  # Column of every LED
+
+    @classmethod
+    def from_spec(cls, spec: BowtieSpec = BowtieSpec()) -> "BowtieIndex":
+        column_sizes = get_column_sizes(spec)
+        return cls(
+            spec=spec,
+            column_sizes=column_sizes,
+            column_starts=np.cumsum(column_sizes) - column_sizes,
+            led_columns=np.repeat(np.arange(len(column_sizes)), column_sizes),
+        )
+
+    def __len__(self):
+        return len(self.led_columns)
+
+    def get_column_row(
+        self, led: Union[int, np.ndarray]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Rows are numbered from the bottom of each column
+        col = self.led_columns[led]
+        return col, led - self.column_starts[col]
+
+    def get_led(
+        self, col: Union[int, np.ndarray], row: Union[int, np.ndarray]
+    ) -> np.ndarray:
+        return self.column_starts[col] + row
+
+    def get_position_nm(
+        self, col: Union[int, np.ndarray], row: Union[int, np.ndarray]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Columns are centred on the centre line
+        row_spacing_nm = mm_to_nm(self.spec.row_spacing)
+        return (
+            mm_to_nm(self.spec.start_x) + mm_to_nm(self.spec.column_spacing) * col,
+            mm_to_nm(self.spec.centre_line_y)
+            - row * row_spacing_nm
+            + halve_nm((self.column_sizes[col] - 1) * row_spacing_nm),
+        )
+
+    def get_column_leds(self, columns: range) -> np.ndarray:
+        # LEDs are numbered column by column, so a run of columns is a run of LEDs
+        assert columns.step == 1, "Column ranges must be contiguous"
+        columns = range(len(self.column_sizes))[columns.start : columns.stop]
+        if not columns:
+            return np.zeros(0, dtype=np.int64)
+        last = columns.stop - 1
+        return np.arange(
+            self.column_starts[columns.start],
+            self.column_starts[last] + self.column_sizes[last],
+        )
+
+    def get_led_from_ref(self, ref: str, prefix: str = "LD", first: int = 1) -> int:
+        # The inverse of array_placement.get_default_refs
+        assert ref.startswith(prefix), f"{ref} is not a bowtie LED"
+        led = int(ref[len(prefix) :]) - first
+        assert 0 <= led < len(self), f"{ref} is not a bowtie LED"
+        return led
+
+
+def plan_bowtie(spec: BowtieSpec = BowtieSpec()) -> BowtieLayout:
+    # Imported here as the array engine builds on the layout types above
+    from array_placement import bowtie_pattern, bowtie_template, plan_array
+
+    return plan_array(
+        bowtie_pattern(spec),
+        bowtie_template(spec),
+        nets=(spec.power_net_name, spec.ground_net_name),
+    )
@@ -0,0 +1,216 @@
+"""
+Design-space sweep over bowtie variants.
+
+Every combination of the swept BowtieSpec fields is planned in a process pool
+and scored, without touching the board. Once a variant has been picked, only
+that one is materialised with create_bowtie.
+
+    python bowtie_sweep.py --sweep num_cols=15,17,19 --sweep row_spacing=2.1,2.3
+
+The pool spawns fresh Python interpreters, so run sweeps from a normal Python
+rather than Kicad's scripting console, where sys.executable is Kicad itself.
+"""
+
+import argparse
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields, replace
+from time import perf_counter
+from typing import Any, Optional, get_args, get_origin
+
+import numpy as np
+
+from bowtie_layout import BowtieLayout, BowtieSpec
+from clearance import get_min_clearance
+from layout_optimiser import optimise_layout
+from plan_cache import get_layout
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class VariantResult:
+    spec: BowtieSpec
+    led_count: int
+    # (min_x, min_y, max_x, max_y) of all copper and LED centres in mm
+    bounding_box_mm: tuple[float, float, float, float]
+    total_track_length_mm: float
+    via_count: int
+    min_clearance_mm: float
+
+    @property
+    def width_mm(self) -> float:
+        return self.bounding_box_mm[2] - self.bounding_box_mm[0]
+
+    @property
+    def height_mm(self) -> float:
+        return self.bounding_box_mm[3] - self.bounding_box_mm[1]
+
+    def __repr__(self):
+        return (
+            f"{self.led_count} LEDs, {self.width_mm:.2f} x {self.height_mm:.2f}mm, "
+            f"{self.total_track_length_mm:.1f}mm of track, {self.via_count} vias, "
+            f"{self.min_clearance_mm:.3f}mm min clearance"
+        )
+
+
+def _bounding_box(layout: BowtieLayout) -> tuple[float, float, float, float]:
+    segments = layout.segments
+    vias = layout.vias
+    half_width = segments.width / 2
+    half_pad = vias.pad / 2
+    x_min = np.concatenate(
+        [
+            layout.placements.x,
+            np.minimum(segments.x0, segments.x1) - half_width,
+            vias.x - half_pad,
+        ]
+    )
+    x_max = np.concatenate(
+        [
+            layout.placements.x,
+            np.maximum(segments.x0, segments.x1) + half_width,
+            vias.x + half_pad,
+        ]
+    )
+    y_min = np.concatenate(
+        [
+            layout.placements.y,
+            np.minimum(segments.y0, segments.y1) - half_width,
+            vias.y - half_pad,
+        ]
+    )
+    y_max = np.concatenate(
+        [
+            layout.placements.y,
+            np.maximum(segments.y0, segments.y1) + half_width,
+            vias.y + half_pad,
+        ]
+    )
+    if len(x_min) == 0:
+        return (0.0, 0.0, 0.0, 0.0)
+    return (
+        float(x_min.min()) / 1e6,
+        float(y_min.min()) / 1e6,
+        float(x_max.max()) / 1e6,
+        float(y_max.max()) / 1e6,
+    )
+
+
+def evaluate_variant(spec: BowtieSpec, optimise: bool = True) -> VariantResult:
+    # Runs in the worker processes, so has to stay importable without pcbnew.
+    # Variants are planned once each, so they stay out of the on-disk cache
+    # where they would only evict the plans the user actually builds
+    layout = get_layout(spec, cache_dir=None)
+    if optimise:
+        layout = optimise_layout(layout)
+
+    segments = layout.segments
+    return VariantResult(
+        spec=spec,
+        led_count=len(layout.placements),
+        bounding_box_mm=_bounding_box(layout),
+        total_track_length_mm=float(
+            np.hypot(segments.x1 - segments.x0, segments.y1 - segments.y0).sum()
+        )
+        / 1e6,
+        via_count=len(layout.vias),
+        # Gaps wider than half a row never limit the design
+        min_clearance_mm=get_min_clearance(layout, spec.row_spacing / 2),
+    )
+
+
+def get_variants(
+    grid: dict[str, list[Any]], base_spec: BowtieSpec = BowtieSpec()
+) -> list[BowtieSpec]:
+    spec_fields = {x.name for x in fields(BowtieSpec)}
+    for name in grid:
+        assert name in spec_fields, f"BowtieSpec has no field {name}"
+
+    names = list(grid)
+    return [
+        replace(base_spec, **dict(zip(names, values)))
+        for values in itertools.product(*(grid[x] for x in names))
+    ]
+
+
+def sweep(
+    grid: dict[str, list[Any]],
+    base_spec: BowtieSpec = BowtieSpec(),
+    max_workers: Optional[int] = None,
+    optimise: bool = True,
+) -> list[VariantResult]:
+    """
+    Plan and score every combination of the values in grid, which maps
+    BowtieSpec field names to the values to try for them. Results are returned
+    in the same order as the combinations. max_workers=0 runs in this process.
+    """
+    start_time = perf_counter()
+    variants = get_variants(grid, base_spec)
+
+    if max_workers == 0:
+        results = [evaluate_variant(x, optimise) for x in variants]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                executor.map(
+                    evaluate_variant, variants, itertools.repeat(optimise)
+                )
+            )
+
+    logger.info(
+        f"Swept {len(results)} bowtie variants in {perf_counter() - start_time:.3f}s"
+    )
+    return results
+
+
+def materialise(kicad_pcb, result: VariantResult, **kwargs):
+    # Imported here so sweeps can run without Kicad
+    from bowtie_creator import create_bowtie
+
+    logger.info(f"Materialising bowtie variant: {result}")
+    return create_bowtie(kicad_pcb, result.spec, **kwargs)
+
+
+def _parse_sweep_argument(argument: str) -> tuple[str, list[Any]]:
+    name, _, values = argument.partition("=")
+    field_types = {x.name: x.type for x in fields(BowtieSpec)}
+    assert name in field_types, f"No BowtieSpec field {name}"
+    # The annotation rather than the default's type, as e.g. centre_line_y is a
+    # float with an int default
+    field_type = field_types[name]
+    if get_origin(field_type) is tuple:
+        # Tuples are written as e.g. taper_steps=3:2,2:2
+        item_type = get_args(field_type)[0]
+        return name, [
+            tuple(item_type(y) for y in x.split(":")) for x in values.split(",")
+        ]
+    return name, [field_type(x) for x in values.split(",")]
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Sweep bowtie design parameters")
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        default=[],
+        metavar="FIELD=A,B,...",
+        help="BowtieSpec field and the values to try, can be repeated",
+    )
+    parser.add_argument("--workers", type=int, help="Defaults to the CPU count")
+    parser.add_argument(
+        "--no-optimise", action="store_true", help="Skip merging collinear tracks"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    grid = dict(_parse_sweep_argument(x) for x in args.sweep)
+    results = sweep(grid, max_workers=args.workers, optimise=not args.no_optimise)
+    for result in results:
+        swept = ", ".join(f"{x}={getattr(result.spec, x)}" for x in grid)
+        print(f"{swept}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,548 @@
+"""
+Uniform-grid spatial index and clearance checker for planned bowtie copper.
+
+Every segment and via is modelled as a capsule: a line segment swept by a
+radius, on a set of copper layers. Vias are zero-length capsules on every layer.
+Rectangular pads are indexed by a capsule that covers the whole pad and then
+measured exactly as rectangles. Candidate pairs come from a uniform grid,
+everything is vectorised with NumPy so a 100k item layout checks in well under a
+second.
+
+Planned copper doesn't carry the nets of the pads it connects, so with pads the
+copper touching each pad takes on that pad's net before anything is compared.
+"""
+
+import logging
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+from bowtie_layout import BowtieLayout
+from kicad_layer import KicadLayer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLEARANCE_MM = 0.1
+
+_ALL_LAYERS = sum(1 << x.value for x in KicadLayer)
+
+
+@dataclass
+class Pads:
+    x: np.ndarray  # nm
+    y: np.ndarray  # nm
+    size_x: np.ndarray  # nm
+    size_y: np.ndarray  # nm
+    rotation: np.ndarray  # Degrees
+    layer: np.ndarray  # KicadLayer values, -1 for pads on every layer
+    net: np.ndarray  # Index into nets
+    led: np.ndarray  # Index into BowtieLayout.placements, -1 if not an LED
+    nets: tuple[str, ...]
+
+    def __len__(self):
+        return len(self.x)
+
+
+@dataclass
+class Capsules:
+    # Converted to mm so gaps compare directly with clearances
+    x0: np.ndarray
+    y0: np.ndarray
+    x1: np.ndarray
+    y1: np.ndarray
+    radius: np.ndarray
+    layers: np.ndarray  # Bit mask of KicadLayer values
+    net: np.ndarray  # Index into nets
+    led: np.ndarray  # -1 if not owned by an LED
+    kind: np.ndarray  # "segment", "via" or "pad"
+    index: np.ndarray  # Index into the array of that kind
+    nets: tuple[str, ...]
+    # Pads only, zero for everything else. The rectangle is centred half way
+    # along the capsule and rotated by angle
+    half_x: np.ndarray
+    half_y: np.ndarray
+    angle: np.ndarray  # Radians
+
+    def __len__(self):
+        return len(self.x0)
+
+    @classmethod
+    def from_layout(
+        cls, layout: BowtieLayout, pads: Optional[Pads] = None
+    ) -> "Capsules":
+        segments = layout.segments
+        vias = layout.vias
+        nets = list(layout.nets)
+        parts = [
+            (
+                segments.x0,
+                segments.y0,
+                segments.x1,
+                segments.y1,
+                segments.width / 2,
+                np.left_shift(1, segments.layer.astype(np.int64)),
+                segments.net,
+                segments.led,
+                "segment",
+                np.zeros((3, len(segments))),
+            ),
+            (
+                vias.x,
+                vias.y,
+                vias.x,
+                vias.y,
+                vias.pad / 2,
+                np.full(len(vias), _ALL_LAYERS),
+                vias.net,
+                vias.led,
+                "via",
+                np.zeros((3, len(vias))),
+            ),
+        ]
+
+        if pads is not None:
+            # Pads can be on nets the layout never uses
+            for net_name in pads.nets:
+                if net_name not in nets:
+                    nets.append(net_name)
+            net_map = np.array([nets.index(x) for x in pads.nets], dtype=np.int64)
+
+            # Along the long axis, with the radius reaching the corners so the
+            # grid never misses a pad
+            long_x = pads.size_x >= pads.size_y
+            radius = np.minimum(pads.size_x, pads.size_y) / 2 * np.sqrt(2)
+            half_length = np.abs(pads.size_x - pads.size_y) / 2
+            rotation = np.radians(pads.rotation)
+            angle = rotation + np.where(long_x, 0, np.pi / 2)
+            # Kicad's Y axis points down, so positive rotation is anticlockwise
+            # on screen
+            dx = half_length * np.cos(angle)
+            dy = -half_length * np.sin(angle)
+            parts.append(
+                (
+                    pads.x - dx,
+                    pads.y - dy,
+                    pads.x + dx,
+                    pads.y + dy,
+                    radius,
+                    np.where(
+                        pads.layer < 0,
+                        _ALL_LAYERS,
+                        np.left_shift(1, np.maximum(pads.layer, 0).astype(np.int64)),
+                    ),
+                    net_map[pads.net] if len(pads) else pads.net,
+                    pads.led,
+                    "pad",
+                    np.stack([pads.size_x / 2, pads.size_y / 2, rotation]),
+                )
+            )
+
+        return cls(
+            x0=np.concatenate([x[0] for x in parts]) / 1e6,
+            y0=np.concatenate([x[1] for x in parts]) / 1e6,
+            x1=np.concatenate([x[2] for x in parts]) / 1e6,
+            y1=np.concatenate([x[3] for x in parts]) / 1e6,
+            radius=np.concatenate([x[4] for x in parts]) / 1e6,
+            layers=np.concatenate([x[5] for x in parts]).astype(np.int64),
+            net=np.concatenate([x[6] for x in parts]).astype(np.int64),
+            led=np.concatenate([x[7] for x in parts]).astype(np.int64),
+            kind=np.concatenate([np.full(len(x[0]), x[8]) for x in parts]),
+            index=np.concatenate([np.arange(len(x[0])) for x in parts]),
+            nets=tuple(nets),
+            half_x=np.concatenate([x[9][0] for x in parts]) / 1e6,
+            half_y=np.concatenate([x[9][1] for x in parts]) / 1e6,
+            angle=np.concatenate([x[9][2] for x in parts]),
+        )
+
+
+class GridIndex:
+    """
+    Buckets capsules into every grid cell their bounding box, grown by half of
+    margin, overlaps. Any two capsules closer than margin then share a cell.
+    """
+
+    def __init__(
+        self, capsules: Capsules, margin: float, cell_size: Optional[float] = None
+    ):
+        self.capsules = capsules
+        self.margin = margin
+
+        grow = capsules.radius + margin / 2
+        self.min_x = np.minimum(capsules.x0, capsules.x1) - grow
+        self.min_y = np.minimum(capsules.y0, capsules.y1) - grow
+        self.max_x = np.maximum(capsules.x0, capsules.x1) + grow
+        self.max_y = np.maximum(capsules.y0, capsules.y1) + grow
+
+        if len(capsules) == 0:
+            self.cell_size = 1.0
+            self._origin = (0.0, 0.0)
+            self._entry_item = np.zeros(0, dtype=np.int64)
+            self._entry_cell = np.zeros(0, dtype=np.int64)
+            return
+
+        if cell_size is None:
+            # Big enough that most items sit in one or two cells, small enough
+            # that a cell only holds a handful of items
+            extent = np.maximum(self.max_x - self.min_x, self.max_y - self.min_y)
+            area = np.ptp(self.min_x) * np.ptp(self.min_y)
+            cell_size = max(
+                float(np.median(extent)), float(np.sqrt(area / len(capsules)))
+            )
+        self.cell_size = cell_size
+        self._origin = (float(self.min_x.min()), float(self.min_y.min()))
+
+        first_x, first_y = self._cell_coords(self.min_x, self.min_y)
+        last_x, last_y = self._cell_coords(self.max_x, self.max_y)
+        self._rows = int(last_y.max()) + 1
+        span_x = last_x - first_x + 1
+        span_y = last_y - first_y + 1
+        entries = span_x * span_y
+
+        # One entry per (item, cell) the item overlaps
+        item = np.repeat(np.arange(len(capsules)), entries)
+        within = np.arange(entries.sum()) - np.repeat(
+            np.cumsum(entries) - entries, entries
+        )
+        cell_x = first_x[item] + within // span_y[item]
+        cell_y = first_y[item] + within % span_y[item]
+        cell = cell_x * self._rows + cell_y
+
+        order = np.argsort(cell, kind="stable")
+        self._entry_item = item[order]
+        self._entry_cell = cell[order]
+
+    def _cell_coords(self, x: np.ndarray, y: np.ndarray):
+        return (
+            np.floor((x - self._origin[0]) / self.cell_size).astype(np.int64),
+            np.floor((y - self._origin[1]) / self.cell_size).astype(np.int64),
+        )
+
+    def candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        # Pairs (first < second) whose grown bounding boxes overlap, each
+        # reported once
+        if len(self._entry_cell) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        _, starts, counts = np.unique(
+            self._entry_cell, return_index=True, return_counts=True
+        )
+        group_end = np.repeat(starts + counts, counts)
+        position = np.arange(len(self._entry_cell))
+        partners = group_end - position - 1
+        first_entry = np.repeat(position, partners)
+        second_entry = np.arange(partners.sum()) - np.repeat(
+            np.cumsum(partners) - partners, partners
+        )
+        second_entry += first_entry + 1
+
+        first = self._entry_item[first_entry]
+        second = self._entry_item[second_entry]
+        cell = self._entry_cell[first_entry]
+
+        overlap_x = np.maximum(self.min_x[first], self.min_x[second])
+        overlap_y = np.maximum(self.min_y[first], self.min_y[second])
+        overlaps = (overlap_x <= np.minimum(self.max_x[first], self.max_x[second])) & (
+            overlap_y <= np.minimum(self.max_y[first], self.max_y[second])
+        )
+        # A pair sharing several cells is only kept in the one holding the
+        # corner of their overlap
+        corner_x, corner_y = self._cell_coords(overlap_x, overlap_y)
+        keep = overlaps & (corner_x * self._rows + corner_y == cell)
+
+        first, second = first[keep], second[keep]
+        swap = first > second
+        return np.where(swap, second, first), np.where(swap, first, second)
+
+
+def _point_segment_distance(px, py, ax, ay, bx, by) -> np.ndarray:
+    dx = bx - ax
+    dy = by - ay
+    length_squared = dx * dx + dy * dy
+    t = np.divide(
+        (px - ax) * dx + (py - ay) * dy,
+        length_squared,
+        out=np.zeros_like(length_squared),
+        where=length_squared > 0,
+    )
+    t = np.clip(t, 0, 1)
+    return np.hypot(ax + t * dx - px, ay + t * dy - py)
+
+
+def _segments_distance(ax, ay, bx, by, cx, cy, dx, dy) -> np.ndarray:
+    distance = np.minimum.reduce(
+        [
+            _point_segment_distance(ax, ay, cx, cy, dx, dy),
+            _point_segment_distance(bx, by, cx, cy, dx, dy),
+            _point_segment_distance(cx, cy, ax, ay, bx, by),
+            _point_segment_distance(dx, dy, ax, ay, bx, by),
+        ]
+    )
+
+    # Segments that cross have no end near the other one
+    def side(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    crosses = (side(ax, ay, bx, by, cx, cy) * side(ax, ay, bx, by, dx, dy) < 0) & (
+        side(cx, cy, dx, dy, ax, ay) * side(cx, cy, dx, dy, bx, by) < 0
+    )
+    return np.where(crosses, 0.0, distance)
+
+
+def _segment_distance(c: Capsules, first: np.ndarray, second: np.ndarray):
+    return _segments_distance(
+        c.x0[first],
+        c.y0[first],
+        c.x1[first],
+        c.y1[first],
+        c.x0[second],
+        c.y0[second],
+        c.x1[second],
+        c.y1[second],
+    )
+
+
+def _to_box_frame(c: Capsules, box: np.ndarray, x: np.ndarray, y: np.ndarray):
+    # Into the frame of each pad, where it's axis aligned about the origin
+    dx = x - (c.x0[box] + c.x1[box]) / 2
+    dy = y - (c.y0[box] + c.y1[box]) / 2
+    cos = np.cos(c.angle[box])
+    sin = np.sin(c.angle[box])
+    return dx * cos - dy * sin, dx * sin + dy * cos
+
+
+def _get_box_corners(c: Capsules, box: np.ndarray) -> list[tuple]:
+    # In order round each pad, in board coordinates
+    centre_x = (c.x0[box] + c.x1[box]) / 2
+    centre_y = (c.y0[box] + c.y1[box]) / 2
+    cos = np.cos(c.angle[box])
+    sin = np.sin(c.angle[box])
+    corners = []
+    for sign_x, sign_y in [(-1, -1), (1, -1), (1, 1), (-1, 1)]:
+        u = sign_x * c.half_x[box]
+        v = sign_y * c.half_y[box]
+        corners.append((centre_x + u * cos + v * sin, centre_y + v * cos - u * sin))
+    return corners
+
+
+def _segment_box_distance(
+    c: Capsules, box: np.ndarray, ax, ay, bx, by
+) -> np.ndarray:
+    # Zero if the segment starts inside the pad or crosses one of its edges
+    ax, ay = _to_box_frame(c, box, ax, ay)
+    bx, by = _to_box_frame(c, box, bx, by)
+    half_x = c.half_x[box]
+    half_y = c.half_y[box]
+    corners = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+    distance = np.minimum.reduce(
+        [
+            _segments_distance(
+                ax,
+                ay,
+                bx,
+                by,
+                start_x * half_x,
+                start_y * half_y,
+                end_x * half_x,
+                end_y * half_y,
+            )
+            for (start_x, start_y), (end_x, end_y) in zip(
+                corners, corners[1:] + corners[:1]
+            )
+        ]
+    )
+    inside = (np.abs(ax) <= half_x) & (np.abs(ay) <= half_y)
+    return np.where(inside, 0.0, distance)
+
+
+def _box_edges_distance(c: Capsules, box: np.ndarray, other: np.ndarray):
+    # From each box to the nearest edge of other, another pad
+    corners = _get_box_corners(c, other)
+    return np.minimum.reduce(
+        [
+            _segment_box_distance(c, box, *start, *end)
+            for start, end in zip(corners, corners[1:] + corners[:1])
+        ]
+    )
+
+
+def _get_box_gaps(c: Capsules, first: np.ndarray, second: np.ndarray):
+    # Exact gaps for pairs where at least one item is a pad
+    first_is_box = c.kind[first] == "pad"
+    box = np.where(first_is_box, first, second)
+    other = np.where(first_is_box, second, first)
+    gap = (
+        _segment_box_distance(
+            c, box, c.x0[other], c.y0[other], c.x1[other], c.y1[other]
+        )
+        - c.radius[other]
+    )
+
+    both = c.kind[other] == "pad"
+    if both.any():
+        # Either pad could be entirely inside the other
+        gap[both] = np.minimum(
+            _box_edges_distance(c, box[both], other[both]),
+            _box_edges_distance(c, other[both], box[both]),
+        )
+    return gap
+
+
+def get_gaps(
+    capsules: Capsules, margin: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Edge to edge gap for every pair of capsules on a shared layer that are
+    closer than margin. Returns (first, second, gap), negative gaps overlap.
+    """
+    first, second = GridIndex(capsules, margin).candidate_pairs()
+    shared = (capsules.layers[first] & capsules.layers[second]) != 0
+    first, second = first[shared], second[shared]
+    gap = (
+        _segment_distance(capsules, first, second)
+        - capsules.radius[first]
+        - capsules.radius[second]
+    )
+    has_box = (capsules.kind[first] == "pad") | (capsules.kind[second] == "pad")
+    if has_box.any():
+        gap[has_box] = _get_box_gaps(capsules, first[has_box], second[has_box])
+    close = gap < margin
+    return first[close], second[close], gap[close]
+
+
+def get_point_gaps(
+    capsules: Capsules, item: np.ndarray, x: np.ndarray, y: np.ndarray
+) -> np.ndarray:
+    """
+    Gap from the edge of each item to the point (x, y) in mm, zero or less if
+    the point is inside it.
+    """
+    gap = (
+        _point_segment_distance(
+            x,
+            y,
+            capsules.x0[item],
+            capsules.y0[item],
+            capsules.x1[item],
+            capsules.y1[item],
+        )
+        - capsules.radius[item]
+    )
+    is_box = capsules.kind[item] == "pad"
+    if is_box.any():
+        gap[is_box] = _segment_box_distance(
+            capsules, item[is_box], x[is_box], y[is_box], x[is_box], y[is_box]
+        )
+    return gap
+
+
+@dataclass
+class ClearanceViolation:
+    first: str  # e.g. "segment 12"
+    second: str
+    nets: tuple[str, str]
+    gap_mm: float  # Zero or less is a short
+    refs: tuple[str, ...]  # LEDs owning either item
+
+    @property
+    def is_short(self) -> bool:
+        return self.gap_mm <= 0
+
+    def __repr__(self):
+        problem = "Short" if self.is_short else f"{self.gap_mm:.3f}mm clearance"
+        refs = f" ({', '.join(self.refs)})" if self.refs else ""
+        return (
+            f"{problem} between {self.first} on {self.nets[0]} and "
+            f"{self.second} on {self.nets[1]}{refs}"
+        )
+
+
+def _get_connected_groups(
+    count: int, first: np.ndarray, second: np.ndarray
+) -> np.ndarray:
+    # Label every item with the lowest index of anything it's connected to
+    labels = np.arange(count)
+    while True:
+        lowest = np.minimum(labels[first], labels[second])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, first, lowest)
+        np.minimum.at(new_labels, second, lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def _get_connected_nets(
+    capsules: Capsules, first: np.ndarray, second: np.ndarray, gap: np.ndarray
+) -> np.ndarray:
+    # Copper takes the net of the pads it touches, directly or through other
+    # copper. If those pads are on different nets, it takes one of them and
+    # the short shows up against the others.
+    touching = gap <= 0
+    groups = _get_connected_groups(len(capsules), first[touching], second[touching])
+    is_pad = capsules.kind == "pad"
+    group_nets = np.full(len(capsules), -1)
+    group_nets[groups[is_pad]] = capsules.net[is_pad]
+    nets = group_nets[groups]
+    return np.where(is_pad | (nets < 0), capsules.net, nets)
+
+
+def check_clearance(
+    layout: BowtieLayout,
+    clearance_mm: float = DEFAULT_CLEARANCE_MM,
+    pads: Optional[Pads] = None,
+) -> list[ClearanceViolation]:
+    """
+    Find every pair of items on different nets that share a layer and are less
+    than clearance_mm apart, including shorts.
+
+    With pads, copper is on the net of the pads it connects to rather than its
+    planned net, so it's checked against the pads and copper of every other
+    net.
+    """
+    start_time = perf_counter()
+    capsules = Capsules.from_layout(layout, pads)
+    first, second, gap = get_gaps(capsules, clearance_mm)
+    net = capsules.net
+    if pads is not None:
+        net = _get_connected_nets(capsules, first, second, gap)
+    different_nets = net[first] != net[second]
+    first, second, gap = first[different_nets], second[different_nets], gap[
+        different_nets
+    ]
+
+    refs = layout.placements.refs
+    violations = []
+    for a, b, gap_mm in zip(first.tolist(), second.tolist(), gap.tolist()):
+        leds = sorted({capsules.led[x] for x in (a, b) if capsules.led[x] >= 0})
+        violations.append(
+            ClearanceViolation(
+                first=f"{capsules.kind[a]} {capsules.index[a]}",
+                second=f"{capsules.kind[b]} {capsules.index[b]}",
+                nets=(capsules.nets[net[a]], capsules.nets[net[b]]),
+                gap_mm=gap_mm,
+                refs=tuple(str(refs[x]) for x in leds),
+            )
+        )
+
+    logger.info(
+        f"Checked {len(capsules)} items for {clearance_mm}mm clearance in "
+        f"{perf_counter() - start_time:.3f}s, {len(violations)} violations"
+    )
+    return violations
+
+
+def get_violating_refs(violations: list[ClearanceViolation]) -> list[str]:
+    refs = {x for violation in violations for x in violation.refs}
+    return sorted(refs, key=lambda x: (len(x), x))
+
+
+def get_min_clearance(layout: BowtieLayout, search_mm: float) -> float:
+    # Smallest gap between any two items on a shared layer that don't touch,
+    # whatever their nets. Touching items are connected on purpose, shorts
+    # are check_clearance's job. Gaps of search_mm or more aren't looked for
+    _, _, gap = get_gaps(Capsules.from_layout(layout), search_mm)
+    gap = gap[gap > 0]
+    return float(gap.min()) if len(gap) else float("inf")
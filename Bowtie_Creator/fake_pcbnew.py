@@ -0,0 +1,507 @@
+"""
+Pure-Python stand-in for the subset of pcbnew used by the bowtie creator.
+
+Every call is counted and can be slowed down to mimic the cost of crossing into
+Kicad through SWIG, so the generator can be run, profiled and benchmarked
+without Kicad installed. Call install() before importing anything that does
+`import pcbnew`.
+"""
+
+import copy
+import math
+import sys
+from collections import Counter
+from functools import wraps
+from itertools import count
+from time import perf_counter
+from typing import Optional
+
+# Kicad 8 layer IDs
+F_Cu = 0
+In1_Cu = 1
+In2_Cu = 2
+In3_Cu = 3
+In4_Cu = 4
+In5_Cu = 5
+In6_Cu = 6
+In7_Cu = 7
+In8_Cu = 8
+B_Cu = 31
+
+# KICAD_T values for the item types the generator touches
+PCB_FOOTPRINT_T = 1
+PCB_VIA_T = 6
+PCB_TRACE_T = 7
+PCB_ARC_T = 8
+PCB_GROUP_T = 9
+PCB_NETINFO_T = 100
+
+ADD_MODE_INSERT = 0
+ADD_MODE_APPEND = 1
+ADD_MODE_BULK_APPEND = 2
+ADD_MODE_BULK_INSERT = 3
+REMOVE_MODE_NORMAL = 0
+REMOVE_MODE_BULK = 1
+
+call_counts: Counter = Counter()
+_latency_s: dict[Optional[str], float] = {}
+
+
+def reset_call_counts() -> None:
+    call_counts.clear()
+
+
+def set_latency(latency_s: float, call_name: Optional[str] = None) -> None:
+    # call_name is e.g. "BOARD.Add" or "FromMM", None sets the default for all
+    _latency_s[call_name] = latency_s
+
+
+def clear_latency() -> None:
+    _latency_s.clear()
+
+
+def _delay(call_name: str) -> None:
+    call_counts[call_name] += 1
+    latency_s = _latency_s.get(call_name, _latency_s.get(None, 0.0))
+    if latency_s:
+        # sleep() is far too coarse for microsecond latencies
+        end_time = perf_counter() + latency_s
+        while perf_counter() < end_time:
+            pass
+
+
+def _instrument(call_name: str, function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        _delay(call_name)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+class _InstrumentedType(type):
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        for attribute_name, attribute in namespace.items():
+            if callable(attribute) and not attribute_name.startswith("_"):
+                call_name = f"{name}.{attribute_name}"
+                setattr(cls, attribute_name, _instrument(call_name, attribute))
+
+    def __call__(cls, *args, **kwargs):
+        # Constructing an object is a call into Kicad too
+        _delay(f"{cls.__name__}()")
+        return super().__call__(*args, **kwargs)
+
+
+class _Instrumented(metaclass=_InstrumentedType):
+    pass
+
+
+def _from_mm(mm: float) -> int:
+    # Kicad rounds half away from zero
+    nm = mm * 1e6
+    return int(nm + 0.5) if nm >= 0 else -int(-nm + 0.5)
+
+
+def _to_mm(nm: int) -> float:
+    return nm / 1e6
+
+
+def _refresh() -> None:
+    pass
+
+
+FromMM = _instrument("FromMM", _from_mm)
+ToMM = _instrument("ToMM", _to_mm)
+Refresh = _instrument("Refresh", _refresh)
+
+_uuid_counter = count(1)
+
+
+class KIID:
+    def __init__(self):
+        self._uuid = f"00000000-0000-4000-8000-{next(_uuid_counter):012x}"
+
+    def AsString(self) -> str:
+        return self._uuid
+
+
+class VECTOR2I:
+    def __init__(self, x: int = 0, y: int = 0):
+        self.x = int(x)
+        self.y = int(y)
+
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+    def __repr__(self):
+        return f"VECTOR2I({self.x}, {self.y})"
+
+
+class NETINFO_ITEM(_Instrumented):
+    def __init__(self, board: Optional["BOARD"], net_name: str, net_code: int = -1):
+        self._board = board
+        self._net_name = net_name
+        self._net_code = net_code
+
+    def GetNetCode(self) -> int:
+        return self._net_code
+
+    def GetNetname(self) -> str:
+        return self._net_name
+
+    def Type(self) -> int:
+        return PCB_NETINFO_T
+
+
+class BOARD_ITEM(_Instrumented):
+    def __init__(self, board: Optional["BOARD"] = None):
+        self._board = board
+        self._layer = F_Cu
+        self._net_code = 0
+        self._group: Optional["PCB_GROUP"] = None
+        self.m_Uuid = KIID()
+
+    def GetBoard(self) -> Optional["BOARD"]:
+        return self._board
+
+    def GetParentGroup(self) -> Optional["PCB_GROUP"]:
+        return self._group
+
+    def SetLayer(self, layer: int) -> None:
+        self._layer = layer
+
+    def GetLayer(self) -> int:
+        return self._layer
+
+    def IsOnLayer(self, layer: int) -> bool:
+        return self._layer == layer
+
+    def SetNetCode(self, net_code: int) -> None:
+        # Kicad looks the code up in the board's net list
+        self._net_code = net_code
+
+    def SetNet(self, net: NETINFO_ITEM) -> None:
+        self._net_code = net._net_code
+
+    def GetNetCode(self) -> int:
+        return self._net_code
+
+    def Duplicate(self) -> "BOARD_ITEM":
+        # Same item with a new UUID, not yet on the board
+        duplicate = copy.copy(self)
+        duplicate.m_Uuid = KIID()
+        duplicate._group = None
+        return duplicate
+
+    def Cast(self) -> "BOARD_ITEM":
+        return self
+
+    def GetNetname(self) -> str:
+        if self._board is None:
+            return ""
+        net = self._board._nets_by_code.get(self._net_code)
+        return "" if net is None else net.GetNetname()
+
+
+class PCB_TRACK(BOARD_ITEM):
+    def __init__(self, board: Optional["BOARD"] = None):
+        super().__init__(board)
+        self._start = VECTOR2I()
+        self._end = VECTOR2I()
+        self._width = 0
+
+    def Type(self) -> int:
+        return PCB_TRACE_T
+
+    def GetClass(self) -> str:
+        return "PCB_TRACK"
+
+    def SetStart(self, point: VECTOR2I) -> None:
+        self._start = point
+
+    def SetEnd(self, point: VECTOR2I) -> None:
+        self._end = point
+
+    def SetStartEnd(self, start: VECTOR2I, end: VECTOR2I) -> None:
+        self._start = start
+        self._end = end
+
+    def GetStart(self) -> VECTOR2I:
+        return self._start
+
+    def GetEnd(self) -> VECTOR2I:
+        return self._end
+
+    def SetWidth(self, width: int) -> None:
+        self._width = width
+
+    def GetWidth(self) -> int:
+        return self._width
+
+
+class PCB_ARC(PCB_TRACK):
+    def Type(self) -> int:
+        return PCB_ARC_T
+
+    def GetClass(self) -> str:
+        return "PCB_ARC"
+
+
+class PCB_VIA(PCB_TRACK):
+    def __init__(self, board: Optional["BOARD"] = None):
+        super().__init__(board)
+        self._drill = 0
+
+    def Type(self) -> int:
+        return PCB_VIA_T
+
+    def GetClass(self) -> str:
+        return "PCB_VIA"
+
+    def IsOnLayer(self, layer: int) -> bool:
+        # Only through vias are modelled
+        return True
+
+    def SetX(self, x: int) -> None:
+        self.SetPosition(VECTOR2I(x, self._start.y))
+
+    def SetY(self, y: int) -> None:
+        self.SetPosition(VECTOR2I(self._start.x, y))
+
+    def SetPosition(self, point: VECTOR2I) -> None:
+        self._start = point
+        self._end = point
+
+    def GetPosition(self) -> VECTOR2I:
+        return self._start
+
+    def SetDrill(self, drill: int) -> None:
+        self._drill = drill
+
+    def GetDrill(self) -> int:
+        return self._drill
+
+
+class PCB_GROUP(BOARD_ITEM):
+    def __init__(self, board: Optional["BOARD"] = None):
+        super().__init__(board)
+        self._name = ""
+        self._items: dict[int, BOARD_ITEM] = {}
+
+    def Type(self) -> int:
+        return PCB_GROUP_T
+
+    def SetName(self, name: str) -> None:
+        self._name = name
+
+    def GetName(self) -> str:
+        return self._name
+
+    def AddItem(self, item: BOARD_ITEM) -> bool:
+        # Like Kicad, an item moves out of any group it was already in
+        if item._group is not None:
+            item._group.RemoveItem(item)
+        self._items[id(item)] = item
+        item._group = self
+        return True
+
+    def RemoveItem(self, item: BOARD_ITEM) -> bool:
+        if self._items.pop(id(item), None) is None:
+            return False
+        item._group = None
+        return True
+
+    def GetItems(self) -> list[BOARD_ITEM]:
+        return list(self._items.values())
+
+
+class PCB_TEXT(_Instrumented):
+    def __init__(self):
+        self._visible = True
+
+    def SetVisible(self, visible: bool) -> None:
+        self._visible = visible
+
+    def IsVisible(self) -> bool:
+        return self._visible
+
+
+class PAD(_Instrumented):
+    def __init__(self, footprint: Optional["FOOTPRINT"] = None):
+        self._footprint = footprint
+        self._number = ""
+        # Relative to the footprint at orientation 0
+        self._offset = VECTOR2I()
+        self._relative_orientation = 0.0
+        self._size = VECTOR2I()
+        self._net: Optional[NETINFO_ITEM] = None
+
+    def SetNumber(self, number: str) -> None:
+        self._number = number
+
+    def SetSize(self, size: VECTOR2I) -> None:
+        self._size = size
+
+    def GetSize(self) -> VECTOR2I:
+        return self._size
+
+    def SetOrientationDegrees(self, orientation: float) -> None:
+        # Absolute, like Kicad, but kept relative so it follows the footprint
+        self._relative_orientation = orientation - self._footprint._orientation
+
+    def GetOrientationDegrees(self) -> float:
+        return (self._footprint._orientation + self._relative_orientation) % 360
+
+    def SetNet(self, net: NETINFO_ITEM) -> None:
+        self._net = net
+
+    def GetNetname(self) -> str:
+        return "" if self._net is None else self._net.GetNetname()
+
+    def GetNumber(self) -> str:
+        return self._number
+
+    def SetFPRelativePosition(self, point: VECTOR2I) -> None:
+        self._offset = point
+
+    def GetPosition(self) -> VECTOR2I:
+        # Pads follow their footprint, rotating anticlockwise with Y down
+        footprint = self._footprint
+        angle = math.radians(footprint._orientation)
+        x = self._offset.x * math.cos(angle) + self._offset.y * math.sin(angle)
+        y = self._offset.y * math.cos(angle) - self._offset.x * math.sin(angle)
+        return VECTOR2I(
+            footprint._position.x + round(x), footprint._position.y + round(y)
+        )
+
+
+class FOOTPRINT(BOARD_ITEM):
+    def __init__(self, board: Optional["BOARD"] = None):
+        super().__init__(board)
+        self._reference = PCB_TEXT()
+        self._reference_text = ""
+        self._position = VECTOR2I()
+        self._orientation = 0.0
+        self._fpid = ""
+        self._pads: list[PAD] = []
+
+    def Type(self) -> int:
+        return PCB_FOOTPRINT_T
+
+    def SetReference(self, reference: str) -> None:
+        self._reference_text = reference
+
+    def GetReference(self) -> str:
+        return self._reference_text
+
+    def Reference(self) -> PCB_TEXT:
+        return self._reference
+
+    def SetFPIDAsString(self, fpid: str) -> None:
+        self._fpid = fpid
+
+    def GetFPIDAsString(self) -> str:
+        return self._fpid
+
+    def Add(self, pad: PAD) -> None:
+        pad._footprint = self
+        self._pads.append(pad)
+
+    def Pads(self) -> list[PAD]:
+        return list(self._pads)
+
+    def SetLayerAndFlip(self, layer: int) -> None:
+        self._layer = layer
+
+    def SetX(self, x: int) -> None:
+        self._position = VECTOR2I(x, self._position.y)
+
+    def SetY(self, y: int) -> None:
+        self._position = VECTOR2I(self._position.x, y)
+
+    def SetPosition(self, point: VECTOR2I) -> None:
+        self._position = point
+
+    def GetPosition(self) -> VECTOR2I:
+        return self._position
+
+    def SetOrientationDegrees(self, orientation: float) -> None:
+        self._orientation = orientation
+
+    def GetOrientationDegrees(self) -> float:
+        return self._orientation
+
+
+class BOARD(_Instrumented):
+    def __init__(self):
+        # Dicts keep insertion order and give O(1) removal
+        self._tracks: dict[int, PCB_TRACK] = {}
+        self._footprints: dict[int, FOOTPRINT] = {}
+        self._groups: dict[int, PCB_GROUP] = {}
+        self._nets_by_code: dict[int, NETINFO_ITEM] = {}
+        self._nets_by_name: dict[str, NETINFO_ITEM] = {}
+        self._file_name = ""
+
+    def Add(self, item, mode: int = ADD_MODE_INSERT, skip_connectivity=False):
+        if isinstance(item, NETINFO_ITEM):
+            if item._net_code < 0:
+                item._net_code = len(self._nets_by_code) + 1
+            self._nets_by_code[item._net_code] = item
+            self._nets_by_name[item._net_name] = item
+        elif isinstance(item, FOOTPRINT):
+            self._footprints[id(item)] = item
+        elif isinstance(item, PCB_GROUP):
+            self._groups[id(item)] = item
+        else:
+            self._tracks[id(item)] = item
+        item._board = self
+
+    def Remove(self, item, mode: int = REMOVE_MODE_NORMAL) -> None:
+        if isinstance(item, FOOTPRINT):
+            del self._footprints[id(item)]
+        elif isinstance(item, PCB_GROUP):
+            del self._groups[id(item)]
+        else:
+            del self._tracks[id(item)]
+
+    def Delete(self, item) -> None:
+        self.Remove(item)
+
+    def GetTracks(self) -> list[PCB_TRACK]:
+        return list(self._tracks.values())
+
+    def GetFootprints(self) -> list[FOOTPRINT]:
+        return list(self._footprints.values())
+
+    def Groups(self) -> list[PCB_GROUP]:
+        return list(self._groups.values())
+
+    def FindFootprintByReference(self, reference: str) -> Optional[FOOTPRINT]:
+        # Linear, like the real thing
+        for footprint in self._footprints.values():
+            if footprint.GetReference() == reference:
+                return footprint
+        return None
+
+    def FindNet(self, net_name: str) -> Optional[NETINFO_ITEM]:
+        return self._nets_by_name.get(net_name)
+
+    def BuildConnectivity(self) -> None:
+        pass
+
+    def SetFileName(self, file_name: str) -> None:
+        self._file_name = file_name
+
+    def GetFileName(self) -> str:
+        return self._file_name
+
+
+class ActionPlugin:
+    def register(self) -> None:
+        pass
+
+
+def install() -> None:
+    # Make `import pcbnew` resolve to this module
+    sys.modules["pcbnew"] = sys.modules[__name__]
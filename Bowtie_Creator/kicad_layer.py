@@ -0,0 +1,55 @@
+from enum import Enum, auto
+
+# pcbnew layer IDs, looked up on first use and then kept for every later call
+_layer_codes: dict["KicadLayer", int] = {}
+
+
+class KicadLayer(Enum):
+    TOP = auto()
+    L2 = auto()
+    L3 = auto()
+    L4 = auto()
+    L5 = auto()
+    L6 = auto()
+    L7 = auto()
+    L8 = auto()
+    L9 = auto()
+    BOTTOM = auto()
+
+    def get_layer_code(self) -> int:
+        if not _layer_codes:
+            # Imported here so the layer enum can be used by the pure-geometry
+            # planner without Kicad being available
+            import pcbnew
+
+            _layer_codes.update(
+                {
+                    KicadLayer.TOP: pcbnew.F_Cu,
+                    KicadLayer.L2: pcbnew.In1_Cu,
+                    KicadLayer.L3: pcbnew.In2_Cu,
+                    KicadLayer.L4: pcbnew.In3_Cu,
+                    KicadLayer.L5: pcbnew.In4_Cu,
+                    KicadLayer.L6: pcbnew.In5_Cu,
+                    KicadLayer.L7: pcbnew.In6_Cu,
+                    KicadLayer.L8: pcbnew.In7_Cu,
+                    KicadLayer.L9: pcbnew.In8_Cu,
+                    KicadLayer.BOTTOM: pcbnew.B_Cu,
+                }
+            )
+        return _layer_codes[self]
+
+    def get_layer_name(self) -> str:
+        # Canonical names as written in .kicad_pcb files
+        layer_names = {
+            KicadLayer.TOP: "F.Cu",
+            KicadLayer.L2: "In1.Cu",
+            KicadLayer.L3: "In2.Cu",
+            KicadLayer.L4: "In3.Cu",
+            KicadLayer.L5: "In4.Cu",
+            KicadLayer.L6: "In5.Cu",
+            KicadLayer.L7: "In6.Cu",
+            KicadLayer.L8: "In7.Cu",
+            KicadLayer.L9: "In8.Cu",
+            KicadLayer.BOTTOM: "B.Cu",
+        }
+        return layer_names[self]
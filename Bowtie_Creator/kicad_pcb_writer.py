@@ -0,0 +1,498 @@
+"""
+Headless writer that streams a bowtie layout into an existing .kicad_pcb file.
+
+The board is never loaded into pcbnew. The file is read line by line: footprint
+positions are rewritten in place with their references hidden, old tracks and
+vias are optionally dropped and the new segments and vias are written just
+before the final closing bracket. Only one footprint is held in memory at a
+time.
+
+Like create_bowtie, the LED pad offsets are read from the first LED's footprint
+in the file, from its pads' positions. Pass --no-footprint-pads to route to the
+spec's constant offsets instead.
+
+    python kicad_pcb_writer.py board.kicad_pcb [-o regenerated.kicad_pcb]
+"""
+
+import argparse
+import logging
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Optional, TextIO
+
+import numpy as np
+
+from bowtie_layout import BowtieLayout, mm_to_nm
+from kicad_layer import KicadLayer
+
+logger = logging.getLogger(__name__)
+
+# Kicad 8 replaced "tstamp" with "uuid" from this file version onwards
+UUID_TOKEN_VERSION = 20231007
+
+_NET_PATTERN = re.compile(r'^\s*\(net (\d+) "((?:[^"\\]|\\.)*)"\)\s*$')
+_VERSION_PATTERN = re.compile(r"\(version (\d+)\)")
+_REFERENCE_PATTERN = re.compile(
+    r'\((?:property "Reference"|fp_text reference) "((?:[^"\\]|\\.)*)"'
+)
+_LAYER_PATTERN = re.compile(r'\(layer "([^"]+)"')
+_PAD_PATTERN = re.compile(r'\(pad "((?:[^"\\]|\\.)*)"')
+_TRACK_ITEMS = ("(segment", "(via", "(arc")
+
+
+@dataclass
+class WriteStats:
+    footprints_moved: int = 0
+    segments_written: int = 0
+    vias_written: int = 0
+    tracks_dropped: int = 0
+    elapsed_s: float = 0.0
+
+    def __repr__(self):
+        return (
+            f"{self.footprints_moved} footprints moved, "
+            f"{self.segments_written} segments and {self.vias_written} vias "
+            f"written, {self.tracks_dropped} old tracks dropped in "
+            f"{self.elapsed_s:.3f}s"
+        )
+
+
+def _format_mm(nm: int) -> str:
+    # Same style as Kicad: up to 6 decimal places, no trailing zeros
+    return f"{nm / 1e6:.6f}".rstrip("0").rstrip(".")
+
+
+def _format_angle(angle: float) -> str:
+    return f"{angle:.6f}".rstrip("0").rstrip(".")
+
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\(.)", r"\1", text)
+
+
+def _depth_change(line: str) -> int:
+    if '"' not in line:
+        return line.count("(") - line.count(")")
+
+    # Brackets inside strings don't count
+    change = 0
+    in_string = False
+    escaped = False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+        elif not in_string:
+            if char == "(":
+                change += 1
+            elif char == ")":
+                change -= 1
+    return change
+
+
+def _iter_at_lists(line: str, depth: int) -> Iterator[tuple[int, int, int]]:
+    # Yields (start, end, depth) for every "(at ...)" list in the line, where
+    # depth is the number of brackets open before it
+    in_string = False
+    escaped = False
+    at_start = None
+    for index, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            if at_start is None and line.startswith("(at ", index):
+                at_start = (index, depth)
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if at_start is not None and depth == at_start[1]:
+                yield at_start[0], index + 1, at_start[1]
+                at_start = None
+
+
+def _find_end(text: str, start: int) -> int:
+    # Index just past the list, string or bare token starting at start
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+            if not in_string and depth == 0:
+                return index + 1
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            if depth == 0:
+                return index
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        elif depth == 0 and char.isspace():
+            return index
+    return len(text)
+
+
+def _iter_children(text: str, start: int) -> Iterator[tuple[int, int]]:
+    # Yields (start, end) of every list, string and bare token directly inside
+    # the list opened at start
+    index = start + 1
+    while index < len(text) and text[index] != ")":
+        if text[index].isspace():
+            index += 1
+            continue
+        end = _find_end(text, index)
+        yield index, end
+        index = end
+
+
+def _hide_reference(block: str) -> str:
+    # Hidden like the live board, where the references would cover the tracks
+    ref_match = _REFERENCE_PATTERN.search(block)
+    if ref_match is None:
+        return block
+    start = ref_match.start()
+    is_property = ref_match.group(0).startswith("(property")
+    insert_at = ref_match.end()
+    for child_start, child_end in _iter_children(block, start):
+        child = block[child_start:child_end]
+        if child == "hide" or child == "(hide yes)":
+            return block
+        if child.startswith("(hide "):
+            return f"{block[:child_start]}(hide yes){block[child_end:]}"
+        if child.startswith("(layer "):
+            insert_at = child_end
+    # Kicad 8 gave properties a (hide yes), before that it was a bare token
+    hide = " (hide yes)" if is_property else " hide"
+    return f"{block[:insert_at]}{hide}{block[insert_at:]}"
+
+
+def _rewrite_footprint(
+    lines: list[str],
+    depth: int,
+    x_nm: int,
+    y_nm: int,
+    rotation: float,
+    layer: KicadLayer,
+) -> list[str]:
+    block = "".join(lines)
+    layer_match = _LAYER_PATTERN.search(block)
+    if layer_match is None or layer_match.group(1) != layer.get_layer_name():
+        # Flipping means mirroring every child item, which needs pcbnew
+        raise ValueError(
+            f"Footprint is on {layer_match and layer_match.group(1)}, "
+            f"cannot move it to {layer.get_layer_name()} headlessly"
+        )
+
+    new_lines = []
+    rotation_delta = None
+    line_depth = depth
+    for line in lines:
+        pieces = []
+        last_end = 0
+        for start, end, at_depth in _iter_at_lists(line, line_depth):
+            values = line[start + 4 : end - 1].split()
+            if at_depth == depth + 1 and rotation_delta is None:
+                # The footprint's own position
+                old_rotation = float(values[2]) if len(values) > 2 else 0.0
+                rotation_delta = rotation - old_rotation
+                new_values = [_format_mm(x_nm), _format_mm(y_nm)]
+                if rotation % 360:
+                    new_values.append(_format_angle(rotation % 360))
+            elif at_depth == depth + 2 and rotation_delta:
+                # Pad and text angles are stored relative to the board, not
+                # the footprint, so have to follow the footprint round
+                angle = float(values[2]) if len(values) > 2 else 0.0
+                angle = (angle + rotation_delta) % 360
+                new_values = values[:2] + [_format_angle(angle)] + values[3:]
+            else:
+                continue
+            pieces.append(line[last_end:start])
+            pieces.append(f"(at {' '.join(new_values)})")
+            last_end = end
+        pieces.append(line[last_end:])
+        new_lines.append("".join(pieces))
+        line_depth += _depth_change(line)
+
+    if rotation_delta is None:
+        raise ValueError("Footprint has no position")
+    return [_hide_reference("".join(new_lines))]
+
+
+def _get_pad_offsets(
+    lines: list[str], depth: int
+) -> tuple[list[str], list[int], list[int]]:
+    # Pad positions in the file are already relative to the unrotated footprint
+    numbers = []
+    x = []
+    y = []
+    line_depth = depth
+    for line in lines:
+        pad_match = _PAD_PATTERN.search(line)
+        if pad_match is not None:
+            numbers.append(_unescape(pad_match.group(1)))
+        for start, end, at_depth in _iter_at_lists(line, line_depth):
+            if at_depth == depth + 2 and len(x) < len(numbers):
+                values = line[start + 4 : end - 1].split()
+                x.append(int(mm_to_nm(float(values[0]))))
+                y.append(int(mm_to_nm(float(values[1]))))
+        line_depth += _depth_change(line)
+    return numbers, x, y
+
+
+def read_pad_offsets(
+    source_path: Path, ref: str
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Return (numbers, x, y) of the pads of footprint ref in source_path, in nm
+    relative to the unrotated footprint. Only reads as far as that footprint.
+    """
+    depth = 0
+    block: list[str] = []
+    with open(source_path, "r", encoding="utf-8") as source:
+        for line in source:
+            start_depth = depth
+            depth += _depth_change(line)
+            if block or (start_depth == 1 and line.lstrip().startswith("(footprint")):
+                block.append(line)
+                if depth > 1:
+                    continue
+                ref_match = _REFERENCE_PATTERN.search("".join(block))
+                if ref_match is not None and _unescape(ref_match.group(1)) == ref:
+                    numbers, x, y = _get_pad_offsets(block, 1)
+                    return (
+                        numbers,
+                        np.array(x, dtype=np.int64),
+                        np.array(y, dtype=np.int64),
+                    )
+                block = []
+    raise ValueError(f"Couldn't find {ref}")
+
+
+def _write_tracks(
+    output: TextIO,
+    layout: BowtieLayout,
+    net_codes: dict[str, int],
+    uuid_token: str,
+) -> tuple[int, int]:
+    for net_name in layout.nets:
+        if net_name not in net_codes:
+            raise ValueError(f"Couldn't find net {net_name}")
+    nets = [net_codes[x] for x in layout.nets]
+    layer_names = {x.value: x.get_layer_name() for x in KicadLayer}
+
+    segments = layout.segments
+    for x0, y0, x1, y1, width, layer, net in zip(
+        segments.x0.tolist(),
+        segments.y0.tolist(),
+        segments.x1.tolist(),
+        segments.y1.tolist(),
+        segments.width.tolist(),
+        segments.layer.tolist(),
+        segments.net.tolist(),
+    ):
+        output.write(
+            f"\t(segment (start {_format_mm(x0)} {_format_mm(y0)}) "
+            f"(end {_format_mm(x1)} {_format_mm(y1)}) (width {_format_mm(width)}) "
+            f'(layer "{layer_names[layer]}") (net {nets[net]}) '
+            f'({uuid_token} "{uuid.uuid4()}"))\n'
+        )
+
+    vias = layout.vias
+    for x, y, drill, pad, net in zip(
+        vias.x.tolist(),
+        vias.y.tolist(),
+        vias.drill.tolist(),
+        vias.pad.tolist(),
+        vias.net.tolist(),
+    ):
+        output.write(
+            f"\t(via (at {_format_mm(x)} {_format_mm(y)}) (size {_format_mm(pad)}) "
+            f'(drill {_format_mm(drill)}) (layers "F.Cu" "B.Cu") (net {nets[net]}) '
+            f'({uuid_token} "{uuid.uuid4()}"))\n'
+        )
+
+    return len(segments), len(vias)
+
+
+def write_layout_to_kicad_pcb(
+    source_path: Path,
+    layout: BowtieLayout,
+    dest_path: Optional[Path] = None,
+    replace_tracks: bool = True,
+) -> WriteStats:
+    """
+    Stream source_path into dest_path (default: overwrite source_path) with the
+    layout applied.
+
+    With replace_tracks, every existing segment, via and arc is dropped first,
+    matching what create_bowtie does to a live board.
+    """
+    start_time = perf_counter()
+    stats = WriteStats()
+    dest_path = source_path if dest_path is None else dest_path
+
+    placements = layout.placements
+    targets = {
+        ref: (x, y, rotation, KicadLayer(layer))
+        for ref, x, y, rotation, layer in zip(
+            placements.refs.tolist(),
+            placements.x.tolist(),
+            placements.y.tolist(),
+            placements.rotation.tolist(),
+            placements.layer.tolist(),
+        )
+    }
+    found_refs = set()
+
+    net_codes: dict[str, int] = {}
+    uuid_token = "tstamp"
+    depth = 0
+    block: list[str] = []
+    block_kind = None
+
+    # Write next to the destination then swap in, so a failure part way through
+    # never leaves a truncated board behind
+    temp_path = dest_path.with_name(f".{dest_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(source_path, "r", encoding="utf-8") as source, open(
+            temp_path, "w", encoding="utf-8", newline=""
+        ) as output:
+            for line in source:
+                start_depth = depth
+                depth += _depth_change(line)
+
+                if block_kind is not None:
+                    block.append(line)
+                    if depth > 1:
+                        continue
+                    if block_kind == "footprint":
+                        ref_match = _REFERENCE_PATTERN.search("".join(block))
+                        ref = ref_match and _unescape(ref_match.group(1))
+                        if ref in targets:
+                            block = _rewrite_footprint(block, 1, *targets[ref])
+                            found_refs.add(ref)
+                            stats.footprints_moved += 1
+                        output.writelines(block)
+                    else:
+                        stats.tracks_dropped += 1
+                    block = []
+                    block_kind = None
+                    continue
+
+                if start_depth == 1:
+                    stripped = line.lstrip()
+                    net_match = _NET_PATTERN.match(line)
+                    if net_match is not None:
+                        net_codes[_unescape(net_match.group(2))] = int(
+                            net_match.group(1)
+                        )
+                    elif stripped.startswith("(footprint"):
+                        block_kind = "footprint"
+                    elif replace_tracks and stripped.startswith(_TRACK_ITEMS):
+                        block_kind = "track"
+
+                    if block_kind is not None:
+                        block.append(line)
+                        if depth > 1:
+                            continue
+                        # Single line item, handle it straight away
+                        if block_kind == "track":
+                            stats.tracks_dropped += 1
+                        else:
+                            output.writelines(block)
+                        block = []
+                        block_kind = None
+                        continue
+
+                if start_depth <= 1 and uuid_token == "tstamp":
+                    version_match = _VERSION_PATTERN.search(line)
+                    if version_match is not None:
+                        if int(version_match.group(1)) >= UUID_TOKEN_VERSION:
+                            uuid_token = "uuid"
+
+                if start_depth >= 1 and depth == 0:
+                    if line.strip() != ")":
+                        raise ValueError("Unexpected content at end of board file")
+                    missing_refs = targets.keys() - found_refs
+                    if missing_refs:
+                        raise ValueError(
+                            f"Couldn't find {', '.join(sorted(missing_refs))}"
+                        )
+                    stats.segments_written, stats.vias_written = _write_tracks(
+                        output, layout, net_codes, uuid_token
+                    )
+
+                output.write(line)
+
+        os.replace(temp_path, dest_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+    stats.elapsed_s = perf_counter() - start_time
+    logger.info(f"Wrote {dest_path}: {stats}")
+    return stats
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from array_placement import get_default_refs
+    from bowtie_layout import BowtieSpec, get_spec_with_pad_offsets
+    from layout_optimiser import optimise_layout
+    from plan_cache import get_layout
+
+    parser = argparse.ArgumentParser(
+        description="Write the default bowtie into a .kicad_pcb file without Kicad"
+    )
+    parser.add_argument("board", type=Path)
+    parser.add_argument("-o", "--output", type=Path, help="Defaults to the input")
+    parser.add_argument(
+        "--keep-tracks",
+        action="store_true",
+        help="Don't drop the existing tracks and vias",
+    )
+    parser.add_argument(
+        "--no-optimise", action="store_true", help="Skip merging collinear tracks"
+    )
+    parser.add_argument(
+        "--no-footprint-pads",
+        action="store_true",
+        help="Route to the default LED pad offsets, not those of the footprint",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    spec = BowtieSpec()
+    if not args.no_footprint_pads:
+        spec = get_spec_with_pad_offsets(
+            spec, *read_pad_offsets(args.board, str(get_default_refs(1)[0]))
+        )
+    layout = get_layout(spec)
+    if not args.no_optimise:
+        layout = optimise_layout(layout)
+    write_layout_to_kicad_pcb(
+        args.board, layout, args.output, replace_tracks=not args.keep_tracks
+    )
+
+
+if __name__ == "__main__":
+    main()
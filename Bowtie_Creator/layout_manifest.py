@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from bowtie_layout import BowtieLayout
+
+# Generated items are kept in one group per owning LED, named after it, so
+# ownership is saved and undone along with the board itself
+OWNER_GROUP_PREFIX = "Bowtie"
+
+# Geometry keys are plain tuples of integers (nm) and strings so that planned
+# items and items read back from the board compare exactly
+# ("track", x0, y0, x1, y1, width, layer, net_name)
+# ("via", x, y, drill, pad, net_name)
+ItemKey = tuple
+
+
+@dataclass
+class ManifestEntry:
+    key: ItemKey
+    led: int  # Index of the owning LED in the plan
+
+
+def get_owner_group_name(ref: Optional[str]) -> str:
+    # Items not owned by any LED, e.g. stitching vias, share one group
+    return OWNER_GROUP_PREFIX if ref is None else f"{OWNER_GROUP_PREFIX} {ref}"
+
+
+def get_owner_ref(group_name: str) -> Optional[str]:
+    # The ref of the LED owning a group's items, "" for the shared group and
+    # None if the group wasn't made by the bowtie creator
+    if group_name == OWNER_GROUP_PREFIX:
+        return ""
+    prefix = f"{OWNER_GROUP_PREFIX} "
+    if group_name.startswith(prefix):
+        return group_name[len(prefix) :]
+    return None
+
+
+def make_track_key(
+    x0: int, y0: int, x1: int, y1: int, width: int, layer: int, net_name: str
+) -> ItemKey:
+    # A track is the same track whichever end it is drawn from
+    if (x1, y1) < (x0, y0):
+        x0, y0, x1, y1 = x1, y1, x0, y0
+    return ("track", x0, y0, x1, y1, width, layer, net_name)
+
+
+def make_via_key(x: int, y: int, drill: int, pad: int, net_name: str) -> ItemKey:
+    return ("via", x, y, drill, pad, net_name)
+
+
+def get_planned_keys(layout: BowtieLayout) -> list[ManifestEntry]:
+    segments = layout.segments
+    vias = layout.vias
+    planned = [
+        ManifestEntry(make_track_key(*coords, layout.nets[net]), led)
+        for *coords, net, led in zip(
+            segments.x0.tolist(),
+            segments.y0.tolist(),
+            segments.x1.tolist(),
+            segments.y1.tolist(),
+            segments.width.tolist(),
+            segments.layer.tolist(),
+            segments.net.tolist(),
+            segments.led.tolist(),
+        )
+    ]
+    planned += [
+        ManifestEntry(make_via_key(*coords, layout.nets[net]), led)
+        for *coords, net, led in zip(
+            vias.x.tolist(),
+            vias.y.tolist(),
+            vias.drill.tolist(),
+            vias.pad.tolist(),
+            vias.net.tolist(),
+            vias.led.tolist(),
+        )
+    ]
+    return planned
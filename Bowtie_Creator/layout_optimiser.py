@@ -0,0 +1,165 @@
+import logging
+from typing import Iterable
+
+import numpy as np
+
+from bowtie_layout import BowtieLayout, Segments, Vias
+
+logger = logging.getLogger(__name__)
+
+
+def _first_in_runs(run_id: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # Index of the first element in each run for which mask is set
+    candidates = np.flatnonzero(mask)
+    _, first = np.unique(run_id[candidates], return_index=True)
+    return candidates[first]
+
+
+def _find_runs(
+    segments: Segments,
+) -> tuple[Segments, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the runs of collinear segments that touch or overlap.
+
+    Returns the non zero-length segments drawn in a canonical direction and
+    sorted so that every run is contiguous, along with the position of each
+    segment's end along its line, the run of each segment and the index where
+    each run starts.
+    """
+    # Coordinates are integer nm so touching ends compare exactly
+    x0, y0, x1, y1 = segments.x0, segments.y0, segments.x1, segments.y1
+    width = segments.width
+
+    keep = (x0 != x1) | (y0 != y1)
+    x0, y0, x1, y1, width = x0[keep], y0[keep], x1[keep], y1[keep], width[keep]
+    layer = segments.layer[keep]
+    net = segments.net[keep]
+    led = segments.led[keep]
+
+    # Draw every segment in a canonical direction
+    swap = (x1 < x0) | ((x1 == x0) & (y1 < y0))
+    x0, x1 = np.where(swap, x1, x0), np.where(swap, x0, x1)
+    y0, y1 = np.where(swap, y1, y0), np.where(swap, y0, y1)
+
+    # Reduce direction to its smallest integer form so collinear segments share
+    # (dir_x, dir_y, offset) and t is the position along that line
+    dx = x1 - x0
+    dy = y1 - y0
+    divisor = np.gcd(dx, dy)
+    dir_x = dx // divisor
+    dir_y = dy // divisor
+    offset = dir_x * y0 - dir_y * x0
+    t0 = dir_x * x0 + dir_y * y0
+    t1 = dir_x * x1 + dir_y * y1
+
+    order = np.lexsort((t0, offset, dir_y, dir_x, width, layer, net))
+    x0, y0, x1, y1 = x0[order], y0[order], x1[order], y1[order]
+    width, layer, net, led = width[order], layer[order], net[order], led[order]
+    t0, t1 = t0[order], t1[order]
+    line_key = np.stack(
+        [net, layer, width, dir_x[order], dir_y[order], offset[order]]
+    )
+
+    ordered = Segments(
+        x0=x0, y0=y0, x1=x1, y1=y1, width=width, layer=layer, net=net, led=led
+    )
+    if len(t0) == 0:
+        return ordered, t1, t1, t1
+
+    new_line = np.ones(len(t0), dtype=bool)
+    new_line[1:] = np.any(line_key[:, 1:] != line_key[:, :-1], axis=0)
+    line_id = np.cumsum(new_line) - 1
+
+    # Running maximum of the end position that resets on every new line by
+    # lifting each line above everything before it
+    t_min = min(t0.min(), t1.min())
+    line_height = max(t0.max(), t1.max()) - t_min + 1
+    lifted_end = (t1 - t_min) + line_id * line_height
+    reach = np.maximum.accumulate(lifted_end)
+    new_run = new_line.copy()
+    new_run[1:] |= (t0[1:] - t_min) + line_id[1:] * line_height > reach[:-1]
+    run_id = np.cumsum(new_run) - 1
+
+    return ordered, t1, run_id, np.flatnonzero(new_run)
+
+
+def merge_segments(segments: Segments) -> Segments:
+    """
+    Merge collinear segments that touch or overlap into single segments.
+
+    Only segments on the same net, layer and width are merged. Zero-length
+    segments are dropped and exact duplicates disappear as part of the merge.
+    Merged segments are owned by the lowest numbered LED that contributed, see
+    get_merged_leds for regenerating only some of the LEDs.
+    """
+    ordered, t1, run_id, run_starts = _find_runs(segments)
+    if len(run_starts) == 0:
+        return ordered
+
+    run_end = np.maximum.reduceat(t1, run_starts)
+    last = _first_in_runs(run_id, t1 == run_end[run_id])
+
+    return Segments(
+        x0=ordered.x0[run_starts],
+        y0=ordered.y0[run_starts],
+        x1=ordered.x1[last],
+        y1=ordered.y1[last],
+        width=ordered.width[run_starts],
+        layer=ordered.layer[run_starts],
+        net=ordered.net[run_starts],
+        led=np.minimum.reduceat(ordered.led, run_starts),
+    )
+
+
+def get_merged_leds(segments: Segments, leds: Iterable[int]) -> set[int]:
+    """
+    Add to leds the owners of every track merge_segments would build from
+    their segments.
+
+    A merged track belongs to one LED but can carry segments of its
+    neighbours, so regenerating only those neighbours has to regenerate the
+    owner too or the track wouldn't be updated.
+    """
+    leds = set(leds)
+    ordered, _, run_id, run_starts = _find_runs(segments)
+    if len(run_starts) == 0:
+        return leds
+
+    owner = np.minimum.reduceat(ordered.led, run_starts)
+    selected = np.isin(ordered.led, list(leds))
+    return leds | set(owner[np.unique(run_id[selected])].tolist())
+
+
+def collapse_vias(vias: Vias) -> Vias:
+    # Vias stacked on the same spot and net are redundant, keep the largest.
+    # Stacked vias on different nets are a short and are left for the clearance
+    # check to report
+    order = np.lexsort((-vias.drill, -vias.pad, vias.net, vias.y, vias.x))
+    key = np.stack([vias.x[order], vias.y[order], vias.net[order]])
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(key[:, 1:] != key[:, :-1], axis=0)
+    keep = np.sort(order[first])
+
+    return Vias(
+        x=vias.x[keep],
+        y=vias.y[keep],
+        drill=vias.drill[keep],
+        pad=vias.pad[keep],
+        net=vias.net[keep],
+        led=vias.led[keep],
+    )
+
+
+def optimise_layout(layout: BowtieLayout) -> BowtieLayout:
+    segments = merge_segments(layout.segments)
+    vias = collapse_vias(layout.vias)
+    logger.info(
+        f"Optimised layout: {len(layout.segments)} -> {len(segments)} segments, "
+        f"{len(layout.vias)} -> {len(vias)} vias"
+    )
+    return BowtieLayout(
+        nets=layout.nets,
+        placements=layout.placements,
+        segments=segments,
+        vias=vias,
+    )
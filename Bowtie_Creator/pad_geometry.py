@@ -0,0 +1,154 @@
+"""
+Pad positions read from the LED footprint actually on the board, so the routing
+follows the real package rather than constants for one particular LED.
+
+Reading pads through SWIG is slow, so each footprint ID, layer and orientation
+is only read once and every other instance reuses the cached offsets.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import pcbnew
+
+from bowtie_layout import (
+    BowtieSpec,
+    Placements,
+    get_spec_with_pad_offsets,
+    rotate_nm,
+)
+from clearance import Pads
+from kicad_layer import KicadLayer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PadGeometry:
+    numbers: tuple[str, ...]
+    # Pad centres relative to the footprint position, as placed on the board
+    x: np.ndarray  # nm
+    y: np.ndarray  # nm
+    orientation_deg: float
+    # pcbnew layer the footprint was on, pads of a flipped footprint are mirrored
+    layer: int
+    size_x: np.ndarray  # nm
+    size_y: np.ndarray  # nm
+    # Relative to the footprint
+    rotation_deg: np.ndarray
+
+    def get_unrotated(self) -> tuple[np.ndarray, np.ndarray]:
+        # Back to the footprint's own frame, i.e. as if its orientation was 0
+        return rotate_nm(self.x, self.y, -self.orientation_deg)
+
+
+# (FPID, layer, orientation) -> pads, shared by every footprint of the same type
+_pad_cache: dict[tuple[str, int, float], PadGeometry] = {}
+
+
+def clear_pad_cache() -> None:
+    # Must be called if a footprint is updated from its library
+    _pad_cache.clear()
+
+
+def get_pad_geometry(footprint: pcbnew.FOOTPRINT) -> PadGeometry:
+    orientation_deg = footprint.GetOrientationDegrees()
+    layer = footprint.GetLayer()
+    key = (footprint.GetFPIDAsString(), layer, orientation_deg)
+    geometry = _pad_cache.get(key)
+    if geometry is not None:
+        return geometry
+
+    position = footprint.GetPosition()
+    numbers = []
+    x = []
+    y = []
+    size_x = []
+    size_y = []
+    rotation_deg = []
+    for pad in footprint.Pads():
+        pad_position = pad.GetPosition()
+        pad_size = pad.GetSize()
+        numbers.append(pad.GetNumber())
+        x.append(pad_position.x - position.x)
+        y.append(pad_position.y - position.y)
+        size_x.append(pad_size.x)
+        size_y.append(pad_size.y)
+        rotation_deg.append(pad.GetOrientationDegrees() - orientation_deg)
+
+    geometry = PadGeometry(
+        numbers=tuple(numbers),
+        x=np.array(x, dtype=np.int64),
+        y=np.array(y, dtype=np.int64),
+        orientation_deg=orientation_deg,
+        layer=layer,
+        size_x=np.array(size_x, dtype=np.int64),
+        size_y=np.array(size_y, dtype=np.int64),
+        rotation_deg=np.array(rotation_deg, dtype=np.float64),
+    )
+    _pad_cache[key] = geometry
+    logger.debug(f"Read {len(numbers)} pads of {key[0]} at {orientation_deg} deg")
+    return geometry
+
+
+def get_led_pad_spec(spec: BowtieSpec, geometry: PadGeometry) -> BowtieSpec:
+    """
+    Return spec with the LED pad offsets taken from the footprint's pads, see
+    get_spec_with_pad_offsets.
+    """
+    # The plan puts every LED on the top
+    assert geometry.layer == KicadLayer.TOP.get_layer_code(), (
+        "Pad offsets must be read from an LED on the top layer"
+    )
+    return get_spec_with_pad_offsets(spec, geometry.numbers, *geometry.get_unrotated())
+
+
+def get_led_pads(
+    placements: Placements, footprints: Sequence[pcbnew.FOOTPRINT]
+) -> Pads:
+    """
+    Pads of every LED, where the plan places it, for the clearance check.
+    footprints[n] is the footprint of placements.refs[n].
+
+    Shapes come from the pad cache, only each pad's net is read from every
+    footprint. Pads are taken to be SMD, on the layer their LED is placed on.
+    """
+    nets: dict[str, int] = {}
+    unrotated = {}
+    led = []
+    x = []
+    y = []
+    size_x = []
+    size_y = []
+    rotation_deg = []
+    net = []
+    for index, footprint in enumerate(footprints):
+        geometry = get_pad_geometry(footprint)
+        if id(geometry) not in unrotated:
+            unrotated[id(geometry)] = geometry.get_unrotated()
+        pad_x, pad_y = unrotated[id(geometry)]
+        led.append(np.full(len(pad_x), index, dtype=np.int64))
+        x.append(pad_x)
+        y.append(pad_y)
+        size_x.append(geometry.size_x)
+        size_y.append(geometry.size_y)
+        rotation_deg.append(geometry.rotation_deg)
+        for pad in footprint.Pads():
+            net.append(nets.setdefault(pad.GetNetname(), len(nets)))
+
+    led = np.concatenate(led)
+    rotation = placements.rotation[led]
+    dx, dy = rotate_nm(np.concatenate(x), np.concatenate(y), rotation)
+    return Pads(
+        x=placements.x[led] + dx,
+        y=placements.y[led] + dy,
+        size_x=np.concatenate(size_x),
+        size_y=np.concatenate(size_y),
+        rotation=(np.concatenate(rotation_deg) + rotation) % 360,
+        layer=placements.layer[led],
+        net=np.array(net, dtype=np.int64),
+        led=led,
+        nets=tuple(nets),
+    )
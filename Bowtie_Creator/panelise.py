@@ -0,0 +1,160 @@
+"""
+Panelisation: one plan replicated onto several copies of the board on a panel.
+
+Each copy is an offset and rotation of the whole plan, with its references
+renumbered so they stay unique across the panel. Every copy is transformed at
+once with NumPy, so planning a 4x4 panel costs little more than one board and
+only committing it to the board grows with the number of copies.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from bowtie_layout import BowtieLayout, Placements, Segments, Vias, mm_to_nm, rotate_nm
+
+# Refs are split into a prefix and a number, e.g. LD and 537
+_REF_PATTERN = re.compile(r"^(.*?)(\d+)$")
+
+
+@dataclass(frozen=True)
+class PanelCopy:
+    offset_x_mm: float
+    offset_y_mm: float
+    # Anticlockwise as shown in Kicad, about the centre given to panelise_layout
+    rotation_deg: float = 0.0
+    # Added to the number of every reference, e.g. 1000 makes LD1 into LD1001
+    ref_offset: int = 0
+
+
+def grid_copies(
+    cols: int,
+    rows: int,
+    pitch_x_mm: float,
+    pitch_y_mm: float,
+    ref_step: int = 1000,
+) -> list[PanelCopy]:
+    # Row by row from the top left, the first copy is the original board
+    return [
+        PanelCopy(
+            offset_x_mm=col * pitch_x_mm,
+            offset_y_mm=row * pitch_y_mm,
+            ref_offset=(row * cols + col) * ref_step,
+        )
+        for row in range(rows)
+        for col in range(cols)
+    ]
+
+
+def _remap_refs(refs: np.ndarray, copies: Sequence[PanelCopy]) -> np.ndarray:
+    # Only the original refs are parsed, every copy is then a single array
+    # addition
+    prefixes = []
+    numbers = []
+    for ref in refs.tolist():
+        match = _REF_PATTERN.match(ref)
+        assert match is not None, f"{ref} has no number to renumber"
+        prefixes.append(match.group(1))
+        numbers.append(int(match.group(2)))
+    prefixes = np.array(prefixes)
+    numbers = np.array(numbers, dtype=np.int64)
+
+    panel_refs = np.concatenate(
+        [
+            np.char.add(prefixes, (numbers + x.ref_offset).astype(str))
+            for x in copies
+        ]
+    )
+    assert len(np.unique(panel_refs)) == len(panel_refs), (
+        "Panel copies have overlapping references, increase the ref offsets"
+    )
+    return panel_refs
+
+
+def panelise_layout(
+    layout: BowtieLayout,
+    copies: Sequence[PanelCopy],
+    centre_x_mm: Optional[float] = None,
+    centre_y_mm: Optional[float] = None,
+) -> BowtieLayout:
+    """
+    Replicate layout once per copy. Copies are rotated about the centre, which
+    defaults to the middle of the LEDs, and then offset.
+
+    Items keep their order within each copy and the copies follow one another,
+    so item n of copy k is item n + k * len(items) and belongs to LED
+    led + k * len(placements).
+    """
+    assert copies, "A panel needs at least one copy"
+    placements = layout.placements
+    if centre_x_mm is None:
+        centre_x_nm = (placements.x.min() + placements.x.max()) // 2
+    else:
+        centre_x_nm = mm_to_nm(centre_x_mm)
+    if centre_y_mm is None:
+        centre_y_nm = (placements.y.min() + placements.y.max()) // 2
+    else:
+        centre_y_nm = mm_to_nm(centre_y_mm)
+
+    # One row per copy, broadcast against one column per item
+    offset_x_nm = mm_to_nm([x.offset_x_mm for x in copies])[:, None]
+    offset_y_nm = mm_to_nm([x.offset_y_mm for x in copies])[:, None]
+    rotation = np.array([x.rotation_deg for x in copies], dtype=np.float64)[:, None]
+
+    def transform(x_nm: np.ndarray, y_nm: np.ndarray):
+        dx, dy = rotate_nm(x_nm - centre_x_nm, y_nm - centre_y_nm, rotation)
+        return (
+            (centre_x_nm + dx + offset_x_nm).ravel(),
+            (centre_y_nm + dy + offset_y_nm).ravel(),
+        )
+
+    def tile(values: np.ndarray) -> np.ndarray:
+        return np.tile(values, len(copies))
+
+    def tile_led(led: np.ndarray) -> np.ndarray:
+        # Items not owned by an LED stay that way
+        copy_index = np.arange(len(copies), dtype=np.int64)[:, None]
+        return np.where(led < 0, led, led + copy_index * len(placements)).ravel()
+
+    x, y = transform(placements.x, placements.y)
+    panel_placements = Placements(
+        refs=_remap_refs(placements.refs, copies),
+        x=x,
+        y=y,
+        rotation=((placements.rotation + rotation) % 360).ravel(),
+        layer=tile(placements.layer),
+    )
+
+    segments = layout.segments
+    x0, y0 = transform(segments.x0, segments.y0)
+    x1, y1 = transform(segments.x1, segments.y1)
+    panel_segments = Segments(
+        x0=x0,
+        y0=y0,
+        x1=x1,
+        y1=y1,
+        width=tile(segments.width),
+        layer=tile(segments.layer),
+        net=tile(segments.net),
+        led=tile_led(segments.led),
+    )
+
+    vias = layout.vias
+    x, y = transform(vias.x, vias.y)
+    panel_vias = Vias(
+        x=x,
+        y=y,
+        drill=tile(vias.drill),
+        pad=tile(vias.pad),
+        net=tile(vias.net),
+        led=tile_led(vias.led),
+    )
+
+    return BowtieLayout(
+        nets=layout.nets,
+        placements=panel_placements,
+        segments=panel_segments,
+        vias=panel_vias,
+    )
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+import array_placement
+import bowtie_layout
+from bowtie_layout import (
+    BowtieLayout,
+    BowtieSpec,
+    Placements,
+    Segments,
+    Vias,
+    plan_bowtie,
+)
+
+PLAN_CACHE_DIR = Path.home() / ".cache" / "m0wut_kicad_plugins" / "bowtie_plans"
+PLAN_CACHE_MAX_ENTRIES = 32
+PLAN_CACHE_MAX_IN_MEMORY = 4
+
+logger = logging.getLogger(__name__)
+
+# Any edit to the planner changes this so stale plans are never reused
+_PLANNER_VERSION = hashlib.sha256(
+    b"".join(
+        Path(x.__file__).read_bytes() for x in (bowtie_layout, array_placement)
+    )
+).hexdigest()
+
+_in_memory_cache: "OrderedDict[str, BowtieLayout]" = OrderedDict()
+
+
+def get_cache_key(spec: BowtieSpec) -> str:
+    spec_json = json.dumps(asdict(spec), sort_keys=True)
+    return hashlib.sha256(f"{_PLANNER_VERSION}:{spec_json}".encode()).hexdigest()
+
+
+def _freeze(layout: BowtieLayout) -> BowtieLayout:
+    # Cached layouts are shared between callers so must not be modified
+    for group in (layout.placements, layout.segments, layout.vias):
+        for x in fields(group):
+            getattr(group, x.name).setflags(write=False)
+    return layout
+
+
+def save_layout(path: Path, layout: BowtieLayout) -> None:
+    arrays = {"nets": np.array(layout.nets)}
+    for prefix, group in [
+        ("placements", layout.placements),
+        ("segments", layout.segments),
+        ("vias", layout.vias),
+    ]:
+        for x in fields(group):
+            arrays[f"{prefix}_{x.name}"] = getattr(group, x.name)
+
+    # Write then rename so a half-written file is never picked up
+    temp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_layout(path: Path) -> BowtieLayout:
+    with np.load(path, allow_pickle=False) as arrays:
+
+        def load_group(prefix: str, group_type: type):
+            return group_type(
+                **{x.name: arrays[f"{prefix}_{x.name}"] for x in fields(group_type)}
+            )
+
+        return BowtieLayout(
+            nets=tuple(arrays["nets"].tolist()),
+            placements=load_group("placements", Placements),
+            segments=load_group("segments", Segments),
+            vias=load_group("vias", Vias),
+        )
+
+
+def _evict(cache_dir: Path, max_entries: int) -> None:
+    # Hits refresh the modification time so the oldest files are least recently
+    # used. Other processes share the cache, so plans can vanish at any point
+    cached_plans = []
+    for path in cache_dir.glob("*.npz"):
+        try:
+            cached_plans.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    cached_plans.sort()
+    for _, path in cached_plans[: max(0, len(cached_plans) - max_entries)]:
+        logger.debug(f"Evicting cached plan {path.name}")
+        path.unlink(missing_ok=True)
+
+
+def get_layout(
+    spec: BowtieSpec = BowtieSpec(),
+    cache_dir: Optional[Path] = PLAN_CACHE_DIR,
+    max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+) -> BowtieLayout:
+    """
+    Return the layout for spec, planning it only if no cached copy exists.
+
+    The returned arrays are read-only. Pass cache_dir=None to only use the
+    in-memory cache.
+    """
+    key = get_cache_key(spec)
+
+    if key in _in_memory_cache:
+        _in_memory_cache.move_to_end(key)
+        return _in_memory_cache[key]
+
+    layout = None
+    if cache_dir is not None:
+        path = cache_dir / f"{key}.npz"
+        try:
+            layout = load_layout(path)
+            os.utime(path)
+            logger.debug(f"Loaded cached plan {path.name}")
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable, either way it needs planning again
+            layout = None
+
+    if layout is None:
+        layout = plan_bowtie(spec)
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            save_layout(cache_dir / f"{key}.npz", layout)
+            _evict(cache_dir, max_entries)
+
+    _in_memory_cache[key] = _freeze(layout)
+    while len(_in_memory_cache) > PLAN_CACHE_MAX_IN_MEMORY:
+        _in_memory_cache.popitem(last=False)
+
+    return layout
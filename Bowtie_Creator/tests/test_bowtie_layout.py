@@ -0,0 +1,255 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from bowtie_layout import (
+    CENTRE_LINE_Y,
+    COLUMN_SPACING,
+    DEFAULT_POWER_TRACK_WIDTH_MM,
+    DEFAULT_TRACK_WIDTH_MM,
+    LED_PAD_OFFSET_X,
+    LED_PAD_OFFSET_Y,
+    LED_PAD_TRACK_VERTEX_OFFSET_X,
+    LED_PAD_TRACK_VERTEX_OFFSET_Y,
+    NUM_CENTRE_COLS,
+    NUM_COLS,
+    ROW_SPACING,
+    START_COLUMN_SIZE,
+    START_X,
+    VIA_DIAMETER,
+    VIA_HOLE,
+    BowtieSpec,
+    halve_nm,
+    mm_to_nm,
+    plan_bowtie,
+    rotate_nm,
+    round_nm,
+)
+from kicad_layer import KicadLayer
+
+
+def from_mm(x_mm: float) -> int:
+    # pcbnew.FromMM, which rounds half away from zero
+    return int(np.sign(x_mm) * np.floor(abs(x_mm) * 1e6 + 0.5))
+
+
+def plan_baseline() -> tuple[list, list, list]:
+    """
+    The bowtie as the original create_bowtie drew it, one LED at a time in mm,
+    as (ref, x, y) placements, (x0, y0, x1, y1, width, layer, net) segments and
+    (x, y, drill, pad, net) vias in nm.
+    """
+    placements = []
+    segments = []
+    vias = []
+
+    def add_track(points, layer, width):
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            segments.append(
+                (
+                    from_mm(x0),
+                    from_mm(y0),
+                    from_mm(x1),
+                    from_mm(y1),
+                    from_mm(width),
+                    layer.value,
+                    0,
+                )
+            )
+
+    current_led_reference = 1
+    leds_per_column = START_COLUMN_SIZE
+    add_led_next_column = False
+    flip = True
+    for col in range(2 * NUM_COLS + NUM_CENTRE_COLS):
+        led_centre_x = START_X + COLUMN_SPACING * col
+        for row in range(leds_per_column):
+            led_centre_y = (
+                CENTRE_LINE_Y
+                - row * ROW_SPACING
+                + 0.5 * (leds_per_column - 1) * ROW_SPACING
+            )
+            placements.append(
+                (
+                    f"LD{current_led_reference}",
+                    from_mm(led_centre_x),
+                    from_mm(led_centre_y),
+                )
+            )
+
+            x_pos = led_centre_x - LED_PAD_OFFSET_X
+            y_pos = led_centre_y + LED_PAD_OFFSET_Y
+            via_y = led_centre_y + 0.5 * ROW_SPACING
+            add_track(
+                [(x_pos, y_pos), (x_pos, via_y)], KicadLayer.TOP, DEFAULT_TRACK_WIDTH_MM
+            )
+            vias.append(
+                (
+                    from_mm(x_pos),
+                    from_mm(via_y),
+                    from_mm(VIA_HOLE),
+                    from_mm(VIA_DIAMETER),
+                    0,
+                )
+            )
+            add_track(
+                [(x_pos, via_y), (x_pos + COLUMN_SPACING, via_y)],
+                KicadLayer.L3,
+                DEFAULT_POWER_TRACK_WIDTH_MM,
+            )
+
+            if row > 0:
+                # Top right, top left and bottom right pads each dog-leg to the
+                # same pad of the LED above
+                for x_sign, y_sign, vertex_sign in (
+                    (1, -1, -1),
+                    (-1, -1, 1),
+                    (1, 1, 1),
+                ):
+                    x_pos = led_centre_x + x_sign * LED_PAD_OFFSET_X
+                    y_pos = led_centre_y + y_sign * LED_PAD_OFFSET_Y
+                    vertex_x = x_pos + vertex_sign * LED_PAD_TRACK_VERTEX_OFFSET_X
+                    add_track(
+                        [
+                            (x_pos, y_pos),
+                            (vertex_x, y_pos + LED_PAD_TRACK_VERTEX_OFFSET_Y),
+                            (
+                                vertex_x,
+                                y_pos + ROW_SPACING - LED_PAD_TRACK_VERTEX_OFFSET_Y,
+                            ),
+                            (x_pos, y_pos + ROW_SPACING),
+                        ],
+                        KicadLayer.TOP,
+                        DEFAULT_TRACK_WIDTH_MM,
+                    )
+
+            current_led_reference += 1
+
+        if col < NUM_COLS or col >= NUM_COLS + NUM_CENTRE_COLS:
+            # Taper down then back up again either side of the centre
+            if add_led_next_column == (2 if flip else 1):
+                leds_per_column += -2 if col < NUM_COLS else 2
+                add_led_next_column = 0
+                flip = not flip
+            else:
+                add_led_next_column = add_led_next_column + 1
+
+    return placements, segments, vias
+
+
+def get_rows(*arrays: np.ndarray) -> list[tuple]:
+    return list(zip(*(x.tolist() for x in arrays)))
+
+
+def test_plan_matches_baseline():
+    layout = plan_bowtie(BowtieSpec())
+    placements, segments, vias = plan_baseline()
+
+    assert layout.nets == ("5V0", "0V")
+    assert get_rows(
+        layout.placements.refs, layout.placements.x, layout.placements.y
+    ) == placements
+    assert not np.any(layout.placements.rotation)
+    assert np.all(layout.placements.layer == KicadLayer.TOP.value)
+
+    s = layout.segments
+    assert sorted(
+        get_rows(s.x0, s.y0, s.x1, s.y1, s.width, s.layer, s.net)
+    ) == sorted(segments)
+
+    v = layout.vias
+    assert sorted(get_rows(v.x, v.y, v.drill, v.pad, v.net)) == sorted(vias)
+
+
+def test_plan_owners():
+    layout = plan_bowtie(BowtieSpec())
+    num_leds = len(layout.placements)
+    assert num_leds == 864
+
+    # Every LED owns a via and its power tracks, and all but the bottom LED of
+    # each column the dog-legs up to the LED above
+    assert np.array_equal(np.sort(layout.vias.led), np.arange(num_leds))
+    assert np.all((layout.segments.led >= 0) & (layout.segments.led < num_leds))
+    owned = np.bincount(layout.segments.led, minlength=num_leds)
+    assert set(owned.tolist()) == {2, 11}
+
+
+def test_plan_follows_spec():
+    spec = replace(BowtieSpec(), column_spacing=3.0, centre_line_y=100.5)
+    layout = plan_bowtie(spec)
+    x = np.unique(layout.placements.x)
+    assert np.all(np.diff(x) == mm_to_nm(3.0))
+    assert x[0] == mm_to_nm(START_X)
+    # Columns are centred on the centre line
+    first_column = layout.placements.y[layout.placements.x == x[0]]
+    assert first_column.min() + first_column.max() == 2 * mm_to_nm(100.5)
+
+
+@pytest.mark.parametrize(
+    "x, expected",
+    [
+        (0.0, 0),
+        (0.4, 0),
+        (0.5, 1),
+        (1.5, 2),
+        (2.5, 3),
+        (-0.5, -1),
+        (-2.5, -3),
+        (-0.4, 0),
+        (1e12 + 0.5, 10**12 + 1),
+    ],
+)
+def test_round_nm_rounds_half_away_from_zero(x, expected):
+    result = round_nm(np.array([x]))
+    assert result.dtype == np.int64
+    assert result.tolist() == [expected]
+
+
+def test_mm_to_nm():
+    assert mm_to_nm(np.array([2.3, -0.65, 0.0000005])).tolist() == [
+        2300000,
+        -650000,
+        1,
+    ]
+    assert halve_nm(np.array([3, -3, 4, 0])).tolist() == [2, -2, 2, 0]
+
+
+def test_rotate_nm_without_rotation_is_exact():
+    x = np.array([1, -2, 3], dtype=np.int64)
+    y = np.array([4, 5, -6], dtype=np.int64)
+    rotated_x, rotated_y = rotate_nm(x, y, np.zeros(3))
+    assert rotated_x is x and rotated_y is y
+
+
+@pytest.mark.parametrize(
+    "rotation_deg, expected",
+    [
+        # Anticlockwise on screen, where Y points down
+        (90, (0, -1000)),
+        (180, (-1000, 0)),
+        (270, (0, 1000)),
+        (-90, (0, 1000)),
+        (360, (1000, 0)),
+        (45, (707, -707)),
+    ],
+)
+def test_rotate_nm(rotation_deg, expected):
+    x, y = rotate_nm(np.array([1000]), np.array([0]), np.array([rotation_deg]))
+    assert (x.tolist(), y.tolist()) == ([expected[0]], [expected[1]])
+
+
+def test_rotate_nm_broadcasts():
+    # One offset against several rotations, as for a pad on rotated LEDs
+    x, y = rotate_nm(np.array(650000), np.array(400000), np.array([0, 90, 180]))
+    assert x.tolist() == [650000, 400000, -650000]
+    assert y.tolist() == [400000, -650000, -400000]
+
+
+def test_rotate_nm_round_trip():
+    rng = np.random.default_rng(0)
+    x = rng.integers(-10**7, 10**7, 1000)
+    y = rng.integers(-10**7, 10**7, 1000)
+    for rotation_deg in (90, 180, 270):
+        back_x, back_y = rotate_nm(*rotate_nm(x, y, rotation_deg), -rotation_deg)
+        assert np.array_equal(back_x, x) and np.array_equal(back_y, y)
@@ -5,6 +5,18 @@ DEFAULT_LOGGING_DEBUG_LEVEL = logging.DEBUG
 
 DELETE_TEMP_FOLDER_ON_STARTUP = True
 TEMP_FOLDER_NAME = "M0WUT_tools"
+# Kept between sessions, unlike the temp folder
+CACHE_FOLDER_NAME = "M0WUT_tools_cache"
+
+# Mirrors younger than this aren't fetched again unless asked
+MIRROR_CACHE_TTL_S = 60 * 60
+# Least recently used mirrors are deleted to keep the cache under this
+MIRROR_CACHE_MAX_SIZE_MB = 2048
+# How long to wait for another session to finish with a mirror
+MIRROR_LOCK_TIMEOUT_S = 60
+
+# How long to wait for another session to finish with a tracker
+TRACKER_LOCK_TIMEOUT_S = 60
 
 
 PROJECT_TRACKER_REPO_OWNER = "M0WUT"
@@ -15,6 +27,10 @@ PROJECT_JSON_PATH = Path("project_structure.json")
 
 GITHUB_PAGES_DEPLOYMENT_WORKFLOW_NAME = "main.yml"
 
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_API_MAX_CONNECTIONS = 8
+GITHUB_API_TIMEOUT_S = 30
+
 KICAD_TEMPLATE_REPO_OWNER = "M0WUT"
 KICAD_TEMPLATE_REPO_NAME = "p0002-pcb-001_kicad-template-pcb"
 KICAD_TEMPLATE_STR_TO_REPLACE = "P0002-PCB-001"
@@ -1,9 +1,14 @@
 # Standard imports
 from pathlib import Path
+import os
 import shutil
 import subprocess
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
 from dataclasses import dataclass
-from typing import Optional
+from enum import Enum, auto
+from typing import BinaryIO, Optional
 
 # Third party imports
 
@@ -16,6 +21,14 @@ from argonaut.misc.os import (
     get_temp_dir_path,
 )
 from argonaut.gui.dialog import ask_question, get_folder_input, show_error
+from argonaut.misc.github_api import (
+    GithubApiError,
+    GithubClient,
+    GithubHost,
+    can_encrypt_secrets,
+)
+from argonaut.config.config import GITHUB_API_MAX_CONNECTIONS, GITHUB_API_URL
+from argonaut.logger.logger import create_default_logger
 
 # Third party but need to load the show_error method first
 try:
@@ -28,6 +41,15 @@ except ImportError:
     )
 
 
+class RepoFetchMode(Enum):
+    # Stream a tarball of the tip of the default branch, no history or checkout
+    Archive = auto()
+    # Full clone with the Github CLI, which also picks up Git LFS files
+    Clone = auto()
+    # Export from a mirror cached between sessions, fetched at most once per TTL
+    Mirror = auto()
+
+
 @dataclass
 class GitInfo:
     local_path: Path
@@ -61,6 +83,21 @@ def run_shell_command(command: list[str]) -> str:
     return response.decode()
 
 
+_github_client: Optional[GithubClient] = None
+
+
+def get_github_client() -> GithubClient:
+    # One client for the whole session, so its connections are reused. The
+    # token is the same one the Github CLI uses.
+    global _github_client
+    if _github_client is None:
+        token = os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN")
+        if not token:
+            token = run_shell_command(["gh", "auth", "token"]).strip()
+        _github_client = GithubClient(GithubHost.from_url(GITHUB_API_URL), token)
+    return _github_client
+
+
 def github_cli_exists():
     try:
         run_shell_command(["gh", "--version"])
@@ -73,34 +110,38 @@ def check_github_repo_exists(
     repo_owner: str, repo_name: str, show_error_window_if_not_exists: bool = True
 ) -> bool:
     try:
-        run_shell_command(["gh", "repo", "view", f"{repo_owner}/{repo_name}"])
-        return True
-    except subprocess.CalledProcessError:
-        if show_error_window_if_not_exists:
-            show_error(
-                f'Required Github project "{repo_owner}/{repo_name}" does not exist',
-                "Repo not found",
-            )
-        return False
+        if get_github_client().repo_exists(repo_owner, repo_name):
+            return True
+    except (GithubApiError, OSError, subprocess.CalledProcessError):
+        pass
+
+    if show_error_window_if_not_exists:
+        show_error(
+            f'Required Github project "{repo_owner}/{repo_name}" does not exist',
+            "Repo not found",
+        )
+    return False
 
 
 def get_current_github_user(show_error_window: bool = True) -> str:
     try:
-        response = run_shell_command(["gh", "auth", "status"])
-    except subprocess.CalledProcessError:
+        return get_github_client().get_current_user()
+    except (GithubApiError, OSError, subprocess.CalledProcessError):
         if show_error_window:
             show_error("GH tool not authorised as a user", "GH not authorised")
         return ""
-    # response will contain .... github.com account <Github User> ....
-    gh_username = response.split("github.com account ")[1].split(" ")[0]
-    return gh_username
 
 
 def create_blank_github_repo(repo_name: str, show_error_window: bool = True) -> bool:
+    # repo_name may be given as owner/name, like the Github CLI
+    repo_owner = None
+    if "/" in repo_name:
+        repo_owner, repo_name = repo_name.split("/")
+
     try:
-        run_shell_command(["gh", "repo", "create", "--public", f"{repo_name}"])
+        get_github_client().create_repo(repo_owner, repo_name)
         return True
-    except subprocess.CalledProcessError:
+    except (GithubApiError, OSError, subprocess.CalledProcessError):
         if show_error_window:
             show_error(
                 f'Failed to create repo "{repo_name}" on Github',
@@ -403,17 +444,120 @@ def ensure_git_repo_up_to_date(path: Path) -> None:
     raise NotImplementedError  # I don't know how we got here
 
 
-def copy_files_from_git_repo(
-    repo_owner: str,
-    repo_name: str,
+def _is_under(path: Path, parents: list[Path]) -> bool:
+    return any(path == x or x in path.parents for x in parents)
+
+
+def extract_repo_tarball(
+    tarball: BinaryIO,
     local_dest_path: Path,
     include_paths: Optional[list[Path]] = None,
     exclude_paths: Optional[list[Path]] = None,
+    mode: str = "r|gz",
+) -> list[Path]:
+    """
+    Write the files in a streamed Github tarball, or anything else with all of
+    its files in one top level folder, into local_dest_path without that folder
+    and return the paths written relative to it.
+
+    Files are written as they arrive, the tarball is never held or unpacked
+    anywhere else.
+    """
+    written = []
+    with tarfile.open(fileobj=tarball, mode=mode) as archive:
+        for member in archive:
+            # Github puts everything under "<owner>-<repo>-<commit>/"
+            parts = Path(member.name).parts[1:]
+            if not parts:
+                continue
+            path = Path(*parts)
+            assert ".." not in parts and not path.is_absolute(), (
+                f'Unsafe path "{member.name}" in repo archive'
+            )
+
+            if include_paths is not None and not (
+                _is_under(path, include_paths)
+                # Folders leading down to an included path
+                or any(path in x.parents for x in include_paths)
+            ):
+                continue
+            if exclude_paths is not None and _is_under(path, exclude_paths):
+                continue
+
+            full_dest_path = local_dest_path / path
+            if member.isdir():
+                full_dest_path.mkdir(exist_ok=True, parents=True)
+            elif member.isfile():
+                full_dest_path.parent.mkdir(exist_ok=True, parents=True)
+                with archive.extractfile(member) as src, open(
+                    full_dest_path, "wb"
+                ) as dest:
+                    shutil.copyfileobj(src, dest)
+                if member.mode & 0o111:
+                    full_dest_path.chmod(full_dest_path.stat().st_mode | 0o111)
+                written.append(path)
+            # Anything else, e.g. symlinks, is skipped like a Windows checkout
+            # without symlink support would
+
+    return written
+
+
+def _fetch_files_from_git_repo(
+    repo_owner: str,
+    repo_name: str,
+    local_dest_path: Path,
+    include_paths: Optional[list[Path]],
+    exclude_paths: Optional[list[Path]],
 ):
-    assert not (
-        include_paths is not None and exclude_paths is not None
-    ), "Only one of include and exclude paths can be specified"
+    try:
+        with get_github_client().open_tarball(repo_owner, repo_name) as tarball:
+            written = extract_repo_tarball(
+                tarball, local_dest_path, include_paths, exclude_paths
+            )
+    except (GithubApiError, OSError, tarfile.TarError, subprocess.CalledProcessError):
+        show_error(
+            f'Failed to download repo "{repo_owner}/{repo_name}" to '
+            f'"{local_dest_path.absolute()}"',
+            "Repo download failed",
+        )
+
+    if include_paths is not None:
+        missing = [
+            x for x in include_paths if not any(_is_under(y, [x]) for y in written)
+        ]
+        if missing:
+            show_error(
+                f'Repo "{repo_owner}/{repo_name}" has nothing at: '
+                + ", ".join(str(x) for x in missing),
+                "Repo download failed",
+            )
+    return written
 
+
+# Start of every Git LFS pointer file, which is all an archive holds of the file
+LFS_POINTER_PREFIX = b"version https://git-lfs.github.com/spec/"
+# Pointers are around 130 bytes, anything much bigger is real content
+LFS_POINTER_MAX_SIZE = 1024
+
+
+def _has_lfs_pointers(local_dest_path: Path, written: list[Path]) -> bool:
+    for path in written:
+        full_path = local_dest_path / path
+        if full_path.stat().st_size > LFS_POINTER_MAX_SIZE:
+            continue
+        with open(full_path, "rb") as f:
+            if f.read(len(LFS_POINTER_PREFIX)) == LFS_POINTER_PREFIX:
+                return True
+    return False
+
+
+def _clone_files_from_git_repo(
+    repo_owner: str,
+    repo_name: str,
+    local_dest_path: Path,
+    include_paths: Optional[list[Path]],
+    exclude_paths: Optional[list[Path]],
+):
     try:
         temp_clone_path = get_temp_dir_path() / repo_name
         git_clone(repo_owner, repo_name, temp_clone_path)
@@ -447,14 +591,69 @@ def copy_files_from_git_repo(
         delete_folder(temp_clone_path)
 
 
-def add_github_secret(
+def copy_files_from_git_repo(
     repo_owner: str,
     repo_name: str,
-    secret_name: str,
-    secret_value: str,
-    show_error_window: bool = True,
+    local_dest_path: Path,
+    include_paths: Optional[list[Path]] = None,
+    exclude_paths: Optional[list[Path]] = None,
+    fetch_mode: RepoFetchMode = RepoFetchMode.Clone,
+):
+    """
+    Copy the files at the tip of the repo's default branch into
+    local_dest_path.
+
+    Archive and Mirror are much faster than Clone but only get pointers to
+    Git LFS files, so if any turn up the repo is cloned after all.
+    """
+    assert not (
+        include_paths is not None and exclude_paths is not None
+    ), "Only one of include and exclude paths can be specified"
+
+    if fetch_mode == RepoFetchMode.Archive:
+        written = _fetch_files_from_git_repo(
+            repo_owner, repo_name, local_dest_path, include_paths, exclude_paths
+        )
+    elif fetch_mode == RepoFetchMode.Mirror:
+        # Imported here as the mirror cache builds on this module
+        from argonaut.misc.mirror_cache import get_mirror_cache
+
+        written = get_mirror_cache().copy_files(
+            repo_owner, repo_name, local_dest_path, include_paths, exclude_paths
+        )
+    else:
+        _clone_files_from_git_repo(
+            repo_owner, repo_name, local_dest_path, include_paths, exclude_paths
+        )
+        return
+
+    if _has_lfs_pointers(local_dest_path, written):
+        create_default_logger(__name__).info(
+            f"{repo_owner}/{repo_name} uses Git LFS, cloning it instead"
+        )
+        _clone_files_from_git_repo(
+            repo_owner, repo_name, local_dest_path, include_paths, exclude_paths
+        )
+
+
+def _warn_if_cannot_encrypt_secrets() -> None:
+    if not can_encrypt_secrets():
+        create_default_logger(__name__).warning(
+            "PyNaCl is not installed so secrets are set through the Github CLI, "
+            "which is much slower. Install the plugin requirements to fix this."
+        )
+
+
+def _set_github_secret(
+    repo_owner: str, repo_name: str, secret_name: str, secret_value: str
 ) -> None:
-    try:
+    if can_encrypt_secrets():
+        # Quoted, to store exactly what the Github CLI always has
+        get_github_client().set_secret(
+            repo_owner, repo_name, secret_name, f'"{secret_value}"'
+        )
+    else:
+        # Without PyNaCl the Github CLI has to do the encryption
         run_shell_command(
             [
                 "gh",
@@ -467,7 +666,19 @@ def add_github_secret(
                 f'"{secret_value}"',
             ],
         )
-    except subprocess.CalledProcessError:
+
+
+def add_github_secret(
+    repo_owner: str,
+    repo_name: str,
+    secret_name: str,
+    secret_value: str,
+    show_error_window: bool = True,
+) -> None:
+    _warn_if_cannot_encrypt_secrets()
+    try:
+        _set_github_secret(repo_owner, repo_name, secret_name, secret_value)
+    except (GithubApiError, OSError, subprocess.CalledProcessError):
         if show_error_window:
             show_error(
                 f'Failed to add secret to repo "{repo_owner}/{repo_name}"',
@@ -475,24 +686,56 @@ def add_github_secret(
             )
 
 
+def add_github_secrets(
+    repo_owner: str,
+    repo_name: str,
+    secrets: dict[str, str],
+    show_error_window: bool = True,
+    max_workers: int = GITHUB_API_MAX_CONNECTIONS,
+) -> list[str]:
+    """
+    Add every secret in secrets (name -> value) to the repo, up to max_workers
+    at once, and return the names of any that failed.
+
+    All of the secrets are attempted and the failures are reported together.
+    """
+    _warn_if_cannot_encrypt_secrets()
+    if can_encrypt_secrets():
+        # Created up front so the threads all share one client. If it can't be,
+        # every secret fails below and is reported.
+        with suppress(OSError, subprocess.CalledProcessError):
+            get_github_client()
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _set_github_secret, repo_owner, repo_name, secret_name, secret_value
+            ): secret_name
+            for secret_name, secret_value in secrets.items()
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (GithubApiError, OSError, subprocess.CalledProcessError) as e:
+                failures[futures[future]] = e
+
+    failed = sorted(failures)
+    if failed and show_error_window:
+        show_error(
+            f'Failed to add {len(failed)} secrets to repo "{repo_owner}/{repo_name}"'
+            ":\n" + "\n".join(f"{x}: {failures[x]}" for x in failed),
+            "Adding repo secrets failed",
+        )
+    return failed
+
+
 def set_github_pages_source_to_actions(
     repo_owner: str, repo_name: str, show_error_window: bool = True
 ) -> None:
     try:
-        for method in ["POST", "PUT"]:
-            run_shell_command(
-                [
-                    "gh",
-                    "api",
-                    "--method",
-                    method,
-                    f"/repos/{repo_owner}/{repo_name}/pages",
-                    "-f",
-                    "build_type=workflow",
-                ],
-            )
-
-    except subprocess.CalledProcessError:
+        get_github_client().set_pages_build_type(repo_owner, repo_name, "workflow")
+    except (GithubApiError, OSError, subprocess.CalledProcessError):
         if show_error_window:
             show_error(
                 "Failed to change Github pages source for repo "
@@ -0,0 +1,280 @@
+# Standard imports
+import base64
+import http.client
+import json
+import queue
+import ssl
+import threading
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Iterator, Optional
+from urllib.parse import quote, urlsplit
+
+# Third party imports
+try:
+    from nacl import encoding, public
+except ImportError:
+    # Secrets can still be set through the Github CLI
+    public = None
+
+# Local imports
+from argonaut.config.config import (
+    GITHUB_API_MAX_CONNECTIONS,
+    GITHUB_API_TIMEOUT_S,
+)
+from argonaut.logger.logger import create_default_logger
+
+GITHUB_API_VERSION = "2022-11-28"
+
+
+class GithubApiError(Exception):
+    def __init__(self, method: str, path: str, status: int, message: str):
+        super().__init__(f"{method} {path} failed with {status}: {message}")
+        self.status = status
+
+
+@dataclass(frozen=True)
+class GithubHost:
+    host: str = "api.github.com"
+    port: Optional[int] = None
+    use_tls: bool = True
+    # e.g. "/api/v3" for Github Enterprise
+    base_path: str = ""
+
+    @classmethod
+    def from_url(cls, url: str) -> "GithubHost":
+        # e.g. https://api.github.com or http://localhost:8080 for a stub server
+        parts = urlsplit(url)
+        return cls(
+            host=parts.hostname,
+            port=parts.port,
+            use_tls=parts.scheme == "https",
+            base_path=parts.path.rstrip("/"),
+        )
+
+    def connect(
+        self, timeout_s: float, ssl_context: Optional[ssl.SSLContext] = None
+    ) -> http.client.HTTPConnection:
+        if self.use_tls:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=timeout_s, context=ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout_s)
+
+
+def can_encrypt_secrets() -> bool:
+    return public is not None
+
+
+class GithubClient:
+    """
+    Github REST API client that keeps its connections open between requests.
+
+    Up to max_connections keep-alive connections are pooled, so requests made
+    one after another reuse the same TLS session and requests from several
+    threads at once each get their own connection.
+    """
+
+    def __init__(
+        self,
+        host: GithubHost,
+        token: str,
+        max_connections: int = GITHUB_API_MAX_CONNECTIONS,
+        timeout_s: float = GITHUB_API_TIMEOUT_S,
+    ):
+        self.host = host
+        self.timeout_s = timeout_s
+        self.logger = create_default_logger(__name__)
+        self._headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"Bearer {token}",
+            "User-Agent": "argonaut",
+            "X-GitHub-Api-Version": GITHUB_API_VERSION,
+        }
+        self._ssl_context = ssl.create_default_context() if host.use_tls else None
+        self._idle_connections: "queue.LifoQueue[http.client.HTTPConnection]" = (
+            queue.LifoQueue()
+        )
+        self._connection_slots = threading.BoundedSemaphore(max_connections)
+        # Repo -> (key ID, key) for encrypting secrets
+        self._public_keys: dict[str, tuple[str, str]] = {}
+        self._public_keys_lock = threading.Lock()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @contextmanager
+    def _connection(self) -> Iterator[tuple[http.client.HTTPConnection, bool]]:
+        # Yields the connection and whether it has been used before
+        with self._connection_slots:
+            try:
+                connection = self._idle_connections.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self.host.connect(self.timeout_s, self._ssl_context)
+                reused = False
+
+            try:
+                yield connection, reused
+            except BaseException:
+                connection.close()
+                raise
+            self._idle_connections.put(connection)
+
+    def _send(
+        self,
+        connection: http.client.HTTPConnection,
+        reused: bool,
+        method: str,
+        path: str,
+        payload: Optional[bytes] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> http.client.HTTPResponse:
+        if headers is None:
+            headers = self._headers
+        try:
+            connection.request(method, self.host.base_path + path, payload, headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError):
+            if not reused:
+                raise
+            # Github closes idle keep-alive connections, so try once more on
+            # a fresh one
+            self.logger.debug("Reconnecting to Github")
+            connection.close()
+            connection.request(method, self.host.base_path + path, payload, headers)
+            response = connection.getresponse()
+        self.logger.debug(f"{method} {path}: {response.status}")
+        return response
+
+    @staticmethod
+    def _raise_for_status(
+        method: str, path: str, response: http.client.HTTPResponse, data: bytes
+    ) -> None:
+        if response.status >= 400:
+            try:
+                message = json.loads(data)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = data.decode(errors="replace")
+            raise GithubApiError(method, path, response.status, message)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> Any:
+        """
+        Make a request and return the decoded JSON response, or None if there
+        isn't one. Raises GithubApiError for any error status.
+        """
+        headers = dict(self._headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        with self._connection() as (connection, reused):
+            response = self._send(connection, reused, method, path, payload, headers)
+            data = response.read()
+
+        self._raise_for_status(method, path, response, data)
+        return json.loads(data) if data else None
+
+    @contextmanager
+    def open_tarball(
+        self, repo_owner: str, repo_name: str, ref: str = ""
+    ) -> Iterator[BinaryIO]:
+        """
+        Stream a gzipped tarball of the repo at ref, or its default branch, as it
+        downloads. Every path in it is under one top level folder.
+        """
+        path = f"/repos/{repo_owner}/{repo_name}/tarball"
+        if ref:
+            path += f"/{quote(ref)}"
+
+        with self._connection() as (connection, reused):
+            response = self._send(connection, reused, "GET", path)
+            if response.status == 200:
+                # Served directly, which ties up the connection until it's read
+                yield response
+                response.read()
+                return
+            data = response.read()
+        self._raise_for_status("GET", path, response, data)
+
+        # Github redirects to a signed download link on another host, which
+        # mustn't be sent the token
+        location = response.getheader("Location")
+        assert response.status in (301, 302, 307) and location, (
+            f"Unexpected {response.status} response for {path}"
+        )
+        with urllib.request.urlopen(
+            location, timeout=self.timeout_s, context=self._ssl_context
+        ) as download:
+            yield download
+
+    def repo_exists(self, repo_owner: str, repo_name: str) -> bool:
+        try:
+            self.request("GET", f"/repos/{repo_owner}/{repo_name}")
+            return True
+        except GithubApiError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    def get_current_user(self) -> str:
+        return self.request("GET", "/user")["login"]
+
+    def create_repo(self, repo_owner: Optional[str], repo_name: str) -> None:
+        # Without an owner, or if the owner is the current user, the repo goes in
+        # the user's account, otherwise the owner is an organisation
+        path = "/user/repos"
+        # Github logins are case insensitive
+        if (
+            repo_owner is not None
+            and repo_owner.lower() != self.get_current_user().lower()
+        ):
+            path = f"/orgs/{repo_owner}/repos"
+        self.request("POST", path, {"name": repo_name, "private": False})
+
+    def _get_public_key(self, repo_owner: str, repo_name: str) -> tuple[str, str]:
+        # Locked so that secrets set from several threads only fetch it once
+        repo = f"{repo_owner}/{repo_name}"
+        with self._public_keys_lock:
+            if repo not in self._public_keys:
+                response = self.request(
+                    "GET", f"/repos/{repo}/actions/secrets/public-key"
+                )
+                self._public_keys[repo] = (response["key_id"], response["key"])
+            return self._public_keys[repo]
+
+    def set_secret(
+        self, repo_owner: str, repo_name: str, secret_name: str, secret_value: str
+    ) -> None:
+        assert can_encrypt_secrets(), "PyNaCl is needed to encrypt secrets"
+        key_id, key = self._get_public_key(repo_owner, repo_name)
+        sealed_box = public.SealedBox(
+            public.PublicKey(key.encode(), encoding.Base64Encoder())
+        )
+        encrypted_value = sealed_box.encrypt(secret_value.encode())
+        self.request(
+            "PUT",
+            f"/repos/{repo_owner}/{repo_name}/actions/secrets/{quote(secret_name)}",
+            {
+                "encrypted_value": base64.b64encode(encrypted_value).decode(),
+                "key_id": key_id,
+            },
+        )
+
+    def set_pages_build_type(
+        self, repo_owner: str, repo_name: str, build_type: str
+    ) -> None:
+        path = f"/repos/{repo_owner}/{repo_name}/pages"
+        try:
+            self.request("POST", path, {"build_type": build_type})
+        except GithubApiError as e:
+            # Pages is already enabled, so just update it
+            if e.status != 409:
+                raise
+        self.request("PUT", path, {"build_type": build_type})
@@ -0,0 +1,276 @@
+# Standard imports
+import os
+import subprocess
+import tarfile
+import time
+from contextlib import suppress
+from pathlib import Path
+from typing import Optional
+
+# Third party imports
+
+# Local imports
+from argonaut.config.config import (
+    MIRROR_CACHE_MAX_SIZE_MB,
+    MIRROR_CACHE_TTL_S,
+    MIRROR_LOCK_TIMEOUT_S,
+)
+from argonaut.gui.dialog import show_error
+from argonaut.logger.logger import create_default_logger
+from argonaut.misc.git import extract_repo_tarball, run_shell_command
+from argonaut.misc.os import (
+    FileLock,
+    OSType,
+    delete_folder,
+    get_cache_dir_path,
+    get_os_type,
+)
+
+# Marker files kept inside each mirror, only their modification times matter
+LAST_FETCHED_FILE_NAME = "argonaut_last_fetched"
+LAST_USED_FILE_NAME = "argonaut_last_used"
+
+
+class MirrorCache:
+    """
+    Bare mirrors of Github repos, kept between sessions so copying files out of
+    a repo only needs the network for an incremental fetch, at most once per
+    TTL.
+
+    Once the cache is bigger than max_size_mb the least recently used mirrors
+    are deleted. Each mirror has a lock file next to it, so one session never
+    fetches into or deletes a mirror another session is using.
+    """
+
+    def __init__(
+        self,
+        cache_path: Optional[Path] = None,
+        ttl_s: float = MIRROR_CACHE_TTL_S,
+        max_size_mb: float = MIRROR_CACHE_MAX_SIZE_MB,
+    ):
+        if cache_path is None:
+            cache_path = get_cache_dir_path() / "mirrors"
+        self.cache_path = cache_path
+        self.ttl_s = ttl_s
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.logger = create_default_logger(__name__)
+
+    def get_mirror_path(self, repo_owner: str, repo_name: str) -> Path:
+        return self.cache_path / repo_owner / f"{repo_name}.git"
+
+    def _get_lock(self, mirror_path: Path, timeout_s: float) -> FileLock:
+        # Next to the mirror rather than in it, so deleting it doesn't race
+        return FileLock(mirror_path.with_name(f"{mirror_path.name}.lock"), timeout_s)
+
+    def _acquire(self, repo_owner: str, repo_name: str) -> FileLock:
+        lock = self._get_lock(
+            self.get_mirror_path(repo_owner, repo_name), MIRROR_LOCK_TIMEOUT_S
+        )
+        if not lock.acquire():
+            show_error(
+                f"The mirror of {repo_owner}/{repo_name} is in use by another "
+                "session. Please try again once it has finished",
+                "Mirror in use",
+            )
+        return lock
+
+    def get_mirror(
+        self, repo_owner: str, repo_name: str, force_fetch: bool = False
+    ) -> Path:
+        """
+        Return the path of an up to date mirror of the repo, cloning it if it
+        isn't cached and fetching if it's older than the TTL or force_fetch.
+        """
+        lock = self._acquire(repo_owner, repo_name)
+        try:
+            mirror_path = self._update_mirror(repo_owner, repo_name, force_fetch)
+        finally:
+            lock.release()
+        self.evict(keep=mirror_path)
+        return mirror_path
+
+    def _update_mirror(
+        self, repo_owner: str, repo_name: str, force_fetch: bool
+    ) -> Path:
+        # Must hold the mirror's lock
+        mirror_path = self.get_mirror_path(repo_owner, repo_name)
+        last_fetched_path = mirror_path / LAST_FETCHED_FILE_NAME
+
+        if not last_fetched_path.exists():
+            # Missing, or a clone that never finished
+            if mirror_path.exists():
+                delete_folder(mirror_path)
+            mirror_path.parent.mkdir(exist_ok=True, parents=True)
+            self.logger.info(f"Mirroring {repo_owner}/{repo_name} to {mirror_path}")
+            try:
+                run_shell_command(
+                    [
+                        "gh",
+                        "repo",
+                        "clone",
+                        f"{repo_owner}/{repo_name}",
+                        f"{mirror_path.absolute()}",
+                        "--",
+                        "--mirror",
+                    ]
+                )
+            except subprocess.CalledProcessError:
+                show_error(
+                    f'Failed to mirror repo "{repo_owner}/{repo_name}" to '
+                    f'"{mirror_path.absolute()}"',
+                    "Git clone failed",
+                )
+            last_fetched_path.touch()
+
+        elif force_fetch or self._is_stale(last_fetched_path):
+            self.logger.info(f"Fetching {repo_owner}/{repo_name}")
+            try:
+                run_shell_command(
+                    ["git", "-C", f"{mirror_path}", "fetch", "--prune", "origin"]
+                )
+                last_fetched_path.touch()
+            except subprocess.CalledProcessError:
+                # e.g. offline, the last fetch is better than nothing
+                self.logger.warning(
+                    f"Failed to fetch {repo_owner}/{repo_name}, using the mirror "
+                    "from the last fetch"
+                )
+
+        (mirror_path / LAST_USED_FILE_NAME).touch()
+        return mirror_path
+
+    def _is_stale(self, path: Path) -> bool:
+        return time.time() - path.stat().st_mtime > self.ttl_s
+
+    def copy_files(
+        self,
+        repo_owner: str,
+        repo_name: str,
+        local_dest_path: Path,
+        include_paths: Optional[list[Path]] = None,
+        exclude_paths: Optional[list[Path]] = None,
+        force_fetch: bool = False,
+    ) -> list[Path]:
+        """
+        Write the files at the tip of the repo's default branch into
+        local_dest_path, straight out of the mirror with git archive.
+        """
+        # Held until git has finished reading the mirror
+        lock = self._acquire(repo_owner, repo_name)
+        try:
+            mirror_path = self._update_mirror(repo_owner, repo_name, force_fetch)
+            written, error, returncode = self._archive(
+                mirror_path, repo_name, local_dest_path, include_paths, exclude_paths
+            )
+        finally:
+            lock.release()
+        self.evict(keep=mirror_path)
+
+        if written is None or returncode != 0:
+            show_error(
+                f'Failed to copy files from repo "{repo_owner}/{repo_name}": '
+                f"{error.decode(errors='replace').strip()}",
+                "Git archive failed",
+            )
+        return written
+
+    def _archive(
+        self,
+        mirror_path: Path,
+        repo_name: str,
+        local_dest_path: Path,
+        include_paths: Optional[list[Path]],
+        exclude_paths: Optional[list[Path]],
+    ) -> tuple[Optional[list[Path]], bytes, int]:
+        # Returns the files written, or None if the archive couldn't be read,
+        # along with git's stderr and return code
+
+        # Include paths are passed on so git only archives those
+        command = [
+            "git",
+            "-C",
+            f"{mirror_path}",
+            "archive",
+            "--format=tar",
+            f"--prefix={repo_name}/",
+            "HEAD",
+        ]
+        if include_paths is not None:
+            command += ["--"] + [x.as_posix() for x in include_paths]
+
+        creationflags = 0
+        if get_os_type() == OSType.Windows:
+            creationflags = subprocess.CREATE_NO_WINDOW
+        archive_process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=creationflags,
+        )
+        written = None
+        with archive_process:
+            # An include path that isn't in the repo means git writes nothing
+            # and explains why on stderr
+            with suppress(tarfile.TarError):
+                written = extract_repo_tarball(
+                    archive_process.stdout,
+                    local_dest_path,
+                    include_paths,
+                    exclude_paths,
+                    mode="r|",
+                )
+            if written is None:
+                # Nothing more is wanted, and git could be blocked writing the
+                # rest of the archive
+                archive_process.kill()
+            # Reads whatever is left of both pipes together, so neither can
+            # fill up and leave git waiting on us
+            _, error = archive_process.communicate()
+
+        return written, error, archive_process.returncode
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        # Least recently used first, never the one about to be used
+        mirrors = []
+        total_size = 0
+        for mirror_path in self.cache_path.glob("*/*.git"):
+            size = _get_folder_size(mirror_path)
+            total_size += size
+            last_used_path = mirror_path / LAST_USED_FILE_NAME
+            last_used = (
+                last_used_path.stat().st_mtime if last_used_path.exists() else 0
+            )
+            if mirror_path != keep:
+                mirrors.append((last_used, size, mirror_path))
+
+        for _, size, mirror_path in sorted(mirrors):
+            if total_size <= self.max_size_bytes:
+                break
+            # A mirror another session is using is skipped rather than waited on
+            lock = self._get_lock(mirror_path, 0)
+            if not lock.acquire():
+                continue
+            try:
+                self.logger.info(f"Evicting {mirror_path} from the mirror cache")
+                delete_folder(mirror_path)
+                total_size -= size
+            finally:
+                lock.release()
+
+
+def _get_folder_size(path: Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, x))
+        for root, _, files in os.walk(path)
+        for x in files
+    )
+
+
+_mirror_cache: Optional[MirrorCache] = None
+
+
+def get_mirror_cache() -> MirrorCache:
+    global _mirror_cache
+    if _mirror_cache is None:
+        _mirror_cache = MirrorCache()
+    return _mirror_cache
@@ -3,14 +3,23 @@ import os
 import platform
 import shutil
 import stat
+import time
 from enum import Enum, auto
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Optional, TextIO
+
+try:
+    import msvcrt
+except ImportError:
+    # Not Windows
+    import fcntl
+
+    msvcrt = None
 
 # Third party imports
 
 # Local imports
-from argonaut.config.config import TEMP_FOLDER_NAME
+from argonaut.config.config import CACHE_FOLDER_NAME, TEMP_FOLDER_NAME
 
 
 class OSType(Enum):
@@ -57,6 +66,19 @@ def get_temp_dir_path(create_folder: bool = True) -> Path:
     return temp_directory
 
 
+def get_cache_dir_path(create_folder: bool = True) -> Path:
+    # Outside the temp folder, so it survives that being deleted on startup
+    if get_os_type() == OSType.Windows:
+        cache_directory = Path.home() / "AppData" / "Local" / CACHE_FOLDER_NAME
+    else:
+        # Unknown OS
+        raise NotImplementedError
+
+    if create_folder:
+        cache_directory.mkdir(exist_ok=True, parents=True)
+    return cache_directory
+
+
 def delete_folder(repo_path: Path) -> None:
     def overwrite_permissions(func: Callable, path: Path, *args, **kwargs) -> None:
         # Need to overwrite permission for the .git folder
@@ -95,3 +117,58 @@ def copy_into(src: Path, dst: Path) -> Path:
             shutil.copy2(item, target)
 
     return dst
+
+
+class FileLock:
+    """
+    Exclusive lock on a file, shared between processes.
+
+    The lock is held by the OS for as long as the file is open, so it is
+    released even if the process holding it dies without unlocking.
+    """
+
+    def __init__(self, path: Path, timeout_s: float):
+        self.path = path
+        self.timeout_s = timeout_s
+        self._file: Optional[TextIO] = None
+
+    def acquire(self) -> bool:
+        # Returns whether the lock was acquired before the timeout
+        assert self._file is None, f"{self.path} is already locked"
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        lock_file = open(self.path, "a+")
+        deadline = time.monotonic() + self.timeout_s
+        while True:
+            try:
+                _lock_file(lock_file)
+                self._file = lock_file
+                return True
+            except OSError:
+                if time.monotonic() > deadline:
+                    lock_file.close()
+                    return False
+                time.sleep(0.1)
+
+    def release(self) -> None:
+        if self._file is not None:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+
+
+def _lock_file(file: TextIO) -> None:
+    # Raises OSError if it's already locked
+    if msvcrt is not None:
+        # Locks the first byte, which doesn't have to exist
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock_file(file: TextIO) -> None:
+    if msvcrt is not None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -8,7 +8,8 @@ import json
 # Local imports
 from argonaut.tracker.project_tracker import ProjectTracker
 from argonaut.misc.git import (
-    add_github_secret,
+    RepoFetchMode,
+    add_github_secrets,
     copy_files_from_git_repo,
     generate_github_pages_url,
     generate_github_repo_url,
@@ -51,6 +52,7 @@ def init_pcb_folder(
         KICAD_TEMPLATE_REPO_NAME,
         local_path,
         exclude_paths=[Path("README.md")],
+        fetch_mode=RepoFetchMode.Mirror,
     )
 
     # Rename files
@@ -74,12 +76,12 @@ def init_pcb_folder(
         KICAD_RELEASER_REPO_NAME,
         local_path,
         include_paths=[Path("github")],
+        fetch_mode=RepoFetchMode.Mirror,
     )
     (local_path / "github").rename(local_path / ".github")
 
     # Copy secrets over
-    for secret_name, secret_value in REPO_SECRETS.items():
-        add_github_secret(repo_owner, repo_name, secret_name, secret_value)
+    add_github_secrets(repo_owner, repo_name, REPO_SECRETS)
 
     # Enable workflow as Github pages source
     set_github_pages_source_to_actions(repo_owner, repo_name)
@@ -2,43 +2,126 @@
 from dataclasses import dataclass
 from pathlib import Path
 import json
+import subprocess
 
 # Third party imports
 
 # Local imports
+from argonaut.config.config import TRACKER_LOCK_TIMEOUT_S
 from argonaut.gui.dialog import show_error
-from argonaut.misc.os import delete_folder, get_temp_dir_path
+from argonaut.misc.os import FileLock, delete_folder, get_cache_dir_path
 from argonaut.logger.logger import create_default_logger
-from argonaut.misc.git import git_clone
+from argonaut.misc.git import git_clone, run_shell_command
 
 
 @dataclass
 class Tracker:
+    """
+    Project tracking repo, kept as a working copy between sessions.
+
+    Entering the tracker locks the working copy and brings it level with the
+    remote, which only needs a fetch once it has been cloned. Leaving it unlocks
+    the working copy but keeps it for next time.
+    """
+
     project_repo_owner: str
     project_repo_name: str
     relative_json_path: Path
 
     def __post_init__(self):
         self.logger = create_default_logger(__name__)
+        self.local_clone_path = (
+            get_cache_dir_path()
+            / "trackers"
+            / self.project_repo_owner
+            / self.project_repo_name
+        )
+        self.lock = FileLock(
+            self.local_clone_path.with_name(f"{self.project_repo_name}.lock"),
+            TRACKER_LOCK_TIMEOUT_S,
+        )
 
     def __enter__(self):
-        self.local_clone_path = self.clone_project_repo()
-        self.project_json = self.load_project_json()
+        if not self.lock.acquire():
+            show_error(
+                f"{self.project_repo_owner}/{self.project_repo_name} is in use by "
+                "another session. Please try again once it has finished",
+                "Tracker in use",
+            )
+        try:
+            self.update_project_repo()
+            self.project_json = self.load_project_json()
+        except BaseException:
+            # __exit__ isn't called if __enter__ fails
+            self.lock.release()
+            raise
         return self
 
     def __exit__(self, *args, **kwargs):
-        if self.local_clone_path is not None:
-            self.logger.debug(f"Deleting temp file: {self.local_clone_path.absolute()}")
+        self.lock.release()
+
+    def update_project_repo(self) -> None:
+        # Without its .git, git would find any repo the cache happens to be in
+        if (self.local_clone_path / ".git").exists():
+            try:
+                self.reset_project_repo()
+                return
+            except subprocess.CalledProcessError:
+                self.logger.warning(
+                    f"Failed to update {self.local_clone_path.absolute()}, recloning"
+                )
+        # Start again from a fresh clone
+        if self.local_clone_path.exists():
             delete_folder(self.local_clone_path)
+        self.clone_project_repo()
 
-    def clone_project_repo(self) -> Path:
-        local_clone_path = get_temp_dir_path() / self.project_repo_name
+    def reset_project_repo(self) -> None:
+        # Anything left by the last session, committed or not, is thrown away
+        self.logger.info(
+            f"Updating {self.project_repo_owner}/{self.project_repo_name} in "
+            f"{self.local_clone_path.absolute()}"
+        )
+        git_command = ["git", "-C", f"{self.local_clone_path}"]
+        branch = run_shell_command(
+            git_command + ["rev-parse", "--abbrev-ref", "HEAD"]
+        ).strip()
+        run_shell_command(git_command + ["fetch", "--prune", "origin"])
+        run_shell_command(git_command + ["reset", "--hard", f"origin/{branch}"])
+        # Twice forced so submodules cloned into it are removed too
+        run_shell_command(git_command + ["clean", "-ffdx"])
+        self.forget_submodules()
+
+    def forget_submodules(self) -> None:
+        # A submodule add that never got pushed leaves its repo in .git/modules
+        # and its settings in .git/config, so adding the same path again fails.
+        # Submodules are never checked out here, so every one of them can go
+        git_command = ["git", "-C", f"{self.local_clone_path}"]
+        run_shell_command(git_command + ["submodule", "deinit", "--all", "--force"])
+        modules_path = self.local_clone_path / ".git" / "modules"
+        if modules_path.exists():
+            delete_folder(modules_path)
+
+        config = run_shell_command(git_command + ["config", "--local", "--list"])
+        # Keys are submodule.<name>.<setting>, where the name can contain dots
+        names = {
+            x.split("=", 1)[0][len("submodule.") :].rsplit(".", 1)[0]
+            for x in config.splitlines()
+            if x.startswith("submodule.")
+        }
+        for name in names:
+            run_shell_command(
+                git_command
+                + ["config", "--local", "--remove-section", f"submodule.{name}"]
+            )
+
+    def clone_project_repo(self) -> None:
         self.logger.info(
             f"Cloning {self.project_repo_owner}/{self.project_repo_name} to "
-            f"{local_clone_path.absolute()}"
+            f"{self.local_clone_path.absolute()}"
+        )
+        git_clone(
+            self.project_repo_owner, self.project_repo_name, self.local_clone_path
         )
-        git_clone(self.project_repo_owner, self.project_repo_name, local_clone_path)
-        return local_clone_path
 
     def load_project_json(self) -> dict:
         assert self.local_clone_path is not None
@@ -0,0 +1,223 @@
+# Standard imports
+import gzip
+import io
+import json
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+# Third party imports
+import pytest
+
+# Local imports
+from argonaut.misc.github_api import GithubApiError, GithubClient, GithubHost
+
+
+def make_tarball(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(f"M0WUT-repo-abc123/{name}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return gzip.compress(buffer.getvalue())
+
+
+TARBALL = make_tarball({"README.md": b"Hello"})
+
+
+class StubGithub(BaseHTTPRequestHandler):
+    """
+    Just enough of the Github REST API for the client, recording every request
+    and the connection it came in on.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(
+        self,
+        status: int,
+        body: Any = None,
+        headers: Optional[dict[str, str]] = None,
+    ):
+        # Bytes are sent as they are, anything else as JSON
+        if body is None:
+            data = b""
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append(
+            (self.command, self.path, body, self.headers.get("Authorization"))
+        )
+        self.server.connections.add(self.client_address)
+
+        if self.path == "/user":
+            self.send(200, {"login": "M0WUT"})
+        elif self.path == "/repos/M0WUT/missing":
+            self.send(404, {"message": "Not Found"})
+        elif self.path == "/repos/M0WUT/broken":
+            self.send(500, b"Oops")
+        elif self.path.startswith("/repos/M0WUT/") and self.path.endswith("/pages"):
+            if self.command == "POST" and self.path == "/repos/M0WUT/live/pages":
+                self.send(409, {"message": "Pages already enabled"})
+            elif self.command == "PUT":
+                self.send(204)
+            else:
+                self.send(201, {})
+        elif self.path == "/repos/M0WUT/direct/tarball":
+            self.send(200, TARBALL)
+        elif self.path == "/repos/M0WUT/redirected/tarball":
+            self.send(302, headers={"Location": self.server.url + "/download"})
+        elif self.path == "/download":
+            self.send(200, TARBALL)
+        elif self.path == "/hang-up":
+            self.send(200, {}, {"Connection": "close"})
+            self.close_connection = True
+        elif self.command == "GET":
+            self.send(200, {"path": self.path})
+        else:
+            self.send(201, {})
+
+    do_GET = do_POST = do_PUT = handle_request
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGithub)
+    server.requests = []
+    server.connections = set()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = GithubClient(GithubHost.from_url(server.url), "secret-token")
+    yield client
+    client.close()
+
+
+def read_tarball(tarball) -> dict[str, bytes]:
+    with tarfile.open(fileobj=tarball, mode="r|gz") as archive:
+        return {x.name: archive.extractfile(x).read() for x in archive}
+
+
+def test_host_from_url():
+    host = GithubHost.from_url("https://github.example.com/api/v3/")
+    assert host == GithubHost("github.example.com", None, True, "/api/v3")
+    assert GithubHost.from_url("http://localhost:8080") == GithubHost(
+        "localhost", 8080, False, ""
+    )
+
+
+def test_request_sends_token(server, client):
+    assert client.get_current_user() == "M0WUT"
+    assert server.requests == [("GET", "/user", None, "Bearer secret-token")]
+
+
+def test_repo_exists(client):
+    assert client.repo_exists("M0WUT", "present")
+    assert not client.repo_exists("M0WUT", "missing")
+
+
+def test_error_status_raises(client):
+    with pytest.raises(GithubApiError, match="Not Found") as error:
+        client.request("GET", "/repos/M0WUT/missing")
+    assert error.value.status == 404
+
+    # Bodies that aren't JSON are passed on as they are
+    with pytest.raises(GithubApiError, match="Oops") as error:
+        client.repo_exists("M0WUT", "broken")
+    assert error.value.status == 500
+
+
+def test_create_repo(server, client):
+    client.create_repo(None, "a")
+    # Owners are compared case insensitively, like Github logins
+    client.create_repo("m0wut", "b")
+    client.create_repo("SomeOrg", "c")
+    assert [x[:3] for x in server.requests if x[0] == "POST"] == [
+        ("POST", "/user/repos", {"name": "a", "private": False}),
+        ("POST", "/user/repos", {"name": "b", "private": False}),
+        ("POST", "/orgs/SomeOrg/repos", {"name": "c", "private": False}),
+    ]
+
+
+def test_set_pages_build_type(server, client):
+    client.set_pages_build_type("M0WUT", "new", "workflow")
+    # Pages already enabled, so it is only updated
+    client.set_pages_build_type("M0WUT", "live", "workflow")
+    assert [x[:2] for x in server.requests] == [
+        ("POST", "/repos/M0WUT/new/pages"),
+        ("PUT", "/repos/M0WUT/new/pages"),
+        ("POST", "/repos/M0WUT/live/pages"),
+        ("PUT", "/repos/M0WUT/live/pages"),
+    ]
+
+
+def test_connection_is_reused(server, client):
+    for index in range(10):
+        assert client.request("GET", f"/repos/M0WUT/{index}") == {
+            "path": f"/repos/M0WUT/{index}"
+        }
+    assert len(server.connections) == 1
+
+
+def test_reconnects_after_server_hangs_up(server, client):
+    client.request("GET", "/hang-up")
+    assert client.get_current_user() == "M0WUT"
+    assert len(server.connections) == 2
+
+
+def test_concurrent_requests_are_pooled(server):
+    client = GithubClient(GithubHost.from_url(server.url), "token", max_connections=4)
+    threads = [
+        threading.Thread(
+            target=lambda: [client.request("GET", "/repos/a/b") for _ in range(8)]
+        )
+        for _ in range(16)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+
+    assert len(server.requests) == 16 * 8
+    assert len(server.connections) <= 4
+
+
+def test_open_tarball(server, client):
+    with client.open_tarball("M0WUT", "direct") as tarball:
+        assert read_tarball(tarball) == {"M0WUT-repo-abc123/README.md": b"Hello"}
+    # The connection is free again once the tarball has been read
+    client.get_current_user()
+    assert len(server.connections) == 1
+
+
+def test_open_tarball_follows_redirect_without_token(server, client):
+    with client.open_tarball("M0WUT", "redirected") as tarball:
+        assert read_tarball(tarball) == {"M0WUT-repo-abc123/README.md": b"Hello"}
+    assert [(x[1], x[3]) for x in server.requests] == [
+        ("/repos/M0WUT/redirected/tarball", "Bearer secret-token"),
+        ("/download", None),
+    ]